@@ -0,0 +1,292 @@
+
+# ogrChunked.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# Chunked extracts for very large layers (ex. VEG_COMP_LYR_R1_POLY, RSLT_ACTIVITY_TREATMENT_SVW): instead of one long ogr2ogr -sql call,
+# the extent is split into a grid of tiles, an SDO_FILTER for each tile is added to the row's WHERE clause, and the tiles are
+# pulled at the same time into temporary GeoPackages. The tiles are then merged into the row's GPKG output, keeping one copy of
+# each keyColumn value (features crossing a tile edge come back in every tile they touch).
+# Rows are chunked with these optional ogrParams.csv columns:
+#   chunkTiles      - the grid, ex. 4x4 (or just 4 for 4x4)
+#   keyColumn       - a column that's unique for each record, used to drop duplicates when merging, ex. FEATURE_ID
+#   chunkGeomColumn - (optional) the geometry column to filter on, ex. veg.GEOMETRY. Found from the select list if it's called SHAPE, GEOMETRY or GEOM
+#   chunkExtent     - (optional) xmin,ymin,xmax,ymax to split, in the row's CRS. Default: the AOI in an SDO_ANYINTERACT(.. SDO_ORDINATE_ARRAY(..)) clause,
+#                     otherwise the BC Albers extent of the province
+
+"""HOW CHUNKED ROWS WORK:
+--------------------------------------------------------------------------------------
+1. Each tile is its own ogr2ogr job, so tiles run side by side (up to maxWorkers) and a failed tile is retried on its own
+   (chunkRetries times, default 2) instead of re-running the whole extract. Tiles take slots of the same dbConnectionCap as the rows:
+   a chunked row gives up its own slot while its tiles run, so no more than dbConnectionCap are logged in to a database at once,
+   however many rows are chunked.
+
+2. Tiles are written to a <output>_tiles folder next to the output, and finished tiles are recorded in <output>.chunks.json.
+   If a run is interrupted, or a tile still fails after its retries, the next run of the same row only pulls the missing tiles.
+   Changing the sqlQuery, grid or extent starts over. Both are deleted once the tiles are merged.
+
+3. Chunked rows need outType GPKG (a single format) and a keyColumn. With incremental rows (ogrIncremental.py), only the full runs are chunked.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+
+import ogrEngines # companion modules - must be in the same folder as this script
+import ogrScheduler
+import ogrSharedScan
+import sqlDateRewriter
+
+try:
+    from osgeo import gdal
+except ImportError: # ex. running with a Python that isn't the QGIS / OSGeo4W one
+    gdal = None
+
+bcAlbersExtent = (200000.0, 300000.0, 1900000.0, 1750000.0) # xmin, ymin, xmax, ymax of the province in EPSG:3005
+tileLayer = "tile"
+whereEndKeywords = ('GROUP', 'HAVING', 'ORDER', 'FETCH', 'OFFSET', 'FOR')
+unchunkedKeywords = ('UNION', 'INTERSECT', 'MINUS')
+
+###############################################################################################################
+# Function to read a row's chunk columns into a settings dictionary; returns None if the row isn't chunked
+def chunkSettings(paramName, chunkTiles=None, keyColumn=None, chunkGeomColumn=None, chunkExtent=None, chunkRetries=None):
+    if not chunkTiles:
+        return None
+    m = re.match(r"^\s*(\d+)\s*(?:[xX*]\s*(\d+))?\s*$", chunkTiles)
+    if not m:
+        print("\nRow '{}': chunkTiles should look like 4x4 (columns x rows), not '{}'... check your .csv\n".format(paramName, chunkTiles)), sys.exit()
+    if not keyColumn:
+        print("\nRow '{}' has chunkTiles but no keyColumn; it's needed to drop features that come back in two tiles... check your .csv\n".format(paramName)), sys.exit()
+    extent = None
+    if chunkExtent:
+        try:
+            extent = tuple(float(x) for x in chunkExtent.split(","))
+        except ValueError:
+            extent = ()
+        if len(extent) != 4:
+            print("\nRow '{}': chunkExtent should be xmin,ymin,xmax,ymax, not '{}'... check your .csv\n".format(paramName, chunkExtent)), sys.exit()
+    cols = int(m.group(1))
+    return {'cols':cols, 'rows':int(m.group(2) or cols), 'keyColumn':keyColumn.upper(), 'geomColumn':chunkGeomColumn, 'extent':extent,
+            'retries':int(chunkRetries) if chunkRetries else 2}
+
+# ex. job['chunk'] = chunkSettings('vriParams', '4x4', 'FEATURE_ID') # FUNCTION CALL
+
+###############################################################################################################
+# Function to find the extent to split: chunkExtent, else the AOI of an SDO_ANYINTERACT clause, else BC Albers
+def chunkExtentFor(sqlString, settings):
+    if settings['extent']:
+        return settings['extent'], "chunkExtent"
+    m = re.search(r"SDO_ANYINTERACT\s*\(.*?SDO_ORDINATE_ARRAY\s*\(([^)]*)\)", sqlString, re.IGNORECASE | re.DOTALL)
+    if m:
+        numbers = [float(x) for x in re.findall(r"-?\d+(?:\.\d+)?", m.group(1))]
+        if len(numbers) >= 4:
+            xs, ys = numbers[0::2], numbers[1::2]
+            return (min(xs), min(ys), max(xs), max(ys)), "SDO_ANYINTERACT area of interest"
+    return bcAlbersExtent, "BC Albers extent"
+
+def makeTiles(extent, cols, rows):
+    xmin, ymin, xmax, ymax = extent
+    width, height = (xmax - xmin) / cols, (ymax - ymin) / rows
+    return [("r{:02d}c{:02d}".format(r, c), (xmin + c * width, ymin + r * height, xmin + (c + 1) * width, ymin + (r + 1) * height))
+            for r in range(rows) for c in range(cols)]
+
+###############################################################################################################
+# Function to find the geometry column for SDO_FILTER: chunkGeomColumn, else a SHAPE / GEOMETRY / GEOM column in the select list
+def geomColumnFor(sqlString, settings):
+    if settings['geomColumn']:
+        return settings['geomColumn']
+    parsed = ogrSharedScan.parseSimpleSelect(sqlString) # FUNCTION CALL
+    for name, expression in (parsed['items'] if parsed else []):
+        if name in ogrSharedScan.geometryNames and re.match(r"^[A-Za-z_][\w$#.]*$", expression):
+            return expression
+    return None
+
+###############################################################################################################
+# Function to add a tile's SDO_FILTER to a query's top-level WHERE clause (or add a WHERE clause). Returns None if the query can't be chunked
+def tileSQL(sqlString, geomColumn, bbox, srid=3005):
+    tileFilter = ("SDO_FILTER({}, SDO_GEOMETRY(2003, {}, NULL, SDO_ELEM_INFO_ARRAY(1, 1003, 3), "
+                  "SDO_ORDINATE_ARRAY({:.3f}, {:.3f}, {:.3f}, {:.3f}))) = 'TRUE'").format(geomColumn, srid, *bbox)
+    tokens = sqlDateRewriter.tokenize(sqlString.strip().rstrip(";"))
+    depth, wherePos, endPos = 0, None, len(tokens)
+    for i, (kind, text) in enumerate(tokens):
+        upper = text.upper() if kind == 'ident' else None
+        depth += 1 if text == '(' else -1 if text == ')' else 0
+        if depth != 0:
+            continue
+        if upper in unchunkedKeywords:
+            return None
+        if upper == 'WHERE' and wherePos is None:
+            wherePos = i
+        elif upper in whereEndKeywords and i > (wherePos or 0):
+            endPos = i
+            break
+    before = "".join(t for k, t in tokens[:endPos])
+    after = "".join(t for k, t in tokens[endPos:])
+    if wherePos is None:
+        return "{}\nwhere {}\n{}".format(before.rstrip(), tileFilter, after).strip()
+    head = "".join(t for k, t in tokens[:wherePos + 1])
+    condition = "".join(t for k, t in tokens[wherePos + 1:endPos])
+    return "{} {}\nand ({})\n{}".format(head, tileFilter, condition.strip(), after).strip()
+
+###############################################################################################################
+def _ogrOption(ogrList, option):
+    return ogrList[ogrList.index(option) + 1] if option in ogrList[:-1] else None
+
+def _readSQL(sqlFile):
+    with open(sqlFile, 'r') as thing:
+        return thing.read()
+
+def resumePath(fileName):
+    return fileName + ".chunks.json"
+
+def _readResume(fileName):
+    try:
+        with open(resumePath(fileName), 'r') as thing:
+            return json.load(thing)
+    except (OSError, ValueError):
+        return None
+
+def _writeResume(fileName, resume):
+    tmpPath = resumePath(fileName) + ".tmp"
+    with open(tmpPath, 'w') as thing:
+        json.dump(resume, thing, indent=2)
+    os.replace(tmpPath, resumePath(fileName))
+
+###############################################################################################################
+# Function to build one tile's job: the row's options, written to <output>_tiles\<tile>.gpkg with the tile's SQL, staged in its own subfolder
+def makeTileJob(job, tileId, bbox, geomColumn, srid, tileDir):
+    tileStagingDir = os.path.join(job['stagingDir'], tileId) # each tile keeps its own ogr_stdout.txt / ogr_stderr.txt
+    os.makedirs(tileStagingDir, exist_ok=True)
+    tileSqlFile = os.path.join(tileStagingDir, "tile_query.sql")
+    with open(tileSqlFile, 'w') as thing:
+        thing.write(tileSQL(_readSQL(job['sqlFile']), geomColumn, bbox, srid))
+    tilePath = os.path.join(tileDir, "{}.gpkg".format(tileId))
+    ogrList = [tilePath if arg == job['fileName'] else "@{}".format(tileSqlFile) if arg == "@{}".format(job['sqlFile']) else arg for arg in job['ogrList']]
+    if '-nln' in ogrList:
+        ogrList[ogrList.index('-nln') + 1] = tileLayer
+    return dict(job, ogrList=ogrList, fileName=tilePath, sqlFile=tileSqlFile, stagingDir=tileStagingDir, paramName="{} {}".format(job['paramName'], tileId), tileId=tileId, chunk=None, gpkgFastWrite=False)
+
+###############################################################################################################
+# Function to merge the finished tiles into the row's output, then drop the extra copies of features that were in more than one tile.
+# With gpkgFastWrite, the spatial index is built after the duplicates are gone
+def mergeTiles(job, tilePaths, layerName, keyColumn):
+    if os.path.exists(job['fileName']) and '-overwrite' in job['ogrList']:
+        os.remove(job['fileName'])
+    for i, tilePath in enumerate(tilePaths):
+        options = ['-nln', layerName] + (['-append'] if i > 0 or os.path.exists(job['fileName']) else [])
+        if job.get('gpkgFastWrite'): # same fast-write profile as the row's own GPKG options; the index is built by finishGpkg() below
+            options += ['-gt', 'unlimited', '-lco', 'SPATIAL_INDEX=NO']
+        if gdal is not None:
+            gdal.UseExceptions()
+            dstDS = gdal.VectorTranslate(job['fileName'], tilePath, options=['-f', 'GPKG'] + options + [tileLayer])
+            dstDS = None
+        else:
+            launcher = job['ogrList'][:job['ogrList'].index('-a_srs')] if '-a_srs' in job['ogrList'] else ['ogr2ogr']
+            result = ogrScheduler.runOgrJob(dict(job, ogrList=launcher + ['-f', 'GPKG', job['fileName'], tilePath] + options + [tileLayer])) # FUNCTION CALL
+            if result['status'] != 'OK':
+                raise RuntimeError("Merging {} failed: {}".format(tilePath, result['stderr']))
+
+    features, duplicates = dropDuplicates(job['fileName'], layerName, keyColumn) # FUNCTION CALL
+    if job.get('gpkgFastWrite'):
+        ogrEngines.finishGpkg(job, job['fileName'], layerName) # FUNCTION CALL
+    return features, duplicates
+
+# Function to keep the first copy (lowest fid) of each keyColumn value in a GPKG layer. Returns (features left, duplicates dropped).
+# GPKG is SQLite, so the duplicates can be dropped with plain SQL (the R-tree delete trigger doesn't need any GDAL functions)
+def dropDuplicates(fileName, layerName, keyColumn):
+    conn = sqlite3.connect(fileName)
+    try:
+        before = conn.execute('SELECT COUNT(*) FROM "{}"'.format(layerName)).fetchone()[0]
+        conn.execute('DELETE FROM "{0}" WHERE "{1}" IS NOT NULL AND fid NOT IN (SELECT MIN(fid) FROM "{0}" GROUP BY "{1}")'.format(layerName, keyColumn))
+        conn.commit()
+        after = conn.execute('SELECT COUNT(*) FROM "{}"'.format(layerName)).fetchone()[0]
+    finally:
+        conn.close()
+    return after, before - after
+
+###############################################################################################################
+# Function to wrap an engine's runner so jobs with job['chunk'] settings are pulled tile by tile.
+# Tiles run on their own pool of 'maxWorkers'. Run by ogrScheduler.runJobs(), they share its per-database connection cap;
+# run on their own, they get a cap of 'dbConnectionCap'
+def getChunkedRunner(runner, maxWorkers=4, dbConnectionCap=2):
+    def runChunkedJob(job):
+        if not job.get('chunk'):
+            return runner(job)
+        settings, sqlString = job['chunk'], _readSQL(job['sqlFile'])
+        geomColumn = geomColumnFor(sqlString, settings) # FUNCTION CALL
+        if job['outType'] != "GPKG" or job.get('fanOut') or geomColumn is None or tileSQL(sqlString, geomColumn, (0, 0, 1, 1)) is None:
+            ogrScheduler.printSafe("\tJob {:>3}: can't be chunked (needs a single GPKG outType, a geometry column and no UNION); running it in one piece".format(job['n']))
+            return runner(job)
+
+        extent, extentSource = chunkExtentFor(sqlString, settings) # FUNCTION CALL
+        srid = int(re.sub(r"\D", "", _ogrOption(job['ogrList'], '-a_srs') or "3005") or 3005)
+        tiles = makeTiles(extent, settings['cols'], settings['rows']) # FUNCTION CALL
+        tileDir = job['fileName'] + "_tiles"
+        signature = hashlib.sha1(json.dumps([" ".join(sqlString.split()), extent, settings['cols'], settings['rows']]).encode('utf-8')).hexdigest()
+        resume = _readResume(job['fileName'])
+        if resume is None or resume.get('signature') != signature:
+            shutil.rmtree(tileDir, ignore_errors=True)
+            resume = {'signature':signature, 'started':datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'done':[]}
+        os.makedirs(tileDir, exist_ok=True)
+        done = set(t for t in resume['done'] if os.path.exists(os.path.join(tileDir, "{}.gpkg".format(t))))
+        ogrScheduler.printSafe("\tJob {:>3}: {} tiles over the {} ({:.0f}, {:.0f}, {:.0f}, {:.0f}); {} already done".format(
+            job['n'], len(tiles), extentSource, extent[0], extent[1], extent[2], extent[3], len(done)))
+
+        resumeLock = threading.Lock()
+        def runTile(tileJob): # records each finished tile straight away, so an interrupted run can pick up where it stopped
+            tileResult = runner(tileJob)
+            if tileResult['status'] == 'OK':
+                with resumeLock:
+                    done.add(tileJob['tileId'])
+                    resume['done'] = sorted(done)
+                    _writeResume(job['fileName'], resume)
+            return tileResult
+
+        tileJobs = [makeTileJob(job, tileId, bbox, geomColumn, srid, tileDir) for tileId, bbox in tiles if tileId not in done] # FUNCTION CALL
+        for i, tileJob in enumerate(tileJobs):
+            tileJob['n'] = i
+        _writeResume(job['fileName'], resume)
+        tileResults, attempt, seconds = [], 0, 0.0
+        while tileJobs and attempt <= settings['retries']:
+            if attempt > 0:
+                ogrScheduler.printSafe("\tJob {:>3}: retrying {} failed tile(s) (attempt {} of {})".format(job['n'], len(tileJobs), attempt, settings['retries']))
+            with ogrScheduler.releasedSlot(): # FUNCTION CALL - the tiles log in, not the row
+                tileResults = ogrScheduler.runJobs(tileJobs, maxWorkers, dbConnectionCap, runTile, ogrScheduler.currentSemaphores()) # FUNCTION CALL
+            seconds += sum(r['seconds'] for r in tileResults)
+            failed = set(r['n'] for r in tileResults if r['status'] != 'OK')
+            tileJobs = [t for t in tileJobs if t['n'] in failed]
+            attempt += 1
+
+        result = ogrScheduler.newJobResult(job) # FUNCTION CALL
+        if tileJobs:
+            result['seconds'] = seconds
+            result['stderr'] = "{} of {} tile(s) failed after {} retries: {}\nRun the script again to pull just those tiles.\n\n{}".format(
+                len(tileJobs), len(tiles), settings['retries'], ", ".join(t['tileId'] for t in tileJobs),
+                "\n".join(r['stderr'] for r in tileResults if r['status'] != 'OK'))
+            ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+            return result
+
+        try:
+            layerName = _ogrOption(job['ogrList'], '-nln') or job['outName']
+            features, duplicates = mergeTiles(job, [os.path.join(tileDir, "{}.gpkg".format(t)) for t, bbox in tiles], layerName, settings['keyColumn']) # FUNCTION CALL
+        except Exception as error:
+            result['returncode'], result['seconds'] = 1, seconds
+            result['stderr'] = "Merging the tiles failed (the tiles are kept, so the next run only re-does the merge): {}".format(error)
+            ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+            return result
+        os.remove(resumePath(job['fileName']))
+        shutil.rmtree(tileDir, ignore_errors=True)
+        result['returncode'], result['status'], result['seconds'] = 0, 'OK', seconds
+        result['stdout'] = "{} tiles merged into {}: {} feature(s), {} duplicate(s) from tile edges dropped".format(len(tiles), layerName, features, duplicates)
+        ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+        ogrScheduler.printSafe("\tJob {:>3}: {}".format(job['n'], result['stdout']))
+        return result
+
+    return runChunkedJob
+
+# ex. results = ogrScheduler.runJobs(jobs, 4, 2, getChunkedRunner(ogrEngines.getRunner("gdal"), 4, 2)) # FUNCTION CALL
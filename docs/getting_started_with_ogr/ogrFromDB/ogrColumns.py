@@ -0,0 +1,176 @@
+
+# ogrColumns.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# Expands 'select *' (and 'alias.*') in a row's sqlQuery into the table's real column list, looked up in Oracle's ALL_TAB_COLUMNS,
+# leaving out LOB columns (BLOB, CLOB, LONG ..) and ESRI annotation columns like SE_ANNO_CAD_DATA - the same column Oracle_2_Qgis.__listFields
+# has to remove by hand. These are slow to pull over OCI and mostly can't be written to GPKG / KML / GeoJSON anyway.
+# An optional keepColumns value in ogrParams.csv (ex. FIRE_NUMBER;FIRE_YEAR;FIRE_CAUSE) limits '*' to just those columns (plus the geometry).
+# Each table is only looked up once per run, however many rows use it.
+
+import re
+import threading
+
+import ogrPlanner # companion modules - must be in the same folder as this script
+import sqlDateRewriter
+
+lobTypes = ('BLOB', 'CLOB', 'NCLOB', 'BFILE', 'LONG', 'LONG RAW')
+annotationColumns = ('SE_ANNO_CAD_DATA',)
+geometryTypes = ('SDO_GEOMETRY',) # always kept, even if keepColumns doesn't list them
+fromEndKeywords = ('WHERE', 'GROUP', 'HAVING', 'ORDER', 'CONNECT', 'START', 'UNION', 'INTERSECT', 'MINUS', 'FETCH', 'FOR')
+joinKeywords = ('INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 'CROSS', 'NATURAL', 'ON', 'USING')
+
+_catalogCache = {} # {(ds, OWNER, TABLE): [(COLUMN_NAME, DATA_TYPE), ..]} for the whole run
+_catalogLock = threading.Lock()
+
+###############################################################################################################
+# Function to look up a table's (or view's) columns in ALL_TAB_COLUMNS, in column order - once per table per run.
+# 'fetch' runs a query and returns (columns, rows), like ogrPlanner.gdalFetcher() / dbapiFetcher()
+def catalogColumns(fetch, ds, owner, table):
+    key = (ds, owner.upper(), table.upper())
+    with _catalogLock:
+        if key not in _catalogCache:
+            columns, rows = fetch("SELECT COLUMN_NAME, DATA_TYPE FROM ALL_TAB_COLUMNS WHERE OWNER = '{}' AND TABLE_NAME = '{}' ORDER BY COLUMN_ID".format(key[1], key[2]))
+            _catalogCache[key] = [(str(r[0]), str(r[1]).upper()) for r in rows]
+        return _catalogCache[key]
+
+def clearCatalogCache():
+    with _catalogLock:
+        _catalogCache.clear()
+
+###############################################################################################################
+# Function to split a query into its top-level select list items and FROM tables. Returns None if it's not a plain select
+def _parseQuery(tokens):
+    depth, selectPos, fromPos, fromEnd = 0, None, None, len(tokens)
+    for i, (kind, text) in enumerate(tokens):
+        depth += 1 if text == '(' else -1 if text == ')' else 0
+        upper = text.upper() if kind == 'ident' and depth == 0 else None
+        if upper == 'SELECT' and selectPos is None:
+            selectPos = i
+        elif upper == 'FROM' and selectPos is not None and fromPos is None:
+            fromPos = i
+        elif upper in fromEndKeywords and fromPos is not None:
+            fromEnd = i
+            break
+    if selectPos is None or fromPos is None:
+        return None
+
+    items, current, depth = [], [], 0
+    for kind, text in tokens[selectPos + 1:fromPos]:
+        depth += 1 if text == '(' else -1 if text == ')' else 0
+        if text == ',' and depth == 0:
+            items.append("".join(current))
+            current = []
+        else:
+            current.append(text)
+    items.append("".join(current))
+
+    # FROM OWNER.TABLE alias [, | JOIN] OWNER.TABLE alias ON ... - the alias is optional
+    tables, expect, depth = [], 'table', 0
+    for kind, text in tokens[fromPos + 1:fromEnd]:
+        if kind in ('space', 'comment'):
+            continue
+        if text == '(':
+            if depth == 0 and expect == 'table':
+                return None # inline view / subquery in FROM
+            depth += 1
+            continue
+        if text == ')':
+            depth -= 1
+            continue
+        if depth > 0:
+            continue
+        upper = text.upper() if kind == 'ident' else text
+        if text == '@':
+            return None # database link
+        if text == ',' or upper == 'JOIN':
+            expect = 'table'
+        elif upper in joinKeywords:
+            expect = None if upper in ('ON', 'USING') else expect
+        elif expect == 'table' and kind == 'ident':
+            tables.append([text.replace('"', ''), None])
+            expect = 'alias'
+        elif expect == 'alias' and kind in ('ident', 'qident'):
+            tables[-1][1] = text.replace('"', '')
+            expect = None
+        else:
+            expect = None
+    return {'selectPos':selectPos, 'fromPos':fromPos, 'items':items, 'tables':tables}
+
+starRegex = re.compile(r"^(?:([\w$#\"]+)\.)?\*$") # * or alias.* as a select list item
+
+def hasSelectStar(sqlString):
+    parsed = _parseQuery(sqlDateRewriter.tokenize(sqlString)) # FUNCTION CALL
+    return parsed is not None and any(starRegex.match(item.strip()) for item in parsed['items'])
+
+def _quoted(name):
+    return name if re.match(r"^[A-Z][A-Z0-9_$#]*$", name) else '"{}"'.format(name)
+
+###############################################################################################################
+# Function to expand * / alias.* in a query into the tables' column lists, without LOB / annotation columns.
+# keepColumns (ex. "FIRE_NUMBER;FIRE_YEAR") limits the expansion to those columns plus the geometry.
+# Returns (newSQL, message); the query comes back unchanged if it has no * or a table can't be looked up
+def expandSelectStar(sqlString, fetch, ds, keepColumns=None):
+    tokens = sqlDateRewriter.tokenize(sqlString)
+    parsed = _parseQuery(tokens) # FUNCTION CALL
+    if parsed is None or not any(starRegex.match(item.strip()) for item in parsed['items']):
+        return sqlString, None
+    keepSet = set(c.strip().upper() for c in re.split(r"[;,]", keepColumns or "") if c.strip())
+
+    newItems, kept, dropped, found = [], 0, [], set()
+    for item in parsed['items']:
+        m = starRegex.match(item.strip())
+        if not m:
+            newItems.append(item)
+            continue
+        prefix = m.group(1).replace('"', '').upper() if m.group(1) else None
+        starTables = [t for t in parsed['tables'] if prefix is None or prefix in ((t[1] or "").upper(), t[0].upper(), t[0].split(".")[-1].upper())]
+        if not starTables:
+            return sqlString, "Couldn't match {} to a table in the FROM clause; select * left as written".format(item.strip())
+        columns = []
+        for table, alias in starTables:
+            if "." not in table:
+                return sqlString, "Table {} has no owner (ex. WHSE_FOREST_VEGETATION.{}); select * left as written".format(table, table)
+            owner, name = table.split(".", 1)
+            catalog = catalogColumns(fetch, ds, owner, name) # FUNCTION CALL
+            if not catalog:
+                return sqlString, "No columns found for {} in ALL_TAB_COLUMNS; select * left as written".format(table)
+            qualifier = "{}.".format(alias or table) if (prefix or len(parsed['tables']) > 1) else ""
+            for column, dataType in catalog:
+                found.add(column.upper())
+                if keepSet:
+                    keep = column.upper() in keepSet or dataType in geometryTypes
+                else:
+                    keep = dataType not in lobTypes and column.upper() not in annotationColumns
+                if keep:
+                    columns.append(qualifier + _quoted(column))
+                else:
+                    dropped.append("{} ({})".format(column, dataType))
+        kept += len(columns)
+        newItems.append(item.replace(item.strip(), ", ".join(columns), 1)) # keeps the whitespace around the *
+
+    before = "".join(t for k, t in tokens[:parsed['selectPos'] + 1])
+    after = "".join(t for k, t in tokens[parsed['fromPos']:])
+    newSQL = before + ",".join(newItems) + after
+    message = "select * expanded to {} column(s)".format(kept)
+    if dropped:
+        message += "; left out {} column(s): {}".format(len(dropped), ", ".join(dropped) if len(dropped) <= 8 else ", ".join(dropped[:8]) + " ..")
+    missing = sorted(keepSet - found)
+    if missing:
+        message += "; keepColumns not found in the table(s): {}".format(", ".join(missing))
+    return newSQL, message
+
+###############################################################################################################
+# Function to expand * against the row's own database with GDAL; the query is left as written if osgeo isn't available or the lookup fails
+def expandForSource(sqlString, ds, keepColumns=None):
+    if not hasSelectStar(sqlString): # FUNCTION CALL
+        return sqlString, None
+    if ogrPlanner.gdal is None:
+        return sqlString, "osgeo.gdal is not available in this Python, so the table's columns can't be looked up; select * left as written"
+    ogrPlanner.gdal.UseExceptions()
+    try:
+        return expandSelectStar(sqlString, ogrPlanner.gdalFetcher(ds), ds, keepColumns) # FUNCTION CALL
+    except Exception as error:
+        return sqlString, "Couldn't look up the table's columns ({}); select * left as written".format(re.sub(r"\s+", " ", str(error))[:100])
+
+# ex. sqlQuery, msg = expandForSource(sqlQuery, "OCI:user/pass@IDWPROD1:no_Table", "FIRE_NUMBER;FIRE_YEAR") # FUNCTION CALL
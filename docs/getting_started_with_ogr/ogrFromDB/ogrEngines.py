@@ -0,0 +1,457 @@
+
+# ogrEngines.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# The 'engine' is what actually runs each job built from an ogrParams.csv row:
+#   "gdal"       - in-process, using osgeo.gdal.VectorTranslate (the library behind ogr2ogr).
+#                  The source database is opened once per worker thread and reused for every row,
+#                  so rows don't each pay for process startup, driver registration and a fresh OCI login.
+#   "subprocess" - the original approach: spawn OSGeo4W / ogr2ogr.exe once per row (ogrScheduler.runOgrJob)
+# If osgeo can't be imported, the "gdal" engine falls back to "subprocess" automatically.
+
+"""NOTES ON THE GDAL ENGINE:
+--------------------------------------------------------------------------------------
+1. The same ogr2ogr options are used by both engines (-a_srs, -f, -sql, -overwrite, -nln, -lco WRITE_NAME=NO, -dsco NameField= ...).
+   They are taken from the job's ogrList, so anything added to ogrList in ogrFromBCGW() / ogrFromDB() works with either engine.
+
+2. GDAL datasets can't be shared between threads, so each worker thread keeps its own open source dataset.
+   With maxWorkers = 4 that's at most 4 logins for the whole params file, instead of one per row.
+   Call closeSources() when all jobs are finished.
+
+3. GDAL warnings and errors for each row are captured to that row's ogr_stderr.txt, like the subprocess engine.
+
+4. Rows with several outTypes (ex. GPKG;KML;GeoJSON) are 'fanned out': the row's SQL is run once, and each feature is written to
+   every format as it's read (runFanOutJob). Each format keeps its own options (-nln, -lco WRITE_NAME=NO, -dsco NameField=..),
+   and KML is reprojected to EPSG:4326 on the way. The subprocess engine does the same with one database read into a scratch
+   GeoPackage, then one local ogr2ogr per format (runFanOutSubprocessJob).
+
+5. GPKG outputs from rows with job['gpkgFastWrite'] are written in one transaction (-gt unlimited), with OGR_SQLITE_SYNCHRONOUS=OFF, OGR_SQLITE_JOURNAL=MEMORY
+   and no R-tree (-lco SPATIAL_INDEX=NO). Once the load is finished, finishGpkg() builds the R-tree in one go, then runs VACUUM and ANALYZE.
+   --config options in the ogrList are passed on to ogr2ogr.exe as they are, and set for the worker thread by the "gdal" engine.
+
+6. Coordinates are rounded to the row's coordPrec (or snapped to its snapGrid) with -xyRes, and -simplify thins vertices, see precisionOptions().
+   -xyRes needs GDAL 3.9+. The ogrList only gets it if the OSGeo4W ogr2ogr.exe is new enough (hasXyRes(), from 'ogr2ogr --version'),
+   and the "gdal" engine also leaves it out if this Python's osgeo is older; either way GeoJSON is still rounded with COORDINATE_PRECISION.
+   Fanned-out rows simplify and round each feature themselves (SimplifyPreserveTopology / SetPrecision) as it's written to each format.
+"""
+
+import math
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+import time
+
+import ogrScheduler # companion module - must be in the same folder as this script
+
+try:
+    from osgeo import gdal, ogr, osr
+except ImportError: # ex. running with a Python that isn't the QGIS / OSGeo4W one
+    gdal, ogr, osr = None, None, None
+
+_threadSources = threading.local() # one {connection string: open dataset} dictionary per worker thread
+_openSources = [] # every dataset opened by any thread, so closeSources() can release them all
+_openSourcesLock = threading.Lock()
+_gdalVersions = {} # {launcher: GDAL version number}, so 'ogr2ogr --version' is only run once per run
+
+###############################################################################################################
+# Function to return the source dataset for 'ds' (ex. "OCI:user/pass@IDWPROD1:no_Table"), opening it only the first time
+# this thread asks for it
+def getSourceDataset(ds):
+    if not hasattr(_threadSources, 'sources'):
+        _threadSources.sources = {}
+    if ds not in _threadSources.sources:
+        srcDS = gdal.OpenEx(ds, gdal.OF_VECTOR)
+        if srcDS is None:
+            raise RuntimeError("Could not open source data source: {}".format(ds.split("/")[0])) # don't print the password
+        _threadSources.sources[ds] = srcDS
+        with _openSourcesLock:
+            _openSources.append(srcDS)
+    return _threadSources.sources[ds]
+
+###############################################################################################################
+def closeSources():
+    with _openSourcesLock:
+        del _openSources[:]
+    if hasattr(_threadSources, 'sources'):
+        _threadSources.sources = {}
+
+###############################################################################################################
+# Function to split '--config KEY VALUE' options (ex. --config OGR_SQLITE_SYNCHRONOUS OFF) out of an ogr2ogr option list
+def splitConfigOptions(args):
+    options, config, i = [], {}, 0
+    while i < len(args):
+        if args[i] == '--config' and i + 2 < len(args):
+            config[args[i + 1]] = args[i + 2]
+            i += 3
+            continue
+        options.append(args[i])
+        i += 1
+    return options, config
+
+def _setThreadConfig(config, reset=False): # config options only for this worker thread, so other rows aren't affected
+    for key, value in config.items():
+        gdal.SetThreadLocalConfigOption(key, None if reset else value)
+
+###############################################################################################################
+# Function to turn a job's ogrList (OSGeo4W.bat, ogr2ogr.exe, options, destination, source) into a VectorTranslate options list.
+# -sql @file is replaced by the SQL text itself, and -progress is dropped (the scheduler reports progress instead)
+def ogrListToTranslateOptions(job):
+    args = splitConfigOptions(job['ogrList'])[0] # FUNCTION CALL - --config options are set on the thread instead
+    while args and not args[0].startswith('-'): # drop the launcher / executable part, i.e. everything before the first -option
+        args.pop(0)
+
+    options, i = [], 0
+    while i < len(args):
+        arg = args[i]
+        if arg in (job['fileName'], job['ds']) or arg == '-progress':
+            i += 1
+            continue
+        if arg == '-xyRes' and not hasXyRes(): # this Python's GDAL is older than 3.9
+            i += 2
+            continue
+        if arg == '-sql' and i + 1 < len(args) and args[i + 1].startswith('@'):
+            with open(args[i + 1][1:], 'r') as thing:
+                options += ['-sql', thing.read()]
+            i += 2
+            continue
+        options.append(arg)
+        i += 1
+    return options
+
+###############################################################################################################
+# Function to read an optional number from ogrParams.csv; blank / 'none' means not set
+def _optionalNumber(value, name):
+    if value is None or str(value).strip().upper() in ("", "NONE", "N"):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("{} should be a number, not '{}'".format(name, value))
+
+# Function to turn a row's coordPrec / snapGrid / simplify values into ogr2ogr options for one outType.
+# coordPrec is decimal places in metres (1 -> 0.1 m); snapGrid is a grid size in metres that overrides it; simplify is a tolerance in metres.
+# -xyRes rounds the written coordinates (converted to degrees by GDAL for EPSG:4326 outputs like KML); GeoJSON also gets COORDINATE_PRECISION.
+# xyRes=False (GDAL older than 3.9, see hasXyRes) leaves -xyRes out, so only GeoJSON is rounded
+def precisionOptions(outType, coordPrec=None, snapGrid=None, simplify=None, geographic=False, xyRes=True):
+    coordPrec, snapGrid, simplify = _optionalNumber(coordPrec, 'coordPrec'), _optionalNumber(snapGrid, 'snapGrid'), _optionalNumber(simplify, 'simplify')
+    options = ['-simplify', '{:g}'.format(simplify)] if simplify else []
+    grid = snapGrid if snapGrid else 10 ** -int(coordPrec) if coordPrec is not None else None
+    if grid:
+        if xyRes:
+            options += ['-xyRes', '{:g} m'.format(grid)]
+        if outType == "GeoJSON": # the GeoJSON writer's own rounding, in the output's units - degrees need ~5 more decimals than metres
+            decimals = max(0, int(math.ceil(-math.log10(grid)))) + (5 if geographic else 0)
+            options += ['-lco', 'COORDINATE_PRECISION={}'.format(decimals)]
+    return options
+
+# ex. precisionOptions("KML", 1, simplify=2) -> ['-simplify', '2', '-xyRes', '0.1 m'] # FUNCTION CALL
+
+###############################################################################################################
+# Function to return the GDAL version number (ex. 3080400 for 3.8.4) of the ogr2ogr a launcher runs (ex. [OSGeo4W.bat, ogr2ogr.exe]),
+# from 'ogr2ogr --version'. Without a launcher, or if it can't be run, this Python's osgeo.gdal is used; None if there's neither
+def gdalVersionNum(launcher=None):
+    key = tuple(launcher or [])
+    if key not in _gdalVersions:
+        version = None
+        if launcher:
+            try:
+                rc = subprocess.run(list(launcher) + ['--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+                m = re.search(r"GDAL (\d+)\.(\d+)\.(\d+)", rc.stdout)
+                version = int(m.group(1)) * 1000000 + int(m.group(2)) * 10000 + int(m.group(3)) * 100 if m else None
+            except (OSError, subprocess.SubprocessError): # ex. ogr2ogr.exe not found
+                pass
+        if version is None and gdal is not None:
+            version = int(gdal.VersionInfo())
+        _gdalVersions[key] = version
+    return _gdalVersions[key]
+
+# Function to check the launcher's (or this Python's) GDAL can use -xyRes, i.e. is 3.9 or newer
+def hasXyRes(launcher=None):
+    version = gdalVersionNum(launcher) # FUNCTION CALL
+    return version is not None and version >= 3090000
+
+# ex. hasXyRes([r"C:\Program Files\QGIS 3.34.4\OSGeo4W.bat", r"C:\Program Files\QGIS 3.34.4\bin\ogr2ogr.exe"]) # FUNCTION CALL
+
+###############################################################################################################
+# Function to make a GDAL error handler that collects this thread's warnings / errors for ogr_stderr.txt
+def _errorCollector(messages):
+    def errorHandler(errClass, errNo, msg):
+        messages.append("{} {}: {}".format({gdal.CE_Warning:'Warning', gdal.CE_Failure:'ERROR', gdal.CE_Fatal:'FATAL'}.get(errClass, 'INFO'), errNo, msg))
+    return errorHandler
+
+###############################################################################################################
+# Function to run one job in-process with gdal.VectorTranslate. Returns the same result dictionary as ogrScheduler.runOgrJob()
+def runVectorTranslateJob(job):
+    result = ogrScheduler.newJobResult(job) # FUNCTION CALL
+    messages, config = [], splitConfigOptions(job['ogrList'])[1] # FUNCTION CALL
+    start = time.time()
+    gdal.PushErrorHandler(_errorCollector(messages))
+    _setThreadConfig(config)
+    try:
+        srcDS = getSourceDataset(job['ds']) # FUNCTION CALL
+        dstDS = gdal.VectorTranslate(job['fileName'], srcDS, options=ogrListToTranslateOptions(job))
+        if dstDS is None:
+            raise RuntimeError("VectorTranslate returned no output for {}".format(job['fileName']))
+        dstDS = None # closing the output dataset flushes it to disk
+        result['returncode'], result['status'] = 0, 'OK'
+    except Exception as error:
+        result['returncode'] = 1
+        messages.append(str(error))
+    finally:
+        _setThreadConfig(config, reset=True)
+        gdal.PopErrorHandler()
+    result['seconds'] = time.time() - start
+    result['stderr'] = "\n".join(messages)
+    ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+    return result
+
+###############################################################################################################
+def _ogrOption(ogrList, option):
+    return ogrList[ogrList.index(option) + 1] if option in ogrList[:-1] else None
+
+# Function to return the part of a job's ogrList shared by every fan-out format: launcher, -a_srs, -f, output, source, -sql @file, -overwrite
+def _headList(job):
+    i = job['ogrList'].index("@{}".format(job['sqlFile'])) + 1
+    if i < len(job['ogrList']) and job['ogrList'][i] == '-overwrite':
+        i += 1
+    return job['ogrList'][:i]
+
+# Function to read one fan-out format's writer settings from its options (-nln, -lco, -dsco, -t_srs, -simplify, -xyRes)
+def _writerSettings(options):
+    settings, i = {'nln':None, 'lco':[], 'dsco':[], 't_srs':None, 'simplify':None, 'xyRes':None}, 0
+    while i < len(options) - 1:
+        key = options[i].lstrip('-')
+        if key in ('lco', 'dsco'):
+            settings[key].append(options[i + 1])
+        elif key in ('nln', 't_srs', 'simplify', 'xyRes'):
+            settings[key] = options[i + 1]
+        i += 2 if key in settings else 1
+    return settings
+
+def _srsFromUserInput(text):
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(text) # ex. 'epsg:3005'
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER) # x/y (easting/northing, lon/lat) order, like ogr2ogr
+    return srs
+
+###############################################################################################################
+# Function to create one fan-out output layer with the same fields as the source. Returns a 'writer' dictionary
+def _openWriter(spec, srcLyr, srs, overwrite):
+    settings = _writerSettings(spec['formatOptions']) # FUNCTION CALL
+    drv, dstDS = ogr.GetDriverByName(spec['outType']), None
+    layerName = settings['nln'] or srcLyr.GetName()
+    if os.path.exists(spec['fileName']):
+        if not overwrite:
+            raise RuntimeError("{} already exists and overwrite is off".format(spec['fileName']))
+        if spec['outType'] == "GPKG": # only replace this layer, like ogr2ogr -overwrite does
+            dstDS = ogr.Open(spec['fileName'], 1)
+            for i in range(dstDS.GetLayerCount()):
+                if dstDS.GetLayer(i).GetName() == layerName:
+                    dstDS.DeleteLayer(i)
+                    break
+        else:
+            drv.DeleteDataSource(spec['fileName'])
+    if dstDS is None:
+        dstDS = drv.CreateDataSource(spec['fileName'], options=settings['dsco'])
+
+    dstSRS, ct = srs, None
+    if settings['t_srs'] and srs is not None: # ex. KML, which must be in EPSG:4326
+        dstSRS = _srsFromUserInput(settings['t_srs'])
+        ct = osr.CoordinateTransformation(srs, dstSRS)
+    srcDefn = srcLyr.GetLayerDefn()
+    dstLyr = dstDS.CreateLayer(layerName, dstSRS, srcDefn.GetGeomType(), options=settings['lco'])
+    grid = float(settings['xyRes'].split()[0]) if settings['xyRes'] else None # precisionOptions() always gives -xyRes in metres
+    if grid and dstSRS is not None and dstSRS.IsGeographic():
+        grid = grid / 111320.0 # metres to degrees (at the equator, i.e. a little finer than asked for in BC)
+    fieldMap = []
+    for i in range(srcDefn.GetFieldCount()): # drivers may launder field names (ex. shapefiles), so fields are matched by position
+        dstLyr.CreateField(srcDefn.GetFieldDefn(i))
+        fieldMap.append(dstLyr.GetLayerDefn().GetFieldCount() - 1)
+    dstLyr.StartTransaction()
+    return {'spec':spec, 'ds':dstDS, 'lyr':dstLyr, 'defn':dstLyr.GetLayerDefn(), 'fieldMap':fieldMap, 'ct':ct,
+            'simplify':float(settings['simplify']) if settings['simplify'] else None, 'grid':grid}
+
+# Function to simplify, reproject and round one feature's geometry for one fan-out writer, like -simplify / -t_srs / -xyRes do in ogr2ogr
+def _writerGeometry(geom, w):
+    geom = geom.SimplifyPreserveTopology(w['simplify']) if w['simplify'] else geom.Clone()
+    if w['ct'] is not None:
+        geom.Transform(w['ct'])
+    if w['grid'] and hasattr(geom, 'SetPrecision'): # GDAL 3.9+
+        geom = geom.SetPrecision(w['grid'], 0)
+    return geom
+
+###############################################################################################################
+# Function to run a row with several outTypes in-process: the SQL is run once and each feature is written to every format as it's read
+def runFanOutJob(job):
+    result = ogrScheduler.newJobResult(job) # FUNCTION CALL
+    result['fileName'] = "; ".join(spec['fileName'] for spec in job['fanOut'])
+    messages, writers, srcDS, srcLyr = [], [], None, None
+    config = splitConfigOptions(sum([spec['formatOptions'] for spec in job['fanOut']], []))[1] # FUNCTION CALL
+    start = time.time()
+    gdal.PushErrorHandler(_errorCollector(messages))
+    _setThreadConfig(config)
+    try:
+        with open(job['sqlFile'], 'r') as thing:
+            sqlString = thing.read()
+        srcDS = getSourceDataset(job['ds']) # FUNCTION CALL
+        srcLyr = srcDS.ExecuteSQL(sqlString)
+        if srcLyr is None:
+            raise RuntimeError("The row's SQL didn't return a layer")
+        result['querySeconds'] = time.time() - start # replaced by the time to the first feature, if there is one (see ogrTelemetry.py)
+        assignedSRS = _ogrOption(job['ogrList'], '-a_srs')
+        srs = _srsFromUserInput(assignedSRS) if assignedSRS else srcLyr.GetSpatialRef() # -a_srs assigns the CRS, it doesn't reproject
+        writers = [_openWriter(spec, srcLyr, srs, '-overwrite' in job['ogrList']) for spec in job['fanOut']] # FUNCTION CALL
+
+        count = 0
+        for srcFeat in srcLyr: # one read from the database ..
+            if count == 0:
+                result['querySeconds'] = time.time() - start
+            for w in writers: # .. one write per format
+                dstFeat = ogr.Feature(w['defn'])
+                dstFeat.SetFromWithMap(srcFeat, 1, w['fieldMap'])
+                geom = srcFeat.GetGeometryRef()
+                if geom is not None and (w['ct'] is not None or w['simplify'] or w['grid']):
+                    dstFeat.SetGeometryDirectly(_writerGeometry(geom, w)) # FUNCTION CALL
+                w['lyr'].CreateFeature(dstFeat)
+            count += 1
+            if count % 100000 == 0: # commit in batches so memory stays flat
+                for w in writers:
+                    w['lyr'].CommitTransaction()
+                    w['lyr'].StartTransaction()
+        for w in writers:
+            w['lyr'].CommitTransaction()
+        result['returncode'], result['status'] = 0, 'OK'
+        result['stdout'] = "{} feature(s) read once and written to {}".format(count, ", ".join(spec['outType'] for spec in job['fanOut']))
+    except Exception as error:
+        result['returncode'] = 1
+        messages.append(str(error))
+    finally:
+        if srcLyr is not None:
+            srcDS.ReleaseResultSet(srcLyr)
+        for w in writers: # closing each output dataset flushes it to disk
+            w['lyr'], w['defn'], w['ds'] = None, None, None
+        _setThreadConfig(config, reset=True)
+        gdal.PopErrorHandler()
+    result['seconds'] = time.time() - start
+    result['stderr'] = "\n".join(messages)
+    ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+    return result
+
+###############################################################################################################
+# Function to run a row with several outTypes with ogr2ogr.exe: one database read into a scratch GeoPackage, then one local ogr2ogr per format
+def runFanOutSubprocessJob(job):
+    headList, scratchPath = _headList(job), os.path.join(job['stagingDir'], "fanout.gpkg")
+    launcher = headList[:headList.index('-a_srs')] if '-a_srs' in headList else headList[:1]
+    fetchList = [scratchPath if arg == job['fileName'] else arg for arg in headList] + ['-nln', 'fanout']
+    fetchList[fetchList.index('-f') + 1] = 'GPKG'
+    steps = [('database read', fetchList)]
+    for spec in job['fanOut']:
+        steps.append((spec['outType'], launcher + ['-f', spec['outType'], spec['fileName'], scratchPath, '-progress'] +
+                      (['-overwrite'] if '-overwrite' in headList else []) + spec['formatOptions']))
+
+    result = ogrScheduler.newJobResult(job) # FUNCTION CALL
+    result['fileName'] = "; ".join(spec['fileName'] for spec in job['fanOut'])
+    stdout, stderr = [], []
+    for label, ogrList in steps:
+        stepResult = ogrScheduler.runOgrJob(dict(job, ogrList=ogrList)) # FUNCTION CALL
+        result['seconds'] += stepResult['seconds']
+        stdout.append("--- {}\n{}".format(label, stepResult['stdout']))
+        stderr.append("--- {}\n{}".format(label, stepResult['stderr']))
+        result['returncode'] = stepResult['returncode']
+        if label == 'database read':
+            result['querySeconds'] = stepResult['seconds'] # the only step that touches the database (see ogrTelemetry.py)
+        if stepResult['status'] != 'OK':
+            break
+    else:
+        result['status'] = 'OK'
+    result['stdout'], result['stderr'] = "\n".join(stdout), "\n".join(stderr)
+    ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+    return result
+
+###############################################################################################################
+# Function to send rows with several outTypes to the fan-out runner, and every other row to the normal one
+def _withFanOut(runner, fanOutRunner):
+    def runJob(job):
+        return fanOutRunner(job) if job.get('fanOut') else runner(job)
+    return runJob
+
+###############################################################################################################
+# Function to finish a GPKG written with the fast-write options: build the R-tree left out during the load (if the layer has
+# a geometry column and no index yet), then VACUUM and ANALYZE. Uses ogrinfo.exe next to ogr2ogr.exe if osgeo isn't available
+def finishGpkg(job, fileName, layerName):
+    conn = sqlite3.connect(fileName)
+    try:
+        row = conn.execute("SELECT table_name, column_name FROM gpkg_geometry_columns WHERE lower(table_name) = lower(?)", (layerName,)).fetchone()
+        hasIndex = row is not None and conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE lower(name) = lower(?)",
+                                                    ("rtree_{}_{}".format(*row),)).fetchone()[0] > 0
+    finally:
+        conn.close()
+
+    if row is not None and not hasIndex:
+        sql = "SELECT CreateSpatialIndex('{}', '{}')".format(*row)
+        if gdal is not None:
+            dstDS = gdal.OpenEx(fileName, gdal.OF_VECTOR | gdal.OF_UPDATE)
+            resultLyr = dstDS.ExecuteSQL(sql)
+            if resultLyr is not None:
+                dstDS.ReleaseResultSet(resultLyr)
+            dstDS = None
+        else:
+            launcher = []
+            for arg in job['ogrList']: # OSGeo4W.bat / ogr2ogr.exe, i.e. everything before the first -option
+                if arg.startswith('-'):
+                    break
+                launcher.append(arg)
+            launcher[-1] = re.sub("ogr2ogr", "ogrinfo", launcher[-1], flags=re.IGNORECASE)
+            indexResult = ogrScheduler.runOgrJob(dict(job, ogrList=launcher + [fileName, '-q', '-sql', sql])) # FUNCTION CALL
+            if indexResult['status'] != 'OK':
+                raise RuntimeError("Building the spatial index failed: {}".format(indexResult['stderr']))
+
+    conn = sqlite3.connect(fileName, isolation_level=None) # autocommit - VACUUM can't run inside a transaction
+    try:
+        conn.execute("VACUUM")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return "spatial index built, VACUUM and ANALYZE run" if row is not None and not hasIndex else "VACUUM and ANALYZE run"
+
+###############################################################################################################
+# Function to run finishGpkg() on each GPKG output of a row written with the fast-write options. Returns one message per output
+def finishGpkgOutputs(job):
+    if job.get('fanOut'):
+        targets = [(spec['fileName'], _ogrOption(spec['formatOptions'], '-nln')) for spec in job['fanOut'] if spec['outType'] == "GPKG"]
+    else:
+        targets = [(job['fileName'], _ogrOption(job['ogrList'], '-nln'))] if job['outType'] == "GPKG" else []
+    return ["{}: {}".format(os.path.basename(fileName), finishGpkg(job, fileName, layerName or os.path.splitext(os.path.basename(fileName))[0])) # FUNCTION CALL
+            for fileName, layerName in targets]
+
+# Function to wrap a runner so rows with job['gpkgFastWrite'] are finished once they've loaded
+def _withGpkgFinish(runner):
+    def runJob(job):
+        result = runner(job)
+        if not job.get('gpkgFastWrite') or result['status'] != 'OK':
+            return result
+        start = time.time()
+        try:
+            result['stdout'] = "\n".join([result['stdout'] or ""] + finishGpkgOutputs(job)).strip() # FUNCTION CALL
+        except Exception as error:
+            result['returncode'], result['status'] = 1, 'FAILED'
+            result['stderr'] = "{}\nFinishing the GPKG output failed: {}".format(result['stderr'] or "", error).strip()
+        result['seconds'] += time.time() - start
+        ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+        return result
+    return runJob
+
+###############################################################################################################
+# Function to pick the runner for ogrScheduler.runJobs(); "gdal" falls back to "subprocess" if osgeo isn't available
+def getRunner(engine="gdal"):
+    if engine == "gdal":
+        if gdal is not None:
+            gdal.UseExceptions()
+            print("Using the in-process GDAL engine (gdal.VectorTranslate {})".format(gdal.__version__))
+            return _withGpkgFinish(_withFanOut(runVectorTranslateJob, runFanOutJob))
+        print("osgeo.gdal is not available in this Python; falling back to the ogr2ogr subprocess engine")
+    elif engine != "subprocess":
+        print("Unknown engine '{}'; using the ogr2ogr subprocess engine".format(engine))
+    return _withGpkgFinish(_withFanOut(ogrScheduler.runOgrJob, runFanOutSubprocessJob))
@@ -0,0 +1,261 @@
+
+# ogrIncremental.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# Incremental ('watermark') extracts: instead of re-pulling a row's whole result set and overwriting the output every run,
+# only the rows changed since the last run are pulled, then upserted (delete + insert by key) into the existing GeoPackage layer.
+# Rows are made incremental with these optional ogrParams.csv columns:
+#   watermarkColumn - a date column that changes whenever a record changes, ex. LOAD_DATE, UPDATE_DATE, WHEN_UPDATED
+#   keyColumn       - a column that's unique for each record, ex. FIRE_NUMBER, OBJECTID
+#   fullRefreshDays - (optional) do a full re-pull every this many days, to catch records deleted from the source
+
+r"""HOW INCREMENTAL ROWS WORK:
+--------------------------------------------------------------------------------------
+1. The high-water mark (the newest watermarkColumn value written so far) is kept in a small state file next to the output,
+   ex. H:\_temp\wildfire_Southeast_polys.gpkg.ogrstate.json
+
+2. A row does a FULL run (the normal -overwrite of the whole output) when:
+   - the output or its state file doesn't exist yet (i.e. the first run)
+   - the sqlQuery, watermarkColumn or keyColumn changed since the last run
+   - 'fullRefreshDays' or more days have passed since the last full run
+   - the outType isn't GPKG, or osgeo can't be imported (the upsert needs both)
+   Otherwise it does an INCREMENTAL run:
+   - the row's SQL is wrapped as  select * from ( <sqlQuery> ) where watermarkColumn >= <high-water mark>
+   - the changed rows are written to delta.gpkg in the row's staging folder (with whichever engine is running the jobs)
+   - rows in the output layer with the same keyColumn values are deleted, and the changed rows are inserted, in one transaction
+   - the high-water mark moves up to the newest watermarkColumn value in the delta
+
+3. '>=' rather than '>' is used on purpose: records stamped in the same second as the last run are pulled again rather than missed,
+   and the upsert makes pulling a record twice harmless.
+
+4. The watermarkColumn and keyColumn must be in the sqlQuery's select list, and the outName must not change from run to run
+   (ex. don't put a {curDate} placeholder in it), otherwise every run is a full run.
+
+5. An incremental run can't see records deleted from the source; set fullRefreshDays (ex. 7) so they're dropped once a week.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import sys
+
+import ogrScheduler # companion module - must be in the same folder as this script
+
+try:
+    from osgeo import gdal, ogr
+except ImportError: # ex. running with a Python that isn't the QGIS / OSGeo4W one
+    gdal, ogr = None, None
+
+stateSuffix = ".ogrstate.json"
+deleteBatchSize = 500 # keys per DELETE .. WHERE key IN (..) statement
+
+###############################################################################################################
+# Function to read a row's incremental columns into a settings dictionary; returns None if the row isn't incremental
+def incrementalSettings(paramName, watermarkColumn=None, keyColumn=None, fullRefreshDays=None):
+    if not watermarkColumn:
+        return None
+    if not keyColumn:
+        print("\nRow '{}' has a watermarkColumn but no keyColumn; incremental rows need both... check your .csv\n".format(paramName)), sys.exit()
+    try:
+        fullRefreshDays = int(fullRefreshDays) if fullRefreshDays else None
+    except ValueError:
+        print("\nRow '{}': fullRefreshDays should be a whole number of days, not '{}'... check your .csv\n".format(paramName, fullRefreshDays)), sys.exit()
+    return {'watermarkColumn':watermarkColumn.upper(), 'keyColumn':keyColumn.upper(), 'fullRefreshDays':fullRefreshDays}
+
+# ex. job['incremental'] = incrementalSettings('fireParams', 'LOAD_DATE', 'FIRE_NUMBER', '7') # FUNCTION CALL
+
+###############################################################################################################
+def statePath(fileName):
+    return fileName + stateSuffix
+
+def readState(fileName):
+    try:
+        with open(statePath(fileName), 'r') as thing:
+            return json.load(thing)
+    except (OSError, ValueError): # missing or unreadable state file - treated as 'no state', i.e. a full run
+        return None
+
+def writeState(fileName, state):
+    tmpPath = statePath(fileName) + ".tmp"
+    with open(tmpPath, 'w') as thing:
+        json.dump(state, thing, indent=2)
+    os.replace(tmpPath, statePath(fileName)) # replace in one step, so a crash never leaves half a state file
+
+###############################################################################################################
+# Function to return the value following an option in an ogrList, ex. _ogrOption(ogrList, '-nln') -> layer name
+def _ogrOption(ogrList, option):
+    return ogrList[ogrList.index(option) + 1] if option in ogrList[:-1] else None
+
+def _readSQL(job):
+    with open(job['sqlFile'], 'r') as thing:
+        return thing.read()
+
+def sqlHash(sqlString):
+    return hashlib.sha1(" ".join(sqlString.split()).encode('utf-8')).hexdigest() # whitespace changes don't force a full run
+
+###############################################################################################################
+# Function to normalize a date value read back from GDAL ('2023-05-01T12:00:00Z', '2023/05/01 12:00:00+00' ..) to 'YYYY-MM-DD HH:MM:SS'
+def normalizeWatermark(value):
+    m = re.match(r"^\s*(\d{4})[-/](\d{2})[-/](\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2}))?)?", str(value or ""))
+    if not m:
+        return None
+    parts = [int(x) if x else 0 for x in m.groups()]
+    return datetime.datetime(*parts).strftime("%Y-%m-%d %H:%M:%S")
+
+###############################################################################################################
+# Function to write the high-water mark as a literal the source database understands
+def watermarkLiteral(watermark, ds):
+    if ds.upper().startswith("OCI:"):
+        return "TO_DATE('{}', 'YYYY-MM-DD HH24:MI:SS')".format(watermark)
+    return "'{}'".format(watermark.replace(" ", "T")) # GeoPackage / SpatiaLite sources store dates as ISO 8601 text
+
+###############################################################################################################
+# Function to wrap a row's SQL so only rows at or past the high-water mark come back
+def deltaSQL(sqlString, watermarkColumn, watermark, ds):
+    innerSQL = sqlString.strip().rstrip(";")
+    return "select * from (\n{}\n) delta_src\nwhere delta_src.{} >= {}".format(innerSQL, watermarkColumn, watermarkLiteral(watermark, ds))
+
+###############################################################################################################
+# Function to decide whether a job runs 'full' or 'incremental' this time. Returns (mode, reason)
+def planRun(job, state, now=None):
+    settings, now = job['incremental'], now or datetime.datetime.now()
+    if job.get('fanOut'):
+        return 'full', "rows with several outTypes always run in full"
+    if job['outType'] != "GPKG":
+        return 'full', "upserts need a GPKG output (outType is {})".format(job['outType'])
+    if gdal is None:
+        return 'full', "osgeo is not available for the upsert"
+    if not os.path.exists(job['fileName']) or state is None:
+        return 'full', "no previous output / state file"
+    if state.get('sqlHash') != sqlHash(_readSQL(job)):
+        return 'full', "sqlQuery changed since the last run"
+    if (state.get('watermarkColumn'), state.get('keyColumn')) != (settings['watermarkColumn'], settings['keyColumn']):
+        return 'full', "watermarkColumn / keyColumn changed since the last run"
+    if not state.get('watermark'):
+        return 'full', "no high-water mark recorded yet"
+    if settings['fullRefreshDays']:
+        lastFull = datetime.datetime.strptime(state['lastFullRefresh'], "%Y-%m-%d %H:%M:%S")
+        if (now - lastFull).days >= settings['fullRefreshDays']:
+            return 'full', "{} day(s) since the last full refresh".format((now - lastFull).days)
+    return 'incremental', "rows with {} >= {}".format(settings['watermarkColumn'], state['watermark'])
+
+###############################################################################################################
+# Function to return the newest watermarkColumn value in a layer, or None if the layer is empty
+def maxWatermark(fileName, layerName, watermarkColumn):
+    srcDS = gdal.OpenEx(fileName, gdal.OF_VECTOR)
+    sqlLyr = srcDS.ExecuteSQL('SELECT MAX("{}") AS WM FROM "{}"'.format(watermarkColumn, layerName))
+    try:
+        feat = sqlLyr.GetNextFeature()
+        return normalizeWatermark(feat.GetFieldAsString(0)) if feat is not None and feat.IsFieldSetAndNotNull(0) else None
+    finally:
+        srcDS.ReleaseResultSet(sqlLyr)
+        srcDS = None
+
+###############################################################################################################
+def _keyLiteral(value):
+    return str(value) if isinstance(value, (int, float)) else "'{}'".format(str(value).replace("'", "''"))
+
+# Function to upsert the delta layer into the output layer: delete the rows whose keys are in the delta, then insert the delta rows.
+# Both happen in one transaction, so a failure leaves the output exactly as it was. Returns the number of rows upserted
+def upsertLayer(fileName, layerName, deltaPath, keyColumn):
+    deltaDS = gdal.OpenEx(deltaPath, gdal.OF_VECTOR)
+    deltaLyr = deltaDS.GetLayerByName(layerName) if deltaDS is not None else None
+    if deltaLyr is None or deltaLyr.GetFeatureCount() == 0:
+        return 0
+
+    dstDS = gdal.OpenEx(fileName, gdal.OF_VECTOR | gdal.OF_UPDATE)
+    dstLyr = dstDS.GetLayerByName(layerName)
+    if dstLyr is None:
+        raise RuntimeError("Layer '{}' not found in {}; delete the state file to force a full run".format(layerName, fileName))
+    keyIndex = deltaLyr.GetLayerDefn().GetFieldIndex(keyColumn)
+    if keyIndex < 0:
+        raise RuntimeError("keyColumn '{}' is not in the sqlQuery's select list".format(keyColumn))
+
+    keys = [feat.GetField(keyIndex) for feat in deltaLyr]
+    deltaLyr.ResetReading()
+    dstDefn, upserted = dstLyr.GetLayerDefn(), 0
+    dstDS.StartTransaction()
+    try:
+        for i in range(0, len(keys), deleteBatchSize):
+            batch = ", ".join(_keyLiteral(k) for k in keys[i:i + deleteBatchSize] if k is not None)
+            if batch:
+                dstDS.ExecuteSQL('DELETE FROM "{}" WHERE "{}" IN ({})'.format(layerName, keyColumn, batch))
+        for srcFeat in deltaLyr:
+            dstFeat = ogr.Feature(dstDefn)
+            dstFeat.SetFrom(srcFeat) # copies the geometry and matches fields by name
+            dstLyr.CreateFeature(dstFeat)
+            upserted += 1
+        dstDS.CommitTransaction()
+    except Exception:
+        dstDS.RollbackTransaction()
+        raise
+    finally:
+        dstDS, deltaDS = None, None
+    return upserted
+
+###############################################################################################################
+# Function to build the job that pulls just the delta into the row's staging folder (same options, GPKG output, wrapped SQL)
+def makeDeltaJob(job, watermark):
+    settings = job['incremental']
+    deltaPath = os.path.join(job['stagingDir'], "delta.gpkg")
+    deltaSqlFile = os.path.join(job['stagingDir'], "delta_query.sql")
+    with open(deltaSqlFile, 'w') as thing:
+        thing.write(deltaSQL(_readSQL(job), settings['watermarkColumn'], watermark, job['ds']))
+    if os.path.exists(deltaPath):
+        os.remove(deltaPath)
+
+    ogrList = [deltaPath if arg == job['fileName'] else "@{}".format(deltaSqlFile) if arg == "@{}".format(job['sqlFile']) else arg
+               for arg in job['ogrList']]
+    deltaJob = dict(job, ogrList=ogrList, fileName=deltaPath, sqlFile=deltaSqlFile, chunk=None, gpkgFastWrite=False) # deltas are small and temporary, so they're never chunked or finished
+    return deltaJob
+
+###############################################################################################################
+# Function to wrap an engine's runner (ex. ogrEngines.getRunner("gdal")) so jobs with job['incremental'] settings run incrementally.
+# Jobs without incremental settings are passed straight through to the engine
+def getIncrementalRunner(runner):
+    def runIncrementalJob(job):
+        if not job.get('incremental'):
+            return runner(job)
+
+        settings, layerName = job['incremental'], _ogrOption(job['ogrList'], '-nln')
+        state = readState(job['fileName']) # FUNCTION CALL
+        mode, reason = planRun(job, state) # FUNCTION CALL
+        ogrScheduler.printSafe("\tJob {:>3}: {} run - {}".format(job['n'], mode, reason))
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        if mode == 'full':
+            result = runner(job)
+            if result['status'] == 'OK' and job['outType'] == "GPKG" and gdal is not None:
+                writeState(job['fileName'], {'layerName':layerName, 'watermarkColumn':settings['watermarkColumn'], 'keyColumn':settings['keyColumn'],
+                                             'watermark':maxWatermark(job['fileName'], layerName, settings['watermarkColumn']),
+                                             'sqlHash':sqlHash(_readSQL(job)), 'lastFullRefresh':now, 'lastRun':now, 'lastMode':'full'})
+            return result
+
+        deltaJob = makeDeltaJob(job, state['watermark']) # FUNCTION CALL
+        result = runner(deltaJob)
+        result['fileName'] = job['fileName']
+        if result['status'] != 'OK':
+            return result
+        try:
+            upserted = upsertLayer(job['fileName'], layerName, deltaJob['fileName'], settings['keyColumn']) # FUNCTION CALL
+            deltaMax = maxWatermark(deltaJob['fileName'], layerName, settings['watermarkColumn']) if upserted else None
+        except Exception as error:
+            result['returncode'], result['status'] = 1, 'FAILED'
+            result['stderr'] = "{}\nUpsert failed: {}".format(result['stderr'], error)
+            ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+            return result
+
+        state.update({'watermark':max(state['watermark'], deltaMax or state['watermark']), 'lastRun':now, 'lastMode':'incremental',
+                      'lastRowsUpserted':upserted})
+        writeState(job['fileName'], state)
+        msg = "Incremental run: {} row(s) upserted into {} ({}); high-water mark is now {}".format(upserted, layerName, job['fileName'], state['watermark'])
+        result['stdout'] = "{}\n{}".format(result['stdout'], msg).strip()
+        ogrScheduler.writeJobOutput(job, result) # FUNCTION CALL
+        ogrScheduler.printSafe("\tJob {:>3}: {} row(s) upserted".format(job['n'], upserted))
+        return result
+
+    return runIncrementalJob
+
+# ex. results = ogrScheduler.runJobs(jobs, 4, 2, getIncrementalRunner(ogrEngines.getRunner("gdal"))) # FUNCTION CALL
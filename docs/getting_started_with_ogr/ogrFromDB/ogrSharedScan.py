@@ -0,0 +1,280 @@
+
+# ogrSharedScan.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# Shared scans: ogrParams.csv rows that read the same table with the same WHERE clause (ex. rows 1 and 3 of the default
+# ogrParams.csv, which only differ in their columns and KML styling) are fetched from the database ONCE, into a local scratch GeoPackage.
+# Each of those rows' outputs is then made from the local copy, so the database only does one round trip per group of rows.
+
+r"""HOW SHARED SCANS WORK:
+--------------------------------------------------------------------------------------
+1. Each row's (already scrubbed) SQL is split into its SELECT list, FROM table, WHERE clause and ORDER BY.
+   Rows are grouped when they have the same database, output CRS, FROM table (and alias) and WHERE clause.
+   Only simple queries are shared:  select <columns / expressions with an alias> from <one table> [alias] [where ...] [order by ...]
+   Anything else (joins, GROUP BY, DISTINCT, UNION, select *, an expression without an alias ...) runs on its own, as before.
+   The geometry column has to be called SHAPE, GEOMETRY or GEOM, so it can be found again in the scratch GeoPackage.
+
+2. For each group, one 'fetch' job pulls the union of the rows' columns (without ORDER BY) into
+   T:\tempQueryFolder\job..._sharedScan..\shared_scan.gpkg. Fetch jobs run first, alongside the rows that aren't shared, with the usual
+   per-database connection cap. They keep the order of the rows (a fetch takes its group's first row's place), so --plan's longest-first order holds.
+
+3. Each row in the group then runs its own ogr2ogr options against the scratch GeoPackage, with
+   select <its columns> from shared_scan order by <its order by>. These jobs don't touch the database at all.
+
+4. A report at the end shows, for each group, the database round trips saved and roughly how many bytes of column data
+   didn't have to come over the network (measured on the scratch GeoPackage).
+
+5. Incremental rows (see ogrIncremental.py) are never shared, since each one pulls its own delta.
+"""
+
+import os
+import sqlite3
+
+import ogrScheduler # companion modules - must be in the same folder as this script
+import sqlDateRewriter
+
+scratchLayer = "shared_scan"
+geometryNames = ('SHAPE', 'GEOMETRY', 'GEOM') # select-list names treated as the geometry column
+topLevelKeywords = ('SELECT', 'FROM', 'WHERE', 'ORDER')
+unsharedKeywords = ('GROUP', 'HAVING', 'UNION', 'INTERSECT', 'MINUS', 'CONNECT', 'START', 'FETCH', 'OFFSET', 'FOR', 'JOIN', 'DISTINCT', 'UNIQUE')
+orderWords = ('ASC', 'DESC', 'NULLS', 'FIRST', 'LAST')
+
+###############################################################################################################
+# Function to split a query into {'items':[(name, expression)..], 'table', 'alias', 'where', 'orderBy'}; None if it can't be shared
+def parseSimpleSelect(sqlString):
+    tokens = [t for t in sqlDateRewriter.tokenize(sqlString.strip().rstrip(";")) if t[0] != 'comment']
+    clauses, current, depth = {}, None, 0
+    for kind, text in tokens:
+        upper = text.upper() if kind == 'ident' else None
+        if text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+        elif depth == 0 and upper in unsharedKeywords:
+            return None
+        elif depth == 0 and upper in topLevelKeywords:
+            current = upper
+            clauses[current] = []
+            continue
+        if current is None: # something before SELECT
+            if kind != 'space':
+                return None
+            continue
+        clauses[current].append((kind, text))
+    if current is None or 'SELECT' not in clauses or 'FROM' not in clauses:
+        return None
+    if 'ORDER' in clauses: # drop the BY of ORDER BY
+        orderTokens = clauses['ORDER']
+        significant = [i for i, t in enumerate(orderTokens) if t[0] != 'space']
+        if not significant or orderTokens[significant[0]][1].upper() != 'BY':
+            return None
+        clauses['ORDER'] = orderTokens[significant[0] + 1:]
+
+    fromParts = [text for kind, text in clauses['FROM'] if kind != 'space']
+    if len(fromParts) not in (1, 2) or not all(sqlDateRewriter.tokenRegex.fullmatch(p).lastgroup == 'ident' for p in fromParts):
+        return None
+    table, alias = fromParts[0].upper(), fromParts[1].upper() if len(fromParts) == 2 else None
+
+    items = []
+    for itemTokens in _splitTopLevel(clauses['SELECT']):
+        name = _itemName(itemTokens)
+        if name is None:
+            return None
+        items.append((name, _joinTokens(itemTokens)))
+    return {'items':items, 'table':table, 'alias':alias, 'where':_joinTokens(clauses.get('WHERE', [])), 'orderBy':clauses.get('ORDER', [])}
+
+def _joinTokens(tokens):
+    return "".join(text for kind, text in tokens).strip()
+
+def _splitTopLevel(tokens): # split a token list on commas that aren't inside brackets
+    parts, current, depth = [], [], 0
+    for kind, text in tokens:
+        depth += 1 if text == '(' else -1 if text == ')' else 0
+        if text == ',' and depth == 0:
+            parts.append(current)
+            current = []
+        else:
+            current.append((kind, text))
+    parts.append(current)
+    return parts
+
+def _itemName(itemTokens): # output column name of one select-list item: its alias, or the column name itself
+    significant = [(kind, text) for kind, text in itemTokens if kind != 'space']
+    if not significant or significant[-1][0] != 'ident' or significant[-1][1] == '*':
+        return None
+    if len(significant) == 1 or (len(significant) >= 3 and significant[-2][1].upper() == 'AS'):
+        return significant[-1][1].split(".")[-1].upper()
+    if significant[-2][1] == ')' or significant[-2][0] == 'ident': # ex. NVL(a, b) a_or_b  /  CASE .. END style_col
+        return significant[-1][1].upper()
+    return None
+
+###############################################################################################################
+# Function to normalize a clause for grouping: same tokens, case-insensitive outside of string literals, any whitespace
+def _normalize(text):
+    return " ".join(t if kind == 'string' else t.upper() for kind, t in sqlDateRewriter.tokenize(text) if kind not in ('space', 'comment'))
+
+def _ogrOption(ogrList, option):
+    return ogrList[ogrList.index(option) + 1] if option in ogrList[:-1] else None
+
+def _readSQL(sqlFile):
+    with open(sqlFile, 'r') as thing:
+        return thing.read()
+
+###############################################################################################################
+# Function to rewrite a row's ORDER BY for the scratch layer (drop 'alias.' / 'table.' prefixes); returns (text, column names used)
+def _localOrderBy(orderTokens, parsed):
+    prefixes = [p for p in (parsed['alias'], parsed['table']) if p]
+    text, names = [], []
+    for kind, t in orderTokens:
+        if kind == 'ident' and t.upper() not in orderWords:
+            parts = t.split(".")
+            if len(parts) > 1 and ".".join(parts[:-1]).upper() in prefixes:
+                t = parts[-1]
+            names.append(t.split(".")[-1].upper())
+        text.append(t)
+    return "".join(text).strip(), names
+
+###############################################################################################################
+# Function to group jobs that can share one database fetch. Returns a plan dictionary:
+#   'fetchJobs'   - one job per group, pulling the union of columns into a scratch GPKG
+#   'directJobs'  - jobs that run against the database on their own, as before
+#   'firstJobs'   - fetchJobs and directJobs in the order of 'jobs' (a fetch job takes the place of its group's first row),
+#                   so an order from --plan (longest first) still holds
+#   'derivedJobs' - jobs that make their output from a group's scratch GPKG
+#   'groups'      - per-group details for the report
+def planSharedScans(jobs, stagingRoot):
+    candidates, directJobs = {}, []
+    position = dict((id(job), i) for i, job in enumerate(jobs))
+    linked = set(d for job in jobs for d in job.get('dependsOn') or []) | set(job['paramName'] for job in jobs if job.get('dependsOn'))
+    for job in jobs:
+        # rows in a dependsOn chain run on their own, so the scheduler can order them
+        parsed = parseSimpleSelect(_readSQL(job['sqlFile'])) if not (job.get('incremental') or job.get('chunk') or job['paramName'] in linked) else None # FUNCTION CALL
+        if parsed is None:
+            directJobs.append(job)
+            continue
+        key = (job.get('database'), job['ds'], _ogrOption(job['ogrList'], '-a_srs'), parsed['table'], parsed['alias'], _normalize(parsed['where']))
+        candidates.setdefault(key, []).append((job, parsed))
+
+    fetchJobs, derivedJobs, groups = [], [], []
+    for key, members in candidates.items():
+        union, unionOrder, shared = {}, [], []
+        for job, parsed in members:
+            orderText, orderNames = _localOrderBy(parsed['orderBy'], parsed) # FUNCTION CALL
+            if '(' in orderText: # ORDER BY an expression - keep it simple and run the row on its own
+                directJobs.append(job)
+                continue
+            itemsNeeded = list(parsed['items']) + [(name, name) for name in orderNames if name not in [i[0] for i in parsed['items']]]
+            if any(name in union and _normalize(union[name]) != _normalize(expression) for name, expression in itemsNeeded):
+                directJobs.append(job) # same output name, different expression - can't share this one
+                continue
+            for name, expression in itemsNeeded:
+                if name not in union:
+                    union[name] = expression
+                    unionOrder.append(name)
+            shared.append((job, parsed, orderText))
+        geomNames = [name for name in unionOrder if name in geometryNames]
+        if len(shared) < 2 or len(geomNames) != 1: # the scratch layer's geometry column has to be found by name
+            directJobs += [job for job, parsed, orderText in shared]
+            continue
+        groups.append(_buildGroup(len(groups), key, union, unionOrder, geomNames, shared, stagingRoot, fetchJobs, derivedJobs)) # FUNCTION CALL
+        position[id(fetchJobs[-1])] = min(position[id(job)] for job, parsed, orderText in shared)
+
+    directJobs.sort(key=lambda j: position[id(j)]) # rows left out of a group go back to their place in 'jobs'
+    firstJobs = sorted(fetchJobs + directJobs, key=lambda j: position[id(j)])
+    return {'fetchJobs':fetchJobs, 'directJobs':directJobs, 'firstJobs':firstJobs, 'derivedJobs':derivedJobs, 'groups':groups}
+
+# ex. plan = planSharedScans(jobs, r"T:\tempQueryFolder") # FUNCTION CALL
+
+def _buildGroup(g, key, union, unionOrder, geomNames, shared, stagingRoot, fetchJobs, derivedJobs):
+    database, ds, srs, table, alias, where = key
+    firstJob, firstParsed = shared[0][0], shared[0][1]
+    stagingDir = ogrScheduler.makeJobStagingDir(stagingRoot, g, "sharedScan") # FUNCTION CALL
+    scratchPath = os.path.join(stagingDir, "{}.gpkg".format(scratchLayer))
+
+    # The fetch job: the union of the rows' columns, same FROM / WHERE, no ORDER BY (each row sorts its own output locally)
+    fetchSQL = "select {}\nfrom {}{}\n{}".format(",\n".join(union[name] for name in unionOrder), table, " {}".format(alias) if alias else "",
+                                                  "where {}".format(firstParsed['where']) if firstParsed['where'] else "")
+    fetchSqlFile = os.path.join(stagingDir, "query.sql")
+    with open(fetchSqlFile, 'w') as thing:
+        thing.write(fetchSQL)
+    launcher = []
+    for arg in firstJob['ogrList']: # OSGeo4W.bat / ogr2ogr.exe, i.e. everything before the first -option
+        if arg.startswith('-'):
+            break
+        launcher.append(arg)
+    fetchList = launcher + ['-a_srs', srs, '-f', 'GPKG', scratchPath, ds, '-progress', '-sql', '@{}'.format(fetchSqlFile), '-overwrite',
+                            '-nln', scratchLayer, '-lco', 'GEOMETRY_NAME={}'.format(geomNames[0])]
+    fetchJob = {'n':-(g + 1), 'paramName':"sharedScan{}".format(g), 'database':database, 'ogrList':fetchList, 'fileName':scratchPath,
+                'ds':ds, 'outType':'GPKG', 'outPath':stagingDir, 'outName':scratchLayer, 'sqlFile':fetchSqlFile, 'stagingDir':stagingDir}
+    fetchJobs.append(fetchJob)
+
+    # Each row's job re-pointed at the scratch GeoPackage, with its own columns and ORDER BY
+    members = []
+    for job, parsed, orderText in shared:
+        localSQL = "select {} from {}{}".format(", ".join(name for name, expression in parsed['items']), scratchLayer,
+                                                " order by {}".format(orderText) if orderText else "")
+        localSqlFile = os.path.join(job['stagingDir'], "shared_query.sql")
+        with open(localSqlFile, 'w') as thing:
+            thing.write(localSQL)
+        ogrList = [scratchPath if arg == ds else "@{}".format(localSqlFile) if arg == "@{}".format(job['sqlFile']) else arg for arg in job['ogrList']]
+        derivedJobs.append(dict(job, ogrList=ogrList, ds=scratchPath, sqlFile=localSqlFile, database='scratch', sharedScan=g))
+        members.append((job['n'], job['paramName'], [name for name, expression in parsed['items']]))
+    return {'g':g, 'table':table, 'where':where, 'fetchJob':fetchJob, 'columns':unionOrder, 'members':members}
+
+###############################################################################################################
+# Function to measure roughly how many bytes each column holds in a scratch GeoPackage (SUM of LENGTH() per column)
+def columnBytes(scratchPath):
+    conn = sqlite3.connect("file:{}?mode=ro".format(scratchPath.replace("\\", "/")), uri=True)
+    try:
+        columns = [row[1] for row in conn.execute('PRAGMA table_info("{}")'.format(scratchLayer)) if row[1].lower() != 'fid']
+        select = ", ".join('COALESCE(SUM(LENGTH("{}")), 0)'.format(c) for c in columns)
+        totals = conn.execute('SELECT {} FROM "{}"'.format(select, scratchLayer)).fetchone()
+        return {c.upper():int(t) for c, t in zip(columns, totals)}
+    finally:
+        conn.close()
+
+###############################################################################################################
+# Function to run a shared-scan plan: fetch jobs (and unshared rows) against the database first, then the rows derived from the scratch copies.
+# Returns one result per original row, in row order, like ogrScheduler.runJobs()
+def runPlannedJobs(plan, maxWorkers=4, dbConnectionCap=2, runner=ogrScheduler.runOgrJob):
+    firstResults = ogrScheduler.runJobs(plan['firstJobs'], maxWorkers, dbConnectionCap, runner) # FUNCTION CALL
+    fetchResults = {r['n']:r for r in firstResults if r['n'] < 0}
+    results = [r for r in firstResults if r['n'] >= 0]
+
+    readyJobs = []
+    for job in plan['derivedJobs']:
+        fetchResult = fetchResults[-(job['sharedScan'] + 1)]
+        if fetchResult['status'] == 'OK':
+            readyJobs.append(job)
+        else: # the shared fetch failed, so every row in its group fails with the fetch's error
+            result = ogrScheduler.newJobResult(job) # FUNCTION CALL
+            result['fileName'], result['returncode'] = job['fileName'], fetchResult['returncode']
+            result['stderr'] = "Shared fetch {} failed:\n{}".format(fetchResult['paramName'], fetchResult['stderr'])
+            results.append(result)
+    if readyJobs:
+        results += ogrScheduler.runJobs(readyJobs, maxWorkers, maxWorkers, runner) # FUNCTION CALL - local reads, so no connection cap
+    printSharedScanReport(plan, fetchResults) # FUNCTION CALL
+    return sorted(results, key=lambda r: r['n'])
+
+###############################################################################################################
+# Function to print the database round trips and (approximate) bytes saved by each shared fetch
+def printSharedScanReport(plan, fetchResults):
+    if not plan['groups']:
+        return
+    header = "{:>5}  {:<45} {:>5} {:>12} {:>14} {:>14}".format("group", "table", "rows", "trips saved", "bytes fetched", "bytes saved")
+    print("\n\nShared scans:\n{}\n{}".format(header, "="*len(header)))
+    totalTrips, totalBytes = 0, 0
+    for group in plan['groups']:
+        tripsSaved = len(group['members']) - 1
+        fetched, saved = "n/a", "n/a"
+        if fetchResults[group['fetchJob']['n']]['status'] == 'OK' and os.path.exists(group['fetchJob']['fileName']):
+            colBytes = columnBytes(group['fetchJob']['fileName']) # FUNCTION CALL
+            unionBytes = sum(colBytes.values())
+            rowBytes = sum(sum(colBytes.get(name, 0) for name in names) for n, paramName, names in group['members'])
+            fetched, saved = unionBytes, max(0, rowBytes - unionBytes)
+            totalBytes += saved
+        totalTrips += tripsSaved
+        print("{:>5}  {:<45} {:>5} {:>12} {:>14} {:>14}".format(group['g'], group['table'][:45], len(group['members']), tripsSaved, fetched, saved))
+        print("       rows: {}".format(", ".join("{} ({})".format(paramName, n) for n, paramName, names in group['members'])))
+    print("-"*len(header))
+    print("{} database round trip(s) and ~{:,} bytes of column data saved\n".format(totalTrips, totalBytes))
@@ -0,0 +1,182 @@
+
+# sqlDateRewriter.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# Rewrites date comparisons in an Oracle SQL query into index-friendly ('sargable') range predicates.
+# Used by sqlQueryScrubber() when makeFriendlySQL = "Y".
+
+"""WHY:
+--------------------------------------------------------------------------------------
+The older version of sqlQueryScrubber turned  BLOCK_STATUS_DATE >= '01-SEP-17'  into nested
+EXTRACT(year FROM ...) / EXTRACT(month FROM ...) / EXTRACT(day FROM ...) comparisons.
+Oracle can't use an index on the date column for those, so every dated extract became a full table scan.
+
+This rewriter leaves the date column alone and only converts the date literal, ex.
+
+    BLOCK_STATUS_DATE >= '01-SEP-17'
+becomes
+    BLOCK_STATUS_DATE >= TO_DATE('2017-09-01', 'YYYY-MM-DD')
+
+Dates are compared by calendar day (like the old EXTRACT rewrite), so operators that include or exclude a whole day become ranges:
+
+    DATECOL =  'd'              ->  (DATECOL >= d AND DATECOL < d+1)
+    DATECOL <> 'd'              ->  (DATECOL < d OR DATECOL >= d+1)
+    DATECOL >  'd'              ->  DATECOL >= d+1
+    DATECOL >= 'd'              ->  DATECOL >= d
+    DATECOL <  'd'              ->  DATECOL < d
+    DATECOL <= 'd'              ->  DATECOL < d+1
+    DATECOL BETWEEN 'a' AND 'b' ->  (DATECOL >= a AND DATECOL < b+1)
+    DATECOL NOT BETWEEN ...     ->  (DATECOL < a OR DATECOL >= b+1)
+
+The query is split into tokens (strings, comments, identifiers, operators) instead of splitting lines on spaces,
+so any number of date terms per line, reversed comparisons ('01-SEP-17' <= DATECOL) and BETWEEN all work.
+Only columns whose name contains 'DATE' are rewritten, unless a list of dateColumns is given.
+Date literals can be 'DD-MON-YY', 'DD-MON-YYYY' or 'YYYY-MM-DD'. Two digit years are read like Oracle's RR format
+(i.e. within the past 100 years).
+
+With useBinds=True, the dates are returned as bind variables (:d0, :d1 ...) plus a dictionary of their values,
+for Python database clients like cx_Oracle. ogr2ogr's -sql can't bind variables, so the ogr scripts use TO_DATE literals.
+"""
+
+import datetime
+import re
+
+monthDict = {'JAN':1, 'FEB':2, 'MAR':3, 'APR':4, 'MAY':5, 'JUN':6, 'JUL':7, 'AUG':8, 'SEP':9, 'OCT':10, 'NOV':11, 'DEC':12}
+
+# Token types, in the order they're tried. Whitespace and comments are kept so the rewritten SQL keeps its layout
+tokenPatterns = [
+    ('space',   r"\s+"),
+    ('comment', r"--[^\n]*|/\*.*?\*/"),
+    ('string',  r"'(?:[^']|'')*'"),
+    ('qident',  r'"[^"]*"'),
+    ('number',  r"\d+(?:\.\d+)?"),
+    ('ident',   r"[A-Za-z_][A-Za-z0-9_$#]*(?:\.(?:[A-Za-z_][A-Za-z0-9_$#]*|\"[^\"]*\"))*"),
+    ('bind',    r":[A-Za-z0-9_]+"),
+    ('op',      r"<>|!=|\^=|>=|<=|\|\||=|<|>"),
+    ('punct',   r"[(),;*+\-/.@%]"),
+    ('other',   r"."),
+]
+tokenRegex = re.compile("|".join("(?P<{}>{})".format(name, pattern) for name, pattern in tokenPatterns), re.DOTALL)
+
+flipDict = {'=':'=', '<>':'<>', '!=':'<>', '^=':'<>', '>':'<', '<':'>', '>=':'<=', '<=':'>='} # for 'literal OP column' terms
+
+###############################################################################################################
+# Function to split SQL text into (type, text) tokens
+def tokenize(sqlString):
+    return [(m.lastgroup, m.group()) for m in tokenRegex.finditer(sqlString)]
+
+###############################################################################################################
+# Function to read a quoted date literal ('01-SEP-17', '01-SEP-2017', '2017-09-01') into a datetime.date; None if it isn't a date
+def parseDateLiteral(literal, today=None):
+    text = literal.strip("'").strip().upper()
+    m = re.match(r"^(\d{1,2})-([A-Z]{3})-(\d{2}|\d{4})$", text)
+    try:
+        if m and m.group(2) in monthDict:
+            day, month, year = int(m.group(1)), monthDict[m.group(2)], m.group(3)
+            if len(year) == 2: # RR-style: the two digit year is within the past 100 years
+                curYear = (today or datetime.date.today()).year
+                year = int(year) + (curYear // 100) * 100
+                if year > curYear:
+                    year -= 100
+            return datetime.date(int(year), month, day)
+        m = re.match(r"^(\d{4})-(\d{2})-(\d{2})$", text)
+        if m:
+            return datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError: # ex. '31-FEB-20'
+        return None
+    return None
+
+###############################################################################################################
+class _DateTermWriter:
+    # Keeps track of how each date value is written out (TO_DATE literal or bind variable)
+    def __init__(self, useBinds):
+        self.useBinds, self.binds = useBinds, {}
+
+    def value(self, date):
+        if self.useBinds:
+            name = "d{}".format(len(self.binds))
+            self.binds[name] = datetime.datetime(date.year, date.month, date.day)
+            return ":{}".format(name)
+        return "TO_DATE('{}', 'YYYY-MM-DD')".format(date.isoformat())
+
+    def comparison(self, column, operator, date):
+        nextDay = date + datetime.timedelta(days=1)
+        if operator == '=':
+            return "({0} >= {1} AND {0} < {2})".format(column, self.value(date), self.value(nextDay))
+        if operator == '<>':
+            return "({0} < {1} OR {0} >= {2})".format(column, self.value(date), self.value(nextDay))
+        if operator == '>':
+            return "{} >= {}".format(column, self.value(nextDay))
+        if operator == '>=':
+            return "{} >= {}".format(column, self.value(date))
+        if operator == '<':
+            return "{} < {}".format(column, self.value(date))
+        return "{} < {}".format(column, self.value(nextDay)) # '<='
+
+    def between(self, column, lowDate, highDate, negated=False):
+        if negated:
+            return "({0} < {1} OR {0} >= {2})".format(column, self.value(lowDate), self.value(highDate + datetime.timedelta(days=1)))
+        return "({0} >= {1} AND {0} < {2})".format(column, self.value(lowDate), self.value(highDate + datetime.timedelta(days=1)))
+
+###############################################################################################################
+# Function to rewrite every date comparison in sqlString. Returns (newSQL, binds, count) - binds is {} unless useBinds=True
+def rewriteDatePredicates(sqlString, useBinds=False, dateColumns=None, today=None):
+    tokens = tokenize(sqlString)
+    significant = [i for i, (kind, text) in enumerate(tokens) if kind not in ('space', 'comment')] # positions of tokens that matter
+    writer = _DateTermWriter(useBinds)
+    dateColumnsUpper = [c.upper() for c in dateColumns] if dateColumns else None
+
+    def tok(j): # j-th significant token, or ('', '') past the end
+        return tokens[significant[j]] if 0 <= j < len(significant) else ('', '')
+
+    def isDateColumn(j): # is the j-th significant token a date column (and not a function like TO_DATE(...))?
+        kind, text = tok(j)
+        if kind not in ('ident', 'qident') or text.upper() in ('AND', 'OR', 'NOT', 'BETWEEN', 'WHERE', 'ON', 'DATE') or tok(j + 1)[1] == '(':
+            return False
+        name = text.split(".")[-1].strip('"').upper()
+        return name in dateColumnsUpper if dateColumnsUpper else 'DATE' in name
+
+    replacements = {} # first token position -> (last token position, new text)
+    count, j = 0, 0
+    while j < len(significant):
+        kind, text = tok(j)
+        # column [NOT] BETWEEN 'date' AND 'date'
+        if isDateColumn(j):
+            k, negated = j + 1, False
+            if tok(k)[1].upper() == 'NOT':
+                k, negated = k + 1, True
+            if tok(k)[1].upper() == 'BETWEEN' and tok(k + 1)[0] == 'string' and tok(k + 2)[1].upper() == 'AND' and tok(k + 3)[0] == 'string':
+                low, high = parseDateLiteral(tok(k + 1)[1], today), parseDateLiteral(tok(k + 3)[1], today)
+                if low and high:
+                    replacements[significant[j]] = (significant[k + 3], writer.between(text, low, high, negated))
+                    count, j = count + 1, k + 4
+                    continue
+            # column OP 'date'
+            if tok(j + 1)[0] == 'op' and tok(j + 1)[1] in flipDict and tok(j + 2)[0] == 'string':
+                date = parseDateLiteral(tok(j + 2)[1], today)
+                if date:
+                    operator = '<>' if tok(j + 1)[1] in ('!=', '^=') else tok(j + 1)[1]
+                    replacements[significant[j]] = (significant[j + 2], writer.comparison(text, operator, date))
+                    count, j = count + 1, j + 3
+                    continue
+        # 'date' OP column
+        if kind == 'string' and tok(j + 1)[0] == 'op' and tok(j + 1)[1] in flipDict and isDateColumn(j + 2):
+            date = parseDateLiteral(text, today)
+            if date:
+                replacements[significant[j]] = (significant[j + 2], writer.comparison(tok(j + 2)[1], flipDict[tok(j + 1)[1]], date))
+                count, j = count + 1, j + 3
+                continue
+        j += 1
+
+    newSQL, i = [], 0
+    while i < len(tokens):
+        if i in replacements:
+            last, newText = replacements[i]
+            newSQL.append(newText)
+            i = last + 1
+        else:
+            newSQL.append(tokens[i][1])
+            i += 1
+    return "".join(newSQL), writer.binds, count
+
+# ex. newSQL, binds, count = rewriteDatePredicates("select * from t where BLOCK_STATUS_DATE >= '01-SEP-17'") # FUNCTION CALL
@@ -0,0 +1,426 @@
+
+# ogrBenchmark.py
+# Companion benchmark for ogrFromBCGW_csv_FINAL.py - runs offline, no BCGW login needed
+
+# Builds a synthetic polygon layer in a local GeoPackage (or SpatiaLite database) that stands in for the Oracle source,
+# then runs the same kind of jobs ogrFromBCGW() builds against it, so engine changes can be compared without touching IDWPROD1.
+
+"""HOW TO RUN (from the OSGeo4W shell, or any Python with osgeo installed):
+--------------------------------------------------------------------------------------
+python ogrBenchmark.py engines --features 100000 --rows 10
+python ogrBenchmark.py incremental --features 100000 --changed 500
+python ogrBenchmark.py fanout --features 100000
+python ogrBenchmark.py formats --features 1000000
+python ogrBenchmark.py gpkg --features 1000000
+python ogrBenchmark.py precision --features 100000
+python ogrBenchmark.py replay --params ogrParams.csv --scales 10000,100000,1000000 --save baseline.json
+
+engines     - compares the in-process GDAL engine with the ogr2ogr subprocess engine (ogr2ogr must be on the PATH for the second one)
+incremental - a full run, then an incremental (ogrIncremental.py) run after --changed source rows get a new LOAD_DATE, then a forced full run
+fanout      - GPKG, KML and GeoJSON outputs of the same query: three separate rows vs one row with outType GPKG;KML;GeoJSON
+formats     - writes the layer in every outType, then times the same bounding-box reads against each file (FlatGeobuf / Parquet vs the rest)
+gpkg        - features per second writing GPKG with ogr2ogr's defaults vs the gpkgFastWrite profile (including the index build, VACUUM and ANALYZE)
+precision   - file size and write time of GeoJSON, KML, GPKG and FlatGeobuf outputs at full precision and at coordPrec 3, 2, 1 and 0 (-xyRes, GDAL 3.9+)
+replay      - runs every row of a params file against a synthetic SpatiaLite database at each of --scales, with each engine, and prints the totals
+              from the rows' telemetry (ogrTelemetry.py). --save keeps the totals; --baseline compares this run with saved ones, to catch slowdowns.
+              Each row keeps its outType(s), columns and coordPrec / snapGrid / simplify, but its WHERE clause is dropped (Oracle SQL won't run on SQLite),
+              so every row reads the whole synthetic layer.
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import ogrCache # companion modules - must be in the same folder as this script
+import ogrEngines
+import ogrIncremental
+import ogrScheduler
+import ogrTelemetry
+
+try:
+    from osgeo import ogr, osr
+except ImportError:
+    ogr = None
+
+###############################################################################################################
+# Function to create a synthetic fire-polygon-like layer with 'nFeatures' squares scattered across BC Albers
+def makeSyntheticSource(srcPath, nFeatures, driverName="GPKG", layerName="FIRE_POLYS_SP", seed=42):
+    if os.path.exists(srcPath):
+        os.remove(srcPath)
+    dsco = ['SPATIALITE=YES'] if driverName == "SQLite" else []
+    srcDS = ogr.GetDriverByName(driverName).CreateDataSource(srcPath, options=dsco)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3005)
+    lyr = srcDS.CreateLayer(layerName, srs, ogr.wkbPolygon, options=['GEOMETRY_NAME=SHAPE'])
+    for fieldName, fieldType in [('FIRE_NUMBER', ogr.OFTString), ('FIRE_YEAR', ogr.OFTInteger), ('FIRE_STATUS', ogr.OFTString),
+                                 ('FIRE_SIZE_HECTARES', ogr.OFTReal), ('LOAD_DATE', ogr.OFTDateTime)]:
+        lyr.CreateField(ogr.FieldDefn(fieldName, fieldType))
+
+    rnd = random.Random(seed)
+    statuses = ['Out', 'Under Control', 'Being Held', 'Out of Control', 'Fire of Note']
+    defn = lyr.GetLayerDefn()
+    lyr.StartTransaction()
+    for i in range(nFeatures):
+        x, y = rnd.uniform(300000, 1800000), rnd.uniform(400000, 1700000) # roughly the BC Albers extent of the province
+        size = rnd.uniform(50, 2000)
+        feat = ogr.Feature(defn)
+        feat.SetField('FIRE_NUMBER', "{}{:07d}".format(rnd.choice('CGKNRV'), i)) # unique, so it can be used as a keyColumn
+        feat.SetField('FIRE_YEAR', rnd.randint(2000, 2023))
+        feat.SetField('FIRE_STATUS', rnd.choice(statuses))
+        feat.SetField('FIRE_SIZE_HECTARES', size * size / 10000.0)
+        feat.SetField('LOAD_DATE', "2023/{:02d}/{:02d} 12:00:00".format(rnd.randint(1, 12), rnd.randint(1, 28)))
+        feat.SetGeometry(ogr.CreateGeometryFromWkt("POLYGON(({0} {1},{2} {1},{2} {3},{0} {3},{0} {1}))".format(x, y, x + size, y + size)))
+        lyr.CreateFeature(feat)
+        if i % 100000 == 99999: # commit in batches so memory stays flat
+            lyr.CommitTransaction()
+            lyr.StartTransaction()
+    lyr.CommitTransaction()
+    srcDS = None
+    return srcPath
+
+###############################################################################################################
+# Function to build benchmark jobs with the same ogrList layout ogrFromBCGW() uses:
+# [ogr2ogr, -a_srs, epsg, -f, driver, fileName, ds, -progress, -sql, @sqlFile, -overwrite, -nln, lyrName, ...]
+def makeJobs(srcPath, workDir, sqlList, outType="GPKG", ext=".gpkg", extraOptions=None):
+    jobs = []
+    for n, sqlQuery in enumerate(sqlList):
+        stagingDir = ogrScheduler.makeJobStagingDir(os.path.join(workDir, "staging"), n, "bench") # FUNCTION CALL
+        sqlFile = os.path.join(stagingDir, "query.sql")
+        with open(sqlFile, 'w') as thing:
+            thing.write(sqlQuery)
+        fileName = os.path.join(workDir, "out", "bench_{}{}".format(n, ext))
+        ogrList = ['ogr2ogr', '-a_srs', 'epsg:3005', '-f', outType, fileName, srcPath, '-progress', '-sql', '@{}'.format(sqlFile),
+                   '-overwrite', '-nln', 'bench_{}'.format(n)] + list(extraOptions or [])
+        jobs.append({'n':n, 'paramName':'bench_{}'.format(n), 'database':'benchmark', 'ogrList':ogrList, 'fileName':fileName,
+                     'ds':srcPath, 'outType':outType, 'outPath':os.path.dirname(fileName), 'outName':'bench_{}'.format(n),
+                     'sqlFile':sqlFile, 'stagingDir':stagingDir})
+    os.makedirs(os.path.join(workDir, "out"), exist_ok=True)
+    return jobs
+
+###############################################################################################################
+# Benchmark SQL - a mix of filtered and full-table queries, like a typical params file
+def benchmarkSQL(nRows, layerName="FIRE_POLYS_SP"):
+    templates = ["select FIRE_NUMBER, FIRE_YEAR, FIRE_STATUS, SHAPE from {0} where FIRE_NUMBER like 'N%'",
+                 "select * from {0} where FIRE_YEAR >= 2015",
+                 "select FIRE_NUMBER, FIRE_SIZE_HECTARES, SHAPE from {0} where FIRE_STATUS = 'Out of Control'",
+                 "select * from {0}"]
+    return [templates[i % len(templates)].format(layerName) for i in range(nRows)]
+
+###############################################################################################################
+def printResultsTable(title, columns, rows):
+    widths = [max(len(str(c)), max([len(str(r[i])) for r in rows] or [0])) for i, c in enumerate(columns)]
+    line = "  ".join("{:>{}}".format(c, w) for c, w in zip(columns, widths))
+    print("\n{}\n{}\n{}".format(title, line, "="*len(line)))
+    for r in rows:
+        print("  ".join("{:>{}}".format(str(v), w) for v, w in zip(r, widths)))
+
+###############################################################################################################
+# Engines benchmark: the same jobs through the GDAL engine and the subprocess engine, one worker each so only the engine differs
+def benchEngines(args, workDir):
+    srcPath = makeSyntheticSource(os.path.join(workDir, "source.gpkg"), args.features) # FUNCTION CALL
+    rows = []
+    for engine in ['gdal', 'subprocess']:
+        if engine == 'subprocess' and shutil.which('ogr2ogr') is None:
+            print("ogr2ogr is not on the PATH; skipping the subprocess engine")
+            continue
+        jobs = makeJobs(srcPath, os.path.join(workDir, engine), benchmarkSQL(args.rows)) # FUNCTION CALL
+        start = time.time()
+        results = ogrScheduler.runJobs(jobs, 1, 1, ogrEngines.getRunner(engine)) # FUNCTION CALL
+        total = time.time() - start
+        ogrEngines.closeSources()
+        failed = len([r for r in results if r['status'] != 'OK'])
+        rows.append([engine, len(jobs), failed, "{:.2f}".format(total), "{:.3f}".format(total / max(1, len(jobs)))])
+    printResultsTable("Engine comparison ({} features, {} rows)".format(args.features, args.rows),
+                      ['engine', 'rows', 'failed', 'total s', 's per row'], rows)
+
+###############################################################################################################
+# Function to give 'nChanged' evenly spread source rows a newer LOAD_DATE (and a new status), like a day's worth of edits in BCGW
+def touchSourceRows(srcPath, nChanged, layerName="FIRE_POLYS_SP", loadDate="2024-01-15T08:00:00Z"):
+    srcDS = ogr.Open(srcPath, 1)
+    step = max(1, srcDS.GetLayerByName(layerName).GetFeatureCount() // max(1, nChanged))
+    srcDS.ExecuteSQL("UPDATE {0} SET LOAD_DATE = '{1}', FIRE_STATUS = 'Out' WHERE fid IN (SELECT fid FROM {0} WHERE fid % {2} = 0 LIMIT {3})".format(
+        layerName, loadDate, step, nChanged))
+    srcDS = None
+
+###############################################################################################################
+# Incremental benchmark: full run, incremental run after some source rows change, then a forced full run for comparison
+def benchIncremental(args, workDir):
+    srcPath = makeSyntheticSource(os.path.join(workDir, "source.gpkg"), args.features) # FUNCTION CALL
+    sqlQuery = "select FIRE_NUMBER, FIRE_YEAR, FIRE_STATUS, FIRE_SIZE_HECTARES, LOAD_DATE, SHAPE from FIRE_POLYS_SP"
+    runner = ogrIncremental.getIncrementalRunner(ogrEngines.getRunner("gdal")) # FUNCTION CALL
+    rows = []
+    for label in ['first run', 'after edits', 'forced full']:
+        if label == 'after edits':
+            touchSourceRows(srcPath, args.changed) # FUNCTION CALL
+        jobs = makeJobs(srcPath, workDir, [sqlQuery]) # FUNCTION CALL - same output file every time
+        jobs[0]['incremental'] = ogrIncremental.incrementalSettings(jobs[0]['paramName'], 'LOAD_DATE', 'FIRE_NUMBER') # FUNCTION CALL
+        if label == 'forced full' and os.path.exists(ogrIncremental.statePath(jobs[0]['fileName'])):
+            os.remove(ogrIncremental.statePath(jobs[0]['fileName']))
+        mode = ogrIncremental.planRun(jobs[0], ogrIncremental.readState(jobs[0]['fileName']))[0] # FUNCTION CALL
+        result = ogrScheduler.runJobs(jobs, 1, 1, runner)[0] # FUNCTION CALL
+        ogrEngines.closeSources()
+
+        outDS = ogr.Open(jobs[0]['fileName'])
+        outLyr = outDS.GetLayerByName(jobs[0]['outName'])
+        outLyr.SetAttributeFilter("FIRE_STATUS = 'Out' AND LOAD_DATE >= '2024-01-01'")
+        edited = outLyr.GetFeatureCount()
+        outLyr.SetAttributeFilter(None)
+        rows.append([label, mode, result['status'], outLyr.GetFeatureCount(), edited, "{:.2f}".format(result['seconds'])])
+        outDS = None
+    printResultsTable("Incremental vs full ({} features, {} changed)".format(args.features, args.changed),
+                      ['run', 'mode', 'status', 'output rows', 'edited rows', 'seconds'], rows)
+
+###############################################################################################################
+# Fan-out benchmark: the same query written as GPKG, KML and GeoJSON - one row per format (three source reads) vs one fan-out row (one read)
+def benchFanOut(args, workDir):
+    srcPath = makeSyntheticSource(os.path.join(workDir, "source.gpkg"), args.features) # FUNCTION CALL
+    sqlQuery = benchmarkSQL(1)[0]
+    formats = [('GPKG', '.gpkg', []), ('KML', '.kml', ['-t_srs', 'EPSG:4326']), ('GeoJSON', '.json', ['-lco', 'WRITE_NAME=NO'])]
+    rows = []
+    for engine in ['gdal', 'subprocess']:
+        if engine == 'subprocess' and shutil.which('ogr2ogr') is None:
+            print("ogr2ogr is not on the PATH; skipping the subprocess engine")
+            continue
+        runner = ogrEngines.getRunner(engine) # FUNCTION CALL
+
+        jobs = []
+        for outType, ext, options in formats:
+            jobs += makeJobs(srcPath, os.path.join(workDir, engine, "separate_" + ext[1:]), [sqlQuery], outType, ext, options) # FUNCTION CALL
+        start = time.time()
+        results = ogrScheduler.runJobs(jobs, 1, 1, runner) # FUNCTION CALL
+        rows.append([engine, 'one row per format', len(jobs), len([r for r in results if r['status'] != 'OK']), "{:.2f}".format(time.time() - start)])
+        ogrEngines.closeSources()
+
+        job = makeJobs(srcPath, os.path.join(workDir, engine, "fanout"), [sqlQuery])[0] # FUNCTION CALL
+        job['fanOut'] = [{'outType':outType, 'fileName':os.path.splitext(job['fileName'])[0] + ext, 'formatOptions':['-nln', job['outName']] + options}
+                         for outType, ext, options in formats]
+        start = time.time()
+        results = ogrScheduler.runJobs([job], 1, 1, runner) # FUNCTION CALL
+        rows.append([engine, 'fan-out (GPKG;KML;GeoJSON)', 1, len([r for r in results if r['status'] != 'OK']), "{:.2f}".format(time.time() - start)])
+        ogrEngines.closeSources()
+    printResultsTable("Multi-format fan-out ({} features)".format(args.features), ['engine', 'approach', 'source reads', 'failed', 'total s'], rows)
+
+###############################################################################################################
+# outTypes and the options formatOptions() in ogrFromBCGW_csv_FINAL.py gives them (KML is written in EPSG:4326)
+outTypeList = [('GeoJSON', '.json', ['-lco', 'WRITE_NAME=NO']),
+               ('KML', '.kml', ['-t_srs', 'EPSG:4326']),
+               ('ESRI Shapefile', '.shp', []),
+               ('GPKG', '.gpkg', []),
+               ('FlatGeobuf', '.fgb', ['-lco', 'SPATIAL_INDEX=YES']),
+               ('Parquet', '.parquet', ['-lco', 'WRITE_COVERING_BBOX=YES', '-lco', 'SORT_BY_BBOX=YES', '-lco', 'ROW_GROUP_SIZE=65536', '-lco', 'COMPRESSION=ZSTD'])]
+
+# Function to make 'nWindows' random square search windows (BC Albers), like the bbox filters downstream jobs use
+def makeWindows(nWindows, size=25000, seed=7):
+    rnd = random.Random(seed)
+    windows = []
+    for i in range(nWindows):
+        x, y = rnd.uniform(300000, 1800000 - size), rnd.uniform(400000, 1700000 - size)
+        windows.append((x, y, x + size, y + size))
+    return windows
+
+def _toLonLat(window):
+    srs3005, srs4326 = osr.SpatialReference(), osr.SpatialReference()
+    srs3005.ImportFromEPSG(3005)
+    srs4326.ImportFromEPSG(4326)
+    srs4326.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ring = ogr.CreateGeometryFromWkt("POLYGON(({0} {1},{2} {1},{2} {3},{0} {3},{0} {1}))".format(*window))
+    ring.Transform(osr.CoordinateTransformation(srs3005, srs4326))
+    minX, maxX, minY, maxY = ring.GetEnvelope()
+    return (minX, minY, maxX, maxY)
+
+###############################################################################################################
+# Formats benchmark: the whole layer written in each outType, then the same bounding-box reads against every output
+def benchFormats(args, workDir):
+    srcPath = makeSyntheticSource(os.path.join(workDir, "source.gpkg"), args.features) # FUNCTION CALL
+    sqlQuery = "select * from FIRE_POLYS_SP"
+    windows = makeWindows(args.windows) # FUNCTION CALL
+    runner = ogrEngines.getRunner("gdal") # FUNCTION CALL
+    rows = []
+    for outType, ext, options in outTypeList:
+        if ogr.GetDriverByName(outType) is None:
+            print("The {} driver isn't in this GDAL build; skipping it".format(outType))
+            continue
+        job = makeJobs(srcPath, os.path.join(workDir, ext[1:]), [sqlQuery], outType, ext, options)[0] # FUNCTION CALL
+        result = ogrScheduler.runJobs([job], 1, 1, runner)[0] # FUNCTION CALL
+        ogrEngines.closeSources()
+        if result['status'] != 'OK':
+            rows.append([outType, 'FAILED', '', '', ''])
+            continue
+        outDir = os.path.dirname(job['fileName'])
+        sizeMB = sum(os.path.getsize(os.path.join(outDir, f)) for f in os.listdir(outDir)) / 1048576.0
+
+        found, start = 0, time.time()
+        for window in windows:
+            outDS = ogr.Open(job['fileName']) # opened each time, like a downstream job would
+            outLyr = outDS.GetLayer(0)
+            outLyr.SetSpatialFilterRect(*(_toLonLat(window) if outType == 'KML' else window))
+            for feat in outLyr:
+                found += 1
+            outDS = None
+        readMs = (time.time() - start) * 1000.0 / len(windows)
+        rows.append([outType, "{:.2f}".format(result['seconds']), "{:.1f}".format(sizeMB), "{:.1f}".format(readMs), found // len(windows)])
+    printResultsTable("bbox reads by outType ({} features, {} windows of 25 km)".format(args.features, len(windows)),
+                      ['outType', 'write s', 'MB', 'ms per bbox read', 'features per read'], rows)
+
+###############################################################################################################
+# GPKG benchmark: the whole layer written with ogr2ogr's defaults, then with the fast-write options (same as formatOptions() with gpkgFastWrite = "Y")
+def benchGpkg(args, workDir):
+    srcPath = makeSyntheticSource(os.path.join(workDir, "source.gpkg"), args.features) # FUNCTION CALL
+    fastOptions = ['-gt', 'unlimited', '-lco', 'SPATIAL_INDEX=NO', '--config', 'OGR_SQLITE_SYNCHRONOUS', 'OFF',
+                   '--config', 'OGR_SQLITE_JOURNAL', 'MEMORY', '--config', 'OGR_SQLITE_CACHE', '512']
+    rows = []
+    for engine in ['gdal', 'subprocess']:
+        if engine == 'subprocess' and shutil.which('ogr2ogr') is None:
+            print("ogr2ogr is not on the PATH; skipping the subprocess engine")
+            continue
+        for label, options in [('defaults', []), ('fast write', fastOptions)]:
+            job = makeJobs(srcPath, os.path.join(workDir, engine, label.replace(" ", "_")), ["select * from FIRE_POLYS_SP"], extraOptions=options)[0] # FUNCTION CALL
+            job['gpkgFastWrite'] = bool(options)
+            start = time.time()
+            result = ogrScheduler.runJobs([job], 1, 1, ogrEngines.getRunner(engine))[0] # FUNCTION CALL - includes finishGpkg() for the fast write
+            total = time.time() - start
+            ogrEngines.closeSources()
+            outDS = ogr.Open(job['fileName'])
+            indexed = outDS.GetLayer(0).TestCapability(ogr.OLCFastSpatialFilter) if outDS is not None else False
+            outDS = None
+            rows.append([engine, label, result['status'], "{:.2f}".format(total), "{:,.0f}".format(args.features / max(total, 0.001)),
+                         "{:.1f}".format(os.path.getsize(job['fileName']) / 1048576.0), 'yes' if indexed else 'no'])
+    printResultsTable("GPKG write ({} features)".format(args.features), ['engine', 'profile', 'status', 'total s', 'features/s', 'MB', 'spatial index'], rows)
+
+###############################################################################################################
+# Precision benchmark: the same layer written at full precision, then rounded with the options a row's coordPrec gives (ogrEngines.precisionOptions)
+def benchPrecision(args, workDir):
+    srcPath = makeSyntheticSource(os.path.join(workDir, "source.gpkg"), args.features) # FUNCTION CALL
+    runner = ogrEngines.getRunner("gdal") # FUNCTION CALL
+    rows = []
+    for outType, ext, options in [o for o in outTypeList if o[0] in ('GeoJSON', 'KML', 'GPKG', 'FlatGeobuf')]:
+        fullMB = None
+        for coordPrec in [None, 3, 2, 1, 0]:
+            precision = ogrEngines.precisionOptions(outType, coordPrec, geographic=(outType == 'KML')) # FUNCTION CALL
+            label = 'full' if coordPrec is None else str(coordPrec)
+            job = makeJobs(srcPath, os.path.join(workDir, ext[1:], label), ["select * from FIRE_POLYS_SP"], outType, ext, options + precision)[0] # FUNCTION CALL
+            result = ogrScheduler.runJobs([job], 1, 1, runner)[0] # FUNCTION CALL
+            ogrEngines.closeSources()
+            if result['status'] != 'OK':
+                rows.append([outType, label, 'FAILED', '', '', ''])
+                continue
+            sizeMB = os.path.getsize(job['fileName']) / 1048576.0
+            fullMB = sizeMB if coordPrec is None else fullMB
+            rows.append([outType, label, " ".join(precision) or '-', "{:.2f}".format(result['seconds']), "{:.1f}".format(sizeMB),
+                         "{:.0f}%".format(100.0 * sizeMB / fullMB) if fullMB else ''])
+    printResultsTable("Output size by coordPrec ({} features)".format(args.features), ['outType', 'coordPrec', 'options', 'write s', 'MB', 'of full'], rows)
+
+###############################################################################################################
+# Function to read a params file's rows as (paramName, outTypes, output column names, coordPrec, snapGrid, simplify)
+def readReplayRows(paramsPath):
+    rows = []
+    with open(paramsPath, 'r', newline='') as thing:
+        for row in csv.DictReader(thing):
+            if not (row.get('paramName') or "").strip():
+                continue
+            sqlQuery = (row.get('sqlQuery') or "").strip().strip('"').strip("'").replace('"', "'")
+            names = [name.upper() for name in ogrCache.selectNames(sqlQuery) if name.upper() not in ('SHAPE', 'GEOMETRY', 'GEOM')] # FUNCTION CALL
+            outTypes = [t.strip() for t in (row.get('outType') or "GPKG").split(";") if t.strip()]
+            rows.append((row['paramName'].strip(), outTypes, names, row.get('coordPrec') or 1, row.get('snapGrid'), row.get('simplify')))
+    return rows
+
+# Function to add the params file's columns that the synthetic layer doesn't have, as text columns with a few hundred distinct values
+def addReplayColumns(srcPath, names, layerName="FIRE_POLYS_SP"):
+    srcDS = ogr.Open(srcPath, 1)
+    lyr = srcDS.GetLayerByName(layerName)
+    existing = set(lyr.GetLayerDefn().GetFieldDefn(i).GetName().upper() for i in range(lyr.GetLayerDefn().GetFieldCount()))
+    for name in sorted(set(names) - existing):
+        lyr.CreateField(ogr.FieldDefn(name, ogr.OFTString))
+        srcDS.ExecuteSQL("UPDATE {0} SET {1} = '{1} ' || (OGC_FID % 500)".format(layerName, name))
+    srcDS = None
+
+# Replay benchmark: every row of a params file, at several scales, through each engine - timed by the rows' telemetry records
+def benchReplay(args, workDir):
+    replayRows = readReplayRows(args.params) # FUNCTION CALL
+    allNames = sorted(set(name for row in replayRows for name in row[2]))
+    engines = [e for e in args.engines.split(",") if e]
+    if 'subprocess' in engines and shutil.which('ogr2ogr') is None:
+        print("ogr2ogr is not on the PATH; skipping the subprocess engine")
+        engines.remove('subprocess')
+    optionsFor = dict((outType, (ext, options)) for outType, ext, options in outTypeList)
+
+    totals, rows = {}, []
+    for scale in [int(s) for s in args.scales.split(",") if s]:
+        srcPath = makeSyntheticSource(os.path.join(workDir, "replay_{}.sqlite".format(scale)), scale, "SQLite") # FUNCTION CALL - SpatiaLite
+        addReplayColumns(srcPath, allNames) # FUNCTION CALL
+        for engine in engines:
+            jobs = []
+            for paramName, outTypes, names, coordPrec, snapGrid, simplify in replayRows:
+                for outType in [t for t in outTypes if t in optionsFor]: # one job per outType
+                    ext, options = optionsFor[outType]
+                    precision = ogrEngines.precisionOptions(outType, coordPrec, snapGrid, simplify, geographic=(outType == 'KML')) # FUNCTION CALL
+                    sqlQuery = "select {} from FIRE_POLYS_SP".format(", ".join(names + ['SHAPE']) if names else "*")
+                    job = makeJobs(srcPath, os.path.join(workDir, str(scale), engine, str(len(jobs))), [sqlQuery], outType, ext, options + precision)[0] # FUNCTION CALL
+                    job['n'], job['paramName'] = len(jobs), "{} {}".format(paramName, outType)
+                    jobs.append(job)
+            logPath = os.path.join(workDir, "telemetry.jsonl")
+            runId = "{} {}".format(scale, engine)
+            runner = ogrTelemetry.getTelemetryRunner(ogrEngines.getRunner(engine), logPath, runId, engine) # FUNCTION CALL
+            start = time.time()
+            ogrScheduler.runJobs(jobs, args.workers, args.workers, runner) # FUNCTION CALL
+            wall = time.time() - start
+            ogrEngines.closeSources()
+            records = ogrTelemetry.readRecords(logPath, runId) # FUNCTION CALL
+            total = {'wall':wall, 'rowSeconds':sum(r['totalSeconds'] for r in records), 'failed':len([r for r in records if r['status'] != 'OK']),
+                     'features':sum(r['rows'] or 0 for r in records), 'MB':sum(r['bytesOut'] for r in records) / 1048576.0,
+                     'peakRssMB':max([r['peakRssMB'] or 0 for r in records] + [r['childPeakRssMB'] or 0 for r in records])}
+            totals[runId] = total
+            rows.append([scale, engine, len(records), total['failed'], "{:.2f}".format(wall), "{:.2f}".format(total['rowSeconds']),
+                         "{:,.0f}".format(total['features'] / max(wall, 0.001)), "{:.1f}".format(total['MB']), "{:.0f}".format(total['peakRssMB'])])
+
+    columns = ['features', 'engine', 'jobs', 'failed', 'wall s', 'row s', 'features/s', 'MB out', 'peak MB']
+    if args.baseline:
+        with open(args.baseline, 'r') as thing:
+            baseline = json.load(thing)
+        columns.append('wall vs baseline')
+        for r in rows:
+            before = baseline.get("{} {}".format(r[0], r[1]))
+            r.append("{:+.0f}%".format(100.0 * (float(r[4]) / before['wall'] - 1)) if before and before['wall'] else "n/a")
+    printResultsTable("Replay of {} ({} row(s), {} worker(s))".format(args.params, len(replayRows), args.workers), columns, rows)
+    if args.save:
+        with open(args.save, 'w') as thing:
+            json.dump(totals, thing, indent=2)
+        print("\nTotals saved to {}; compare a later run with --baseline {}".format(args.save, args.save))
+
+###############################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the ogrFromBCGW exporters")
+    parser.add_argument('benchmark', choices=['engines', 'incremental', 'fanout', 'formats', 'gpkg', 'precision', 'replay'])
+    parser.add_argument('--features', type=int, default=100000, help="features in the synthetic source layer")
+    parser.add_argument('--rows', type=int, default=10, help="params rows (jobs) to run per engine")
+    parser.add_argument('--changed', type=int, default=500, help="source rows edited between runs (incremental benchmark)")
+    parser.add_argument('--windows', type=int, default=20, help="bounding-box reads per output (formats benchmark)")
+    parser.add_argument('--params', default='ogrParams.csv', help="params file to replay (replay benchmark)")
+    parser.add_argument('--scales', default='10000,100000,1000000', help="synthetic layer sizes to replay at, separated by commas (replay benchmark)")
+    parser.add_argument('--engines', default='gdal,subprocess', help="engines to replay with, separated by commas (replay benchmark)")
+    parser.add_argument('--workers', type=int, default=1, help="maxWorkers for the replay; 1 keeps the timings and peak memory per row clean")
+    parser.add_argument('--save', default=None, help="save the replay totals to this .json file")
+    parser.add_argument('--baseline', default=None, help="compare the replay with totals saved earlier with --save")
+    parser.add_argument('--workDir', default=None, help="scratch folder (default: a new temp folder, deleted afterwards)")
+    args = parser.parse_args()
+
+    if ogr is None:
+        print("osgeo is not available in this Python; run the benchmark from the OSGeo4W shell"), sys.exit(1)
+    ogr.UseExceptions()
+
+    workDir = args.workDir or tempfile.mkdtemp(prefix="ogrBenchmark_")
+    try:
+        {'engines':benchEngines, 'incremental':benchIncremental, 'fanout':benchFanOut, 'formats':benchFormats, 'gpkg':benchGpkg,
+         'precision':benchPrecision, 'replay':benchReplay}[args.benchmark](args, workDir)
+    finally:
+        if args.workDir is None:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+
+# ogrCache.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# A local cache of finished outputs, so a row whose query, output options and source data haven't changed since it was last run
+# is copied from the cache instead of being pulled from Oracle again.
+# Each cache entry is keyed on a hash of:
+#   - the row's final SQL (after placeholders, date re-writes and select * expansion), with whitespace normalized
+#   - the ogr2ogr options that shape the output (format, SRS, layer name, -lco / -dsco ..), but not the output path or the login
+#   - a cheap fingerprint of the source data: COUNT(*) and MAX(<update date column>) of the row's query
+# Set useCache = "N" (next to 'paramsFileName') or run with --no-cache to skip the cache for a run.
+
+"""HOW THE CACHE WORKS:
+--------------------------------------------------------------------------------------
+1. Before the rows run, each row's fingerprint query is run on the database:  select count(*), max(<dateColumn>) from ( <sqlQuery> )
+   The dateColumn is the row's optional 'cacheDateColumn' value in ogrParams.csv, otherwise the first column in the select list
+   that looks like an update date (ex. WHEN_UPDATED, UPDATE_DATE, LOAD_DATE, CHANGE_TIMESTAMP).
+   If the source is a local file (ex. a .gpkg or .sqlite stand-in) its size and modified time are used instead of a query.
+
+2. If an entry with the same key is in the cache, its files are copied to the row's output path (hard-linked instead, if hardLink = True)
+   and the row isn't run. The summary table shows the row as OK, with the copy time.
+
+3. Otherwise the row runs as usual; if it finishes OK its outputs are copied into the cache under that key.
+   The fingerprint is taken before the row runs, so a change made to the source during the run is caught next time.
+
+4. Rows without an update date column can only notice records being added or removed (COUNT(*)), so their entries are only
+   used for 'noDateMaxHours' hours. Entries with an update date column are kept until they're evicted.
+
+5. When the cache is over 'maxCacheGB', the least recently used entries are deleted until it fits.
+
+6. Incremental rows (watermarkColumn) and rows without -overwrite are never cached - they build on the existing output.
+   Rows with dependsOn aren't cached either, as their output depends on other rows' outputs, not just the database.
+   Rows that fail the fingerprint query (or any row, if osgeo can't be imported for the query) run as usual.
+
+7. With hardLink = True a restored output and its cache entry are the same file on disk: editing the output (ex. in QGIS) edits the cache too.
+   Outputs that are hard links are deleted before their row runs again, so ogr2ogr -overwrite never writes into the cache.
+   Hard links only work when the cache and the outputs are on the same drive; otherwise the files are copied.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+import ogrColumns # companion modules - must be in the same folder as this script
+import ogrPlanner
+import ogrScheduler
+import sqlDateRewriter
+
+cacheRoot = r"T:\ogrCache"
+maxCacheGB = 20
+hardLink = False # True hard-links cached outputs into place instead of copying them (same drive only, see 7. above)
+noDateMaxHours = 24 # entries whose query has no update date column are only trusted for this long
+dateColumnRegex = re.compile(r"^(WHEN_UPDATED|(\w*_)?(UPDATE|UPDATED|LOAD|CHANGE|MODIFIED|REVISION)_?(DATE|TIMESTAMP|DT))$", re.IGNORECASE)
+shapefileParts = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.qix', '.sbn', '.sbx')
+entryFileName = "entry.json"
+
+###############################################################################################################
+# Function to list the files that make up one output, ex. a shapefile's .shp / .shx / .dbf / .prj
+def outputFiles(fileName):
+    base, ext = os.path.splitext(fileName)
+    if ext.lower() != '.shp':
+        return [fileName]
+    return [base + part for part in shapefileParts if os.path.exists(base + part)]
+
+###############################################################################################################
+# Function to return why a row can't use the cache, or None if it can
+def notCacheable(job):
+    if job.get('incremental'):
+        return "incremental row"
+    if '-overwrite' not in job['ogrList']:
+        return "row doesn't overwrite its output"
+    if job.get('database') == 'scratch':
+        return "row reads a shared-scan scratch file"
+    if job.get('dependsOn'):
+        return "row depends on other rows' outputs"
+    return None
+
+###############################################################################################################
+# Function to pick the column whose MAX() shows a change to the source: cacheDateColumn, else the first select list item named like an update date
+def dateColumnFor(sqlString, cacheDateColumn=None):
+    if cacheDateColumn:
+        return cacheDateColumn.strip()
+    for name in selectNames(sqlString): # FUNCTION CALL
+        if dateColumnRegex.match(name):
+            return name
+    return None
+
+# Function to return the output column names of a query's select list (the alias, or the column name without its table prefix)
+def selectNames(sqlString):
+    parsed = ogrColumns._parseQuery(sqlDateRewriter.tokenize(sqlString)) # FUNCTION CALL
+    if parsed is None:
+        return []
+    names = []
+    for item in parsed['items']:
+        m = re.search(r"([A-Za-z_][\w$#]*)\"?\s*$", item.strip())
+        if m and not item.strip().endswith('*'):
+            names.append(m.group(1))
+    return names
+
+###############################################################################################################
+# Function to fingerprint a row's source data. 'fetch' runs a query and returns (columns, rows), like ogrPlanner.gdalFetcher()
+def sourceFingerprint(job, sqlString, fetch):
+    if os.path.isfile(job['ds']): # local stand-in source - its size and modified time are enough
+        stat = os.stat(job['ds'])
+        return {'fileSize':stat.st_size, 'fileModified':stat.st_mtime_ns}
+    dateColumn = dateColumnFor(sqlString, job.get('cacheDateColumn')) # FUNCTION CALL
+    select = "count(*), max({})".format(dateColumn) if dateColumn else "count(*)"
+    columns, rows = fetch("select {} from ({}) ogr_cache_fp".format(select, ogrPlanner.stripOrderBy(sqlString))) # FUNCTION CALL
+    return {'rows':rows[0][0], 'dateColumn':dateColumn, 'maxDate':str(rows[0][1]) if dateColumn else None}
+
+###############################################################################################################
+# Function to build a row's cache key from its SQL, its output options and the source fingerprint
+def cacheKey(job, sqlString, fingerprint):
+    paths = set([job['fileName'], job['ds'], "@" + job['sqlFile']])
+    options = [arg for arg in job['ogrList'][2:] if arg not in paths] # [2:] drops the OSGeo4W launcher / ogr2ogr.exe
+    fanOut = [[spec['outType'], spec['formatOptions']] for spec in job.get('fanOut') or []]
+    source = re.sub(r"^OCI:[^@]*@", "OCI:", job['ds']) # the database, without the login
+    keyParts = [" ".join(sqlString.split()), options, fanOut, source, job.get('outType'), fingerprint]
+    return hashlib.sha256(json.dumps(keyParts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def entryDir(key):
+    return os.path.join(cacheRoot, key[:2], key)
+
+def _readEntry(key):
+    try:
+        with open(os.path.join(entryDir(key), entryFileName), 'r') as thing:
+            return json.load(thing)
+    except (OSError, ValueError): # missing or half-written entry - treated as a miss
+        return None
+
+def _writeEntry(folder, entry):
+    tmpPath = os.path.join(folder, entryFileName + ".tmp")
+    with open(tmpPath, 'w') as thing:
+        json.dump(entry, thing, indent=2)
+    os.replace(tmpPath, os.path.join(folder, entryFileName))
+
+###############################################################################################################
+# Function to put one file in place: a hard link if hardLink is on (and the drive allows it), otherwise a copy
+def _placeFile(src, dst, link):
+    if os.path.exists(dst):
+        os.remove(dst)
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError: # different drive, or a file system without hard links
+            pass
+    shutil.copy2(src, dst)
+
+def _isHardLink(fileName):
+    try:
+        return os.stat(fileName).st_nlink > 1
+    except OSError:
+        return False
+
+###############################################################################################################
+# Function to check every job against the cache before the run. Hits are restored now and dropped from the job list;
+# misses get a 'cacheKey' so storeResults() can save their outputs afterwards. Returns (jobs left to run, results for the hits).
+# fetchFor(job) returns the fetch function for a job's database; by default one from ogrPlanner.gdalFetcher()
+def restoreCachedJobs(jobs, fetchFor=None):
+    if fetchFor is None:
+        if ogrPlanner.gdal is None:
+            print("\nosgeo.gdal is not available in this Python, so the cache can't fingerprint the source data; every row will run.")
+            return jobs, []
+        ogrPlanner.gdal.UseExceptions()
+        fetchFor = lambda job: ogrPlanner.gdalFetcher(job['ds'])
+
+    msg = "Checking the output cache ({})".format(cacheRoot)
+    print("\n{}\n{}".format(msg, "-"*len(msg)))
+    toRun, hits = [], []
+    for job in jobs:
+        reason = notCacheable(job) # FUNCTION CALL
+        if reason is not None:
+            print("{:<30} not cached ({})".format(str(job['paramName'])[:30], reason))
+            toRun.append(job)
+            continue
+        with open(job['sqlFile'], 'r') as thing:
+            sqlString = thing.read()
+        try:
+            fingerprint = sourceFingerprint(job, sqlString, fetchFor(job)) # FUNCTION CALL
+        except Exception as error:
+            print("{:<30} not cached (fingerprint query failed: {})".format(str(job['paramName'])[:30], re.sub(r"\s+", " ", str(error))[:80]))
+            toRun.append(job)
+            continue
+        key = cacheKey(job, sqlString, fingerprint) # FUNCTION CALL
+        entry = _readEntry(key) # FUNCTION CALL
+        if entry is not None and fingerprint.get('maxDate') is None and 'fileSize' not in fingerprint and time.time() - entry['created'] > noDateMaxHours * 3600:
+            entry = None # count-only fingerprint, too old to trust
+        if entry is None:
+            job['cacheKey'], job['cacheFingerprint'] = key, fingerprint
+            for fileName in ogrScheduler.jobOutputs(job): # FUNCTION CALL
+                for part in outputFiles(fileName): # FUNCTION CALL
+                    if _isHardLink(part):
+                        os.remove(part) # a restored hard link - don't let ogr2ogr -overwrite write into the cache
+            print("{:<30} miss".format(str(job['paramName'])[:30]))
+            toRun.append(job)
+            continue
+        hits.append(_restoreEntry(job, key, entry)) # FUNCTION CALL
+    return toRun, hits
+
+# Function to copy (or link) a cache entry's files to a job's outputs and return a result like ogrScheduler's
+def _restoreEntry(job, key, entry):
+    result = ogrScheduler.newJobResult(job) # FUNCTION CALL
+    start = time.time()
+    try:
+        for i, fileName in enumerate(ogrScheduler.jobOutputs(job)): # FUNCTION CALL
+            os.makedirs(os.path.dirname(fileName) or ".", exist_ok=True)
+            for partName in entry['outputs'][i]:
+                _placeFile(os.path.join(entryDir(key), partName), os.path.splitext(fileName)[0] + os.path.splitext(partName)[1], hardLink) # FUNCTION CALL
+        entry['lastUsed'] = time.time()
+        _writeEntry(entryDir(key), entry) # FUNCTION CALL
+        result['status'], result['returncode'] = 'OK', 0
+        result['stdout'] = "restored from the output cache ({}), first made {}".format(key[:12], time.strftime("%Y-%m-%d %H:%M", time.localtime(entry['created'])))
+        print("{:<30} hit - {}".format(str(job['paramName'])[:30], result['stdout']))
+    except (OSError, IndexError, KeyError) as error:
+        result['stderr'] = "couldn't restore from the output cache: {}".format(error)
+    result['seconds'] = time.time() - start
+    return result
+
+###############################################################################################################
+# Function to save the outputs of the rows that ran OK (and had a cache miss), then trim the cache to maxCacheGB
+def storeResults(jobs, results):
+    byN = dict((job['n'], job) for job in jobs if job.get('cacheKey'))
+    stored = 0
+    for r in results:
+        job = byN.get(r['n'])
+        if job is None or r['status'] != 'OK':
+            continue
+        folder = entryDir(job['cacheKey'])
+        tmpFolder = folder + ".tmp"
+        try:
+            shutil.rmtree(tmpFolder, ignore_errors=True)
+            os.makedirs(tmpFolder)
+            outputs, size = [], 0
+            for i, fileName in enumerate(ogrScheduler.jobOutputs(job)): # FUNCTION CALL
+                parts = []
+                for part in outputFiles(fileName): # FUNCTION CALL
+                    partName = "out{}{}".format(i, os.path.splitext(part)[1])
+                    shutil.copy2(part, os.path.join(tmpFolder, partName)) # always a copy, so later edits to the output can't reach the cache
+                    size += os.path.getsize(part)
+                    parts.append(partName)
+                outputs.append(parts)
+            _writeEntry(tmpFolder, {'paramName':job['paramName'], 'created':time.time(), 'lastUsed':time.time(),
+                                    'bytes':size, 'fingerprint':job['cacheFingerprint'], 'outputs':outputs}) # FUNCTION CALL
+            shutil.rmtree(folder, ignore_errors=True)
+            os.replace(tmpFolder, folder)
+            stored += 1
+        except OSError as error:
+            shutil.rmtree(tmpFolder, ignore_errors=True)
+            print("Couldn't save {} to the output cache: {}".format(job['paramName'], error))
+    evicted = evictEntries() # FUNCTION CALL
+    if stored or evicted:
+        print("\nOutput cache: {} row(s) saved, {} old entr{} evicted".format(stored, evicted, "y" if evicted == 1 else "ies"))
+
+###############################################################################################################
+# Function to delete the least recently used entries until the cache fits in maxGB. Returns how many were deleted
+def evictEntries(maxGB=None):
+    maxBytes = (maxCacheGB if maxGB is None else maxGB) * 1024**3
+    entries = []
+    if not os.path.isdir(cacheRoot):
+        return 0
+    for prefix in os.listdir(cacheRoot):
+        prefixDir = os.path.join(cacheRoot, prefix)
+        if not os.path.isdir(prefixDir):
+            continue
+        for key in os.listdir(prefixDir):
+            entry = _readEntry(key) if not key.endswith(".tmp") else None # FUNCTION CALL
+            if entry is not None:
+                entries.append((entry['lastUsed'], entry['bytes'], key))
+    total, evicted = sum(e[1] for e in entries), 0
+    for lastUsed, size, key in sorted(entries):
+        if total <= maxBytes:
+            break
+        shutil.rmtree(entryDir(key), ignore_errors=True)
+        total -= size
+        evicted += 1
+    return evicted
+
+# ex. jobs, cachedResults = restoreCachedJobs(jobs) # FUNCTION CALL
+#     results = ogrScheduler.runJobs(jobs, maxWorkers, dbConnectionCap, runner) + cachedResults
+#     storeResults(jobs, results) # FUNCTION CALL
@@ -13,6 +13,17 @@
 IT'S VERY IMPORTANT THAT THESE FILES ARE IN THE SAME FOLDER WHEN RUNNING THIS SCRIPT:
 1. ogrFromBCGW_csv_FINAL.py
 2. ogrParams.csv
+3. ogrScheduler.py
+4. ogrEngines.py
+5. sqlDateRewriter.py
+6. ogrIncremental.py
+7. ogrSharedScan.py
+8. ogrChunked.py
+9. ogrPlanner.py
+10. ogrColumns.py
+11. ogrCache.py
+12. ogrTelemetry.py
+13. ogrTuning.py
 --------------------------------------------------------------------------------------
 
 0. Each row in params_FINAL.csv is a set of values you are feeding into the ogrFromBCGW script.
@@ -22,7 +33,7 @@ Each column header becomes a key name in the dictionary generated from each row,
 paramName - a simple string like harvestParams
 outPath - location to save output to (will be created if it doesn't exist)
 outName - name of your output file (no extension, but placeholders are OK)
-outType - type of file ex. GPKG, KML
+outType - type of file ex. GPKG, KML. Several types can be listed with semicolons, ex. GPKG;KML;GeoJSON (see 15 below)
 sqlQuery - a query to draw the result from the BCGW. IMPORTANT - TEST IT BEFORE USING IN THIS SCRIPT
 ogrReadTheseColumns - this is a comma-seperated text list that tells the script which values to read in. The order doesn't matter
 
@@ -58,9 +69,85 @@ IF YOU MAKE CHANGES, REMEMBER TO SAVE THE .CSV FILE BEFORE RUNNING THIS SCRIPT !
 
 9. If outputting an ESRI Shapefile, it's normal to see 'Warning 6: Normalized/laundered field name:' This reducess field names to 10 characters long, which is the max length for a shapefile field.
 
+10. Date comparisons in the sqlQuery, like BLOCK_STATUS_DATE >= '01-SEP-17', can be re-written by sqlDateRewriter.py into index-friendly ranges,
+    ex. BLOCK_STATUS_DATE >= TO_DATE('2017-09-01', 'YYYY-MM-DD'). BETWEEN and any number of date terms per line are supported.
+    This is opt in: add an optional 'makeFriendlySQL' column to the .csv and set it to Y for the rows to re-write. Rows without it are sent exactly as written.
+    Dates are compared by calendar day, so for a DATE with a time, BLOCK_STATUS_DATE > '01-SEP-17' no longer matches 3pm on Sept 1st.
+    Only columns with 'DATE' in their name are re-written.
+
+11. Rows are run at the same time by ogrScheduler.py. 'maxWorkers' (how many rows at once) and 'dbConnectionCap' (how many of those can be
+    logged in to IDWPROD1 at once) are set next to the 'paramsFileName' variable. Set maxWorkers = 1 to run the rows one at a time, in file order.
+    Each row's ogr2ogr output is captured to ogr_stdout.txt / ogr_stderr.txt in its own T:\tempQueryFolder\job... folder,
+    and a summary table of all rows is printed at the end.
+
+12. Rows are run by the engine set in the 'ogrEngine' variable (next to 'paramsFileName'). The default, "gdal", runs ogr2ogr inside Python
+    (gdal.VectorTranslate) and keeps one database connection open per worker, so each row doesn't have to start ogr2ogr.exe and log in again.
+    Set ogrEngine = "subprocess" to run OSGeo4W / ogr2ogr.exe once per row, like older versions of this script.
+
+13. Rows can be run incrementally (ogrIncremental.py): add the optional columns 'watermarkColumn' (ex. LOAD_DATE) and 'keyColumn' (ex. FIRE_NUMBER)
+    to the .csv. After the first (full) run, only rows with watermarkColumn at or past the last run's newest value are pulled,
+    and they replace the rows with the same keyColumn value in the existing GPKG layer. The newest value is kept in a .ogrstate.json file next to the output.
+    Add an optional 'fullRefreshDays' column (ex. 7) to re-pull everything every so often, which drops records deleted from the source.
+    Incremental rows need outType GPKG, an outName that doesn't change between runs, and both columns in the sqlQuery's select list.
+
+14. Rows that read the same table with the same WHERE clause (ex. the same fire polygons, with different columns or KML styling)
+    are fetched from the database only once, into a scratch GeoPackage in T:\tempQueryFolder, and each of those rows' outputs is made from it (ogrSharedScan.py).
+    A report at the end shows the database round trips and bytes saved. Set shareScans = "N" (next to 'paramsFileName') to run every row on its own.
+
+15. outType can list several formats separated by semicolons, ex. GPKG;KML;GeoJSON. The row's SQL is then run against the database once,
+    and every feature is written to each format as it's read (one output file per format, each with its own extension and the usual
+    layer name / WRITE_NAME=NO / NameField options). KML outputs are reprojected to EPSG:4326 along the way.
+
+16. Very large layers (ex. VEG_COMP_LYR_R1_POLY) can be pulled in tiles (ogrChunked.py): add the optional columns 'chunkTiles' (ex. 4x4)
+    and 'keyColumn' (ex. FEATURE_ID). The BC Albers extent, or the area in the query's SDO_ANYINTERACT clause, is split into a grid, and each tile
+    is pulled with its own SDO_FILTER at the same time as the others, then merged into the row's GPKG with one copy of each keyColumn value.
+    Failed tiles are retried on their own, and an interrupted run picks up from the tiles already done (<output>.chunks.json).
+
+17. For outputs that get read over and over with a bounding box, use outType FlatGeobuf (.fgb, with a packed Hilbert R-tree spatial index)
+    or Parquet (.parquet, GeoParquet with bbox covering columns, spatially sorted 65536-row row groups and ZSTD compression).
+    Parquet needs a GDAL built with Arrow/Parquet support, ex. a recent OSGeo4W GDAL (SORT_BY_BBOX / WRITE_COVERING_BBOX need GDAL 3.9+).
+
+18. GPKG outputs are written with a 'fast write' profile: one transaction for the whole load (-gt unlimited), OGR_SQLITE_SYNCHRONOUS=OFF,
+    OGR_SQLITE_JOURNAL=MEMORY (the rollback journal is kept in memory instead of a -journal file next to the output), and no spatial index
+    during the load (-lco SPATIAL_INDEX=NO). When the row is finished, the R-tree is built in one pass and VACUUM / ANALYZE are run (ogrEngines.finishGpkg).
+    If the machine crashes mid-write, re-run the row. Set gpkgFastWrite = "N" (next to 'paramsFileName') to use ogr2ogr's defaults.
+
+19. Run with --plan (ex. python ogrFromBCGW_csv_FINAL.py --plan) to see how big each row is before anything runs (ogrPlanner.py).
+    Each row's query is costed with EXPLAIN PLAN (or --planMethod count for an exact COUNT(*)), a plan table of rows / MB / minutes is printed,
+    and after you confirm, the rows run longest first. Rows estimated over 2 GB that have a keyColumn are pulled in tiles (see 16.).
+
+20. 'select *' is expanded into the table's own column list (ogrColumns.py, looked up once per table in ALL_TAB_COLUMNS), leaving out LOB columns
+    (BLOB, CLOB, LONG ..) and annotation columns like SE_ANNO_CAD_DATA, which are slow to pull from the BCGW and can't be written to most formats.
+    Add the optional column 'keepColumns' (ex. FIRE_NUMBER;FIRE_YEAR) to keep only those columns (and the geometry). Set pruneColumns = "N" to leave select * alone.
+
+21. Outputs are kept in a local cache (ogrCache.py, T:\ogrCache). Before the rows run, each row's source is fingerprinted with a quick
+    select count(*), max(<update date column>) from ( <sqlQuery> ); if the SQL, output options and fingerprint match a cached output, it's copied into place
+    instead of pulling the data from the BCGW again. The update date column is the optional 'cacheDateColumn', or one named like WHEN_UPDATED / UPDATE_DATE.
+    The cache is trimmed to ogrCache.maxCacheGB (least recently used first). Run with --no-cache, or set useCache = "N", to pull every row fresh.
+
+22. Coordinates are rounded to 'coordPrec' decimal places of a metre (default 1, i.e. 0.1 m; KML gets the same in degrees), so GeoJSON / KML files
+    don't carry 15-digit coordinates. Optional columns: 'coordPrec' (ex. 2, or none to keep full precision), 'snapGrid' (snap vertices to a grid this
+    many metres wide, ex. 0.5) and 'simplify' (drop vertices within this many metres of the line, ex. 2). Rounding uses -xyRes (GDAL 3.9+) plus
+    COORDINATE_PRECISION for GeoJSON; with an older GDAL, -xyRes is left out (with a warning) and only GeoJSON is rounded.
+    Compare sizes and write times with:  python ogrBenchmark.py precision --features 100000
+
+23. Rows can depend on other rows: add the optional column 'dependsOn' with the paramNames of the rows whose outputs it uses (ex. aoiParams;roadsParams).
+    The row starts once those rows have finished OK, rows that don't depend on each other run at the same time, and if a row fails only the rows
+    downstream of it are skipped. Add --runId (ex. --runId weekly) to keep track of what each row made: running again with the same run id
+    skips rows whose query, options and outputs (and the outputs of the rows they depend on) haven't changed. See ogrScheduler.py.
+
+24. Every row that runs adds one JSON line to the 'telemetryLog' file (T:\tempQueryFolder\ogrTelemetry.jsonl, see ogrTelemetry.py): run id, status, exit code,
+    total / query / write seconds, rows and bytes written, and peak memory. Set telemetryLog = "" to turn it off.
+    To check an engine change for slowdowns offline, replay a params file against synthetic data:  python ogrBenchmark.py replay --params ogrParams.csv
+
+25. GDAL settings for every row come from 'tuningProfile' (next to 'paramsFileName'): "default" leaves GDAL's defaults, "bulk" uses big caches and one
+    transaction per output, "low-memory" uses small caches and small transactions. Run with --autotune to time a few settings on a sample of each source
+    table; the fastest is saved to 'tuningFile' and used for that table's rows from then on, instead of the profile. See ogrTuning.py.
+
 """
 
 from pathlib import Path
+import argparse
 import csv
 import logging
 import os
@@ -70,6 +157,18 @@ import sys
 import time
 import subprocess
 
+import ogrCache # companion modules - must be in the same folder as this script
+import ogrChunked
+import ogrColumns
+import ogrEngines
+import ogrIncremental
+import ogrPlanner
+import ogrScheduler
+import ogrSharedScan
+import ogrTelemetry
+import ogrTuning
+import sqlDateRewriter
+
 # Log file setup
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG) # 
@@ -147,6 +246,14 @@ def getVariableDicts(paramList, paramName, dList, nameDict, paramsFileName): # d
     return dicto
 
 # ex.  rsltDict = getVariableDicts(['outPath', 'outName', 'curDate', 'sqlQuery'], 'harvestParams', dList, nameDict) # FUNCTION CALL
+
+###############################################################################################
+# Function to read an optional column for one row (ex. makeFriendlySQL). Optional columns don't need to be listed in ogrReadTheseColumns
+def getOptionalParam(paramName, key, default=None):
+    value = dList[nameDict[paramName]].get(key, default) # dList and nameDict are global variables
+    return value.strip() if isinstance(value, str) else value
+
+# ex.  makeFriendlySQL = getOptionalParam('harvestParams', 'makeFriendlySQL', 'Y') # FUNCTION CALL
 ##############################################################################################
 def reStringPosition(pattern, sequence):
     for match in re.finditer(pattern, sequence):
@@ -163,73 +270,6 @@ def ogrReadTheseColumns(): # one .csv column contains names of all columns (in a
         resultantLists.append(listo)
     return resultantLists
 
-###############################################################################################################  
-# # Function to pull fieldName, operator, day, month, year and lineStartText from an SQL line. Only call it if you've verified the line has a date-like value..
-# def parseSQL_DateLine(line, oDict):
-#     oDict = {'=':'=', '>':'>', '<':'<', '>=':'>', '<=':'<' }
-#     operList = list(oDict.keys())
-#     # print(operList)
-
-#     xList = []
-#     for x in operList:
-#         condition1 = reSearch(x, line) # Checks that the operator is found in the line
-#         if condition1 == False: # .. this means that operator is not found. Check next.. 
-#             # print("{} not found.".format(x))
-#             continue
-#         else:    
-#             dateIndexStart, dateIndexEnd = reStringPosition(r"'\d\d-\w\w\w-\d\d'", line)
-#             # print("dateIndexStart is: {}".format(dateIndexStart)) # Character position of start of date string
-#             operIndexStart, operIndexEnd = reStringPosition(x, line)
-#             # print("operIndexEnd is: {}".format(operIndexEnd)) # Character position of end of 'operator' string 
-#         condition2 = True if dateIndexStart - operIndexEnd <= 5 else False
-#         # True = operator is found to the immediate left (within 5 spaces) of the date; False = oper is found in the line but not close to the date string. Check next..  
-        
-#         if all ([condition1 == True, condition2 == True]):
-#             # print("{} in line: {} ;     {} - {} is <= 5:{}".format(x, condition1, dateIndexStart, operIndexEnd, condition2))
-#             xList.append(x) # x could be the operator..
-   
-#     if len(xList) > 0:
-#         operator = max(xList, key=len)
-
-#         # Find fieldname - split the SQL line by the operator, take the first half, use .rstrip() to clear the space between datefield and oper, use .lstrip("(") to eliminate any ( that may exist
-#         stuff = line.split(operator)[0].rstrip().lstrip("(")  
-#         fieldName =''.join(stuff.split(" ")[-1:]) # get string from the last item in the list
-
-#         # Find 'lineStartText' i.e. everything that comes before fieldname in the SQL line
-#         lineStartText = line.split(fieldName)[0]
-        
-#         # Find date - split the SQL line by the operator, take the first half, use .lstrip() to clear the space between oper and date value, use .rstrip(")") to eliminate any ) that may exist
-#         stuff = line.split(operator)[1].lstrip().rstrip(")") 
-#         date =''.join(stuff.split(" ")[0]) # get string from the last item in the list
-
-#         # Get day, month and year from date
-#         monthDict = {'JAN':1, 'FEB':2, 'MAR':3, 'APR':4, 'MAY':5,'JUN':6, 'JUL':7, 'AUG':8, 'SEP':9, 'OCT':10, 'NOV':11, 'DEC':12}
-#         day = date.strip()[1:3]
-#         month = monthDict[date.strip()[4:7]]
-#         curYear = time.strftime("%Y")[2:4] # two-digit current year
-
-#         # Set four-digit year based on past 100 years 
-#         year = "20{}".format(str(date.strip()[8:10])) if date.strip()[8:10] <= curYear else "19{}".format(str(date.strip()[8:10]))
-#         # if date.strip()[8:10] <= curYear :  
-#         #     year =  "20" + str(date.strip()[8:10]) 
-#         # else:
-#         #     year =  "19" + str(date.strip()[8:10]) 
-
-#         msg = "\nDate expression found in SQL:"                                              
-#         print(msg + "\n" + "-"*len(msg))
-#         print("lineStartText is: {}".format(lineStartText))  # TEMP
-#         print("fieldName is: {}".format(fieldName)) 
-#         print("operator is: {}".format(operator))
-#         print("date is: {}".format(date))
-#         print("day is: {}".format(day))
-#         print("month is: {}".format(month))
-#         print("year is: {}".format(year))
- 
-#     else:
-#         print("No date expression found in SQL line; exiting script"), sys.exit()
-#     # return fieldName, operator, day, month, year
-#     return lineStartText, fieldName, operator, day, month, year
-
 ###############################################################################################################  
 def sqlBracketMismatchCheck(sqlString):
     # Ensure brackets in SQL remain in scope; fix if needed                  
@@ -339,7 +379,8 @@ def bcgwLoginCheck(user, pWord):
 # def ogrFromBCGW(outPath, outName, overWrite, user, pword, sqlQuery, outType="GPKG", outCRS=3005, coordPrec=1, nameField=None):
 # def ogrFromBCGW(outPath, outName, overWrite, makeFriendlySQL, sqlQuery, outType="GPKG", outCRS=3005, coordPrec=1, nameField=None):
 # def ogrFromBCGW(user, pWord, outPath, outName, overWrite, makeFriendlySQL, sqlQuery, outType="GPKG", outCRS=3005, coordPrec=1, nameField=None):
-def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", overWrite = "Y", makeFriendlySQL = "N", outCRS=3005, coordPrec=1, nameField=None):   
+# runNow="N" only builds the job (ogr2ogr arguments + staged SQL) and returns it, so the jobs can be run together by ogrScheduler.runJobs()
+def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", overWrite = "Y", makeFriendlySQL = "N", outCRS=3005, coordPrec=1, nameField=None, runNow="Y", keepColumns=None, snapGrid=None, simplify=None):   
     print("\nStarting ogrFromBCGW function...")
     # outCRS=3005 # Can be overwritten later if needed
 
@@ -353,13 +394,16 @@ def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", over
             break
 
     epsgDict = {3005: "BC Albers", 3741: "NAD83(HARN) / UTM zone 11N", 4326:'WGS 84', 104199:"GCS_WGS_1984_Major_Auxiliary_Sphere"}
-    extDict = {"GeoJSON":".json", "KML":".kml", "ESRI Shapefile":".shp", "GPKG":".gpkg"}
-
-    # Check that specified outType is valid (using regular expressions)
-    conditions = [reSearch(k, outType) for k in extDict.keys()] # FUNCTION CALL
-    if not True in conditions:
-        print("outType is {} {} ; it's not one of {}; exiting script.".format(outType, type(outType), list(extDict.keys())))
-        sys.exit()
+    extDict = {"GeoJSON":".json", "KML":".kml", "ESRI Shapefile":".shp", "GPKG":".gpkg", "FlatGeobuf":".fgb", "Parquet":".parquet"}
+
+    # Check that specified outType is valid. Several types can be listed, separated by semicolons (ex. GPKG;KML;GeoJSON) -
+    # the database is read once and the features are written to every format (see ogrEngines.py)
+    outTypes = [t.strip() for t in outType.split(";") if t.strip()]
+    for t in outTypes:
+        if t not in extDict:
+            print("outType is {} {} ; it's not one of {}; exiting script.".format(t, type(t), list(extDict.keys())))
+            sys.exit()
+    outType = outTypes[0] # the first type is the 'main' output; ogrList below is built for it
 
     osgeo_bat, ogr_exe = r"{}\OSGeo4W.bat".format(qgisPath), r'{}\bin\ogr2ogr.exe'.format(qgisPath)
     # print("{}\t{}".format(osgeo_bat, ogr_exe))
@@ -384,57 +428,32 @@ def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", over
                 if len(line) > 0: # if the line has content, add it to the new SQL String
                     line = line.replace('"','\'') # replace any double quotes with single quotes
                     newSQL += line + "\n"
-        newSQL = sqlBracketMismatchCheck(newSQL) # FUNCTION CALL 
+        newSQL = sqlBracketMismatchCheck(newSQL) # FUNCTION CALL
         msg = "SQL query is:"
-        return newSQL, msg
 
-        # # SQL handling part 2 - re-build SQL date comparisons into integer comparisons  
-        # if makeFriendlySQL == "Y":  
-        #     oDict = {'=':'=', '>':'>', '<':'<', '>=':'>', '<=':'<' } # dictionary to convert date field operators
-        #     newerSQL = ""             
-        #     for line in newSQL.split("\n"):    
-        #         # monthDict = {'JAN':1, 'FEB':2, 'MAR':3, 'APR':4, 'MAY':5,'JUN':6, 'JUL':7, 'AUG':8, 'SEP':9, 'OCT':10, 'NOV':11, 'DEC':12}
-        #         # lineEnd = line.strip()[-11:]
-        
-        #         if reSearch(r"BETWEEN", line) == True:
-        #             print("\nPROBLEM!\n ogrFromBCGW can't successfully translate a BETWEEN operator for dates. Change the sqlQuery and try again.")
-        #             sys.exit()
-                
-        #         # The below conditions show an SQL line has a string including "DATE" (i.e. a date field) being evaluated against a date value
-        #         if not all([reSearch(r"DATE", line) == True , reSearch(r"'\d\d-\w\w\w-\d\d'", line) == True]): 
-        #             newerSQL += line + "\n" # If these conditions are not met, add the line as is to the new SQL block..
-        #         else:
-        #             lineStartText, fieldName, operator, day, month, year = parseSQL_DateLine(line, oDict) # FUNCTION CALL
-
-        #             newline1 = "EXTRACT(year FROM {}) {} '{}'".format(fieldName, oDict[operator], year)
-        #             newline2 = "or ({0} and EXTRACT(month FROM {1}) {2} '{3}' )".format(newline1.replace(oDict[operator], "="), fieldName, oDict[operator], month)
-        #             newline3 = "{0} and EXTRACT(day FROM {1}) {2} '{3}'".format(newline2.replace(oDict[operator], "="), fieldName, operator, day)
-        #             newerSQL += lineStartText + " ( " + newline1 + "\n" + newline2 + "\n" + newline3 + ")"
-            
-            # SQL handling part 3 - check for mismatched / uneven number of brackets
-        #     newerSQL = sqlBracketMismatchCheck(newerSQL) # FUNCTION CALL     
-        #     msg = "OGR-friendly SQL query is:"
-        
-        # else:
-        #     newerSQL = sqlBracketMismatchCheck(newSQL) # FUNCTION CALL 
-        #     msg = "SQL query (date comparison unchanged) is:"
-        # return newerSQL, msg
-            # newSQL = sqlBracketMismatchCheck(newSQL) # FUNCTION CALL     
-            # msg = "OGR-friendly SQL query is:"
-        
-        # newSQL = sqlBracketMismatchCheck(newSQL) # FUNCTION CALL 
-        # msg = "SQL query is:"
-        # return newSQL, msg
+        # SQL handling part 2 - re-write date comparisons (ex. BLOCK_STATUS_DATE >= '01-SEP-17') as index-friendly date ranges
+        if makeFriendlySQL == "Y":
+            newSQL, binds, dateTerms = sqlDateRewriter.rewriteDatePredicates(newSQL) # FUNCTION CALL
+            if dateTerms > 0:
+                msg = "SQL query ({} date comparison(s) re-written as index-friendly ranges) is:".format(dateTerms)
+        return newSQL, msg
 
     sqlQuery, msg = sqlQueryScrubber(sqlQuery, makeFriendlySQL) # FUNCTION CALL 
 
+    # SQL handling part 3 - expand select * into the table's columns from ALL_TAB_COLUMNS, leaving out LOB / annotation columns (or keeping just keepColumns)
+    if pruneColumns == "Y":
+        sqlQuery, columnMsg = ogrColumns.expandForSource(sqlQuery, ds, keepColumns) # FUNCTION CALL
+        if columnMsg is not None:
+            print(columnMsg)
+
     print("\n" + msg + "\n","="*len(msg))
     print(sqlQuery)
 
     # SQL handling - write SQL to a temporary .sql file first, then read it from the external file (ensures UTF-8 compliance)
     make_wrkSpc(r"T:\tempQueryFolder", rsltDict, outPathList) # FUNCTION CALL
-    # sqlFile = os.path.join(r"T:\tempQueryFolder","query.sql")  # query.sql will overwrite if running the script repeatedly
-    sqlFile = os.path.join(r"T:\tempQueryFolder","query{}.sql".format(n))  # query.sql will overwrite if running the script repeatedly
+    # Each job gets its own staging folder inside T:\tempQueryFolder, so rows running at the same time can't overwrite each other's query.sql
+    stagingDir = ogrScheduler.makeJobStagingDir(r"T:\tempQueryFolder", n, rsltDict.get('paramName', n)) # FUNCTION CALL
+    sqlFile = os.path.join(stagingDir, "query.sql")
     with open(sqlFile, 'w') as thing:
         thing.write(sqlQuery)
 
@@ -461,50 +480,83 @@ def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", over
     lyrName = "{}".format(outName[0:20].replace(" ","_").split("{")[0]) # if there's a placeholder in the outName, avoid ugly { or } in the filename
     # -nln = "New Layer Name"; prevents the output layer from assuming the entire sqlQuery as its name - IMPORTANT!
 
-    if outType == "GPKG": # Set GPKG specific options
-       for x in ["-nln", lyrName]:
-            ogrList.append(x)
-
-    if outType == "GeoJSON": # Set GeoJSON specific options
-        for x in ["-lco","WRITE_NAME=NO","-nln", lyrName]:
-            ogrList.append(x)
-
-    if outType == "KML": # Set KML specific options  
-        if nameField is not None:
-            for x in ["-nln", lyrName, "-dsco", "NameField={}".format(nameField)]: # This would give each KML feature a better name than 'No Name'
-                ogrList.append(x)
-        else:
-            for x in ["-nln", lyrName]:
-                ogrList.append(x)
+    # Coordinate precision, vertex snapping and simplification (ogrEngines.precisionOptions) - checked once here, then added to every format's options
+    try:
+        precision = ogrEngines.precisionOptions(outType, coordPrec, snapGrid, simplify) # FUNCTION CALL
+    except ValueError as error:
+        print("\n{} for {} in {}; exiting script.".format(error, rsltDict.get('paramName', n), paramsFileName)), sys.exit()
+    xyRes = ogrEngines.hasXyRes([osgeo_bat, ogr_exe]) # FUNCTION CALL - -xyRes needs GDAL 3.9+ ('ogr2ogr --version' is only run for the first row)
+    if '-xyRes' in precision and not xyRes:
+        print("Warning: ogr2ogr's GDAL is older than 3.9, so -xyRes is left out; coordinates are only rounded in GeoJSON outputs (COORDINATE_PRECISION)")
+
+    def formatOptions(outType): # driver options, then coordinate precision / snapping / simplification (KML is written in EPSG:4326)
+        return driverOptions(outType) + ogrEngines.precisionOptions(outType, coordPrec, snapGrid, simplify, geographic=(outType == "KML" or outCRS == 4326), xyRes=xyRes) # FUNCTION CALL
+
+    def driverOptions(outType): # -nln and any other options specific to one output format
+        if outType == "GPKG": # Set GPKG specific options
+            if gpkgFastWrite == "Y": # one transaction, no fsync per commit, the rollback journal in memory, and the R-tree built after the load (ogrEngines.finishGpkg)
+                return ["-nln", lyrName, "-gt", "unlimited", "-lco", "SPATIAL_INDEX=NO", "--config", "OGR_SQLITE_SYNCHRONOUS", "OFF", "--config", "OGR_SQLITE_JOURNAL", "MEMORY",
+                        "--config", "OGR_SQLITE_CACHE", "512"]
+            return ["-nln", lyrName]
+
+        if outType == "GeoJSON": # Set GeoJSON specific options
+            return ["-lco","WRITE_NAME=NO","-nln", lyrName]
+
+        if outType == "FlatGeobuf": # Set FlatGeobuf specific options - a packed Hilbert R-tree, so bbox reads only touch the features they need
+            return ["-lco","SPATIAL_INDEX=YES","-nln", lyrName]
+
+        if outType == "Parquet": # Set GeoParquet specific options - bbox covering columns and spatially sorted row groups, so bbox reads skip whole row groups
+            return ["-lco","WRITE_COVERING_BBOX=YES","-lco","SORT_BY_BBOX=YES","-lco","ROW_GROUP_SIZE=65536","-lco","COMPRESSION=ZSTD","-nln", lyrName]
+
+        if outType == "KML": # Set KML specific options  
+            if nameField is not None:
+                return ["-nln", lyrName, "-dsco", "NameField={}".format(nameField)] # This would give each KML feature a better name than 'No Name'
+            return ["-nln", lyrName]
+        return []
+
+    ogrList += formatOptions(outType) # FUNCTION CALL
+
+    # Several outTypes: one set of options per format, all sharing the same source, SQL and CRS. KML is reprojected to 4326 explicitly
+    fanOut = []
+    if len(outTypes) > 1:
+        headList = ogrList[:len(ogrList) - len(formatOptions(outType))]
+        for t in outTypes:
+            tFileName = fillFormatPlaceholders(fileName, [extDict, t]) # FUNCTION CALL
+            tOptions = formatOptions(t) + (["-t_srs", "EPSG:4326"] if t == "KML" else [])
+            tList = [tFileName if i == ogrItems.index(fileName) else t if i == ogrItems.index(formatName) else x for i, x in enumerate(headList)] + tOptions
+            fanOut.append({'outType':t, 'fileName':tFileName, 'formatOptions':tOptions, 'ogrList':tList})
 
     if outCRS in epsgDict:
-        if outType == "KML":
-            crsMessage = "Resultant spatial file (KML) automatically converts to CRS:{} ({})".format(4326, epsgDict[4326])
-        else:
-            crsMessage = "Resultant spatial file will have CRS:{} ({})".format(outCRS, epsgDict[outCRS])
-        print(crsMessage)
+        for t in outTypes:
+            if t == "KML":
+                crsMessage = "Resultant spatial file (KML) automatically converts to CRS:{} ({})".format(4326, epsgDict[4326])
+            else:
+                crsMessage = "Resultant spatial file ({}) will have CRS:{} ({})".format(t, outCRS, epsgDict[outCRS])
+            print(crsMessage)
 
     make_wrkSpc(outPath, rsltDict, outPathList) # FUNCTION CALL
 
-    # Which Python version you are using determines what subprocess method to use;
-    pyVersion = float("{}.{}".format(sys.version_info.major, sys.version_info.minor))
-    if pyVersion >= 3.5: # if Python >= 3.5, use subprocess.run
-        print("pyVersion = {}; using subprocess.run . Running now, see progress indicator below...\n".format(pyVersion))
-        # rc = subprocess.run(ogrList, check=True)
-        try:
-            rc = subprocess.run(ogrList, check=True)
-        except subprocess.CalledProcessError as error:
-            print("\nProblem! : {}\nExiting script.".format(error))
-            sys.exit()
-    else: # for Python 2 cases..
-        # Like subprocess.run(), subprocess.call() works with a list of arguments...
-        print("pyVersion = {}; using subprocess.call . Running now...".format(pyVersion))
-        try:
-            rc = subprocess.check_call(ogrList)
-        except subprocess.CalledProcessError as error:
-            print("""Problem! Limited info available due to Python version being {}; try running in Geospatial Desktop (Python 3) to learn more about the problem.
-            Exiting script.\n""".format(pyVersion))
-            sys.exit()
+    if runNow == "Y":
+        # Which Python version you are using determines what subprocess method to use;
+        pyVersion = float("{}.{}".format(sys.version_info.major, sys.version_info.minor))
+        for runList in ([spec['ogrList'] for spec in fanOut] or [ogrList]): # runNow="Y" runs each format on its own, i.e. one database read per format
+            if pyVersion >= 3.5: # if Python >= 3.5, use subprocess.run
+                print("pyVersion = {}; using subprocess.run . Running now, see progress indicator below...\n".format(pyVersion))
+                # rc = subprocess.run(runList, check=True)
+                try:
+                    rc = subprocess.run(runList, check=True)
+                except subprocess.CalledProcessError as error:
+                    print("\nProblem! : {}\nExiting script.".format(error))
+                    sys.exit()
+            else: # for Python 2 cases..
+                # Like subprocess.run(), subprocess.call() works with a list of arguments...
+                print("pyVersion = {}; using subprocess.call . Running now...".format(pyVersion))
+                try:
+                    rc = subprocess.check_call(runList)
+                except subprocess.CalledProcessError as error:
+                    print("""Problem! Limited info available due to Python version being {}; try running in Geospatial Desktop (Python 3) to learn more about the problem.
+                    Exiting script.\n""".format(pyVersion))
+                    sys.exit()
 
     newString = ""
     print("\nArguments used:")
@@ -514,6 +566,8 @@ def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", over
             # Startring with argument 1, put a space between arguments in the ogr2ogr string
             if ogrList.index(arg) == ogrItems.index(formatName): # index of the formatName / driver argument
                 newString += '"{}" '.format(arg) # OGR requires driver has "" aroudn it 
+            elif " " in arg: # ex. -xyRes "0.1 m"
+                newString += '"{}" '.format(arg)
             else:
                 newString += '{} '.format(arg)
 
@@ -521,7 +575,13 @@ def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", over
     outNamesList.append(outName)
     ogrMultiList.append(ogrList)
 
-    return ogrList
+    # Everything ogrScheduler needs to run (and report on) this row later
+    job = {'n':n, 'paramName':rsltDict.get('paramName', n), 'database':'IDWPROD1', 'ogrList':ogrList, 'fileName':ogrList[ogrItems.index(fileName)],
+           'ds':ds, 'outType':outType, 'outPath':outPath, 'outName':outName, 'sqlFile':sqlFile, 'stagingDir':stagingDir, 'cliString':newString,
+           'fanOut':fanOut, 'gpkgFastWrite':gpkgFastWrite == "Y" and "GPKG" in outTypes}
+    if runNow == "Y" and job['gpkgFastWrite']: # the outputs were written without a spatial index; build it now, then VACUUM / ANALYZE
+        print("\n".join(ogrEngines.finishGpkgOutputs(job))) # FUNCTION CALL
+    return job
 
 ###############################################################################################################
 ###############################################################################################################
@@ -529,6 +589,47 @@ def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", over
 
 # Choose params file
 paramsFileName = 'ogrParams.csv' # this is the default
+
+# Concurrency settings for ogrScheduler - how many rows run at once, and how many of those may be logged in to the same database
+maxWorkers = 4
+dbConnectionCap = 2
+
+# Engine that runs each row: "gdal" runs ogr2ogr in-process (gdal.VectorTranslate) and re-uses one open database connection per worker;
+# "subprocess" starts OSGeo4W / ogr2ogr.exe once per row. "gdal" falls back to "subprocess" if osgeo can't be imported
+ogrEngine = "gdal"
+
+# "Y" fetches rows with the same table and WHERE clause from the database once, and makes each of their outputs from that local copy
+shareScans = "Y"
+
+# "Y" writes GPKG outputs in large transactions without a spatial index, then builds the index and runs VACUUM / ANALYZE at the end (much faster for big layers).
+# "N" uses ogr2ogr's defaults
+gpkgFastWrite = "Y"
+
+# "Y" expands select * into the table's columns, without LOB / annotation columns like SE_ANNO_CAD_DATA (see ogrColumns.py)
+pruneColumns = "Y"
+
+# "Y" copies a row's output from the local output cache (see ogrCache.py) when its SQL, options and source data haven't changed; --no-cache skips it for one run
+useCache = "Y"
+
+# Each row that runs appends one JSON record (timings, rows, bytes, peak memory, exit code) to this file; "" turns it off (see ogrTelemetry.py)
+telemetryLog = r"T:\tempQueryFolder\ogrTelemetry.jsonl"
+
+# GDAL settings for every row: "default", "bulk" (big caches, one transaction per output) or "low-memory" (see ogrTuning.py).
+# Tables tuned with --autotune use the settings saved in tuningFile instead
+tuningProfile = "default"
+tuningFile = r"T:\tempQueryFolder\ogrTuning.json"
+
+# Command line options, ex. python ogrFromBCGW_csv_FINAL.py --plan
+parser = argparse.ArgumentParser(description="Runs the ogr2ogr jobs in the params .csv file")
+parser.add_argument('--plan', action='store_true', help="cost each row first, print the plan, then run the longest rows first (big rows with a keyColumn are chunked)")
+parser.add_argument('--planMethod', choices=['explain', 'count'], default='explain', help="EXPLAIN PLAN cardinality (quick) or COUNT(*) (exact) for --plan")
+parser.add_argument('--no-cache', action='store_true', help="pull every row from the database, even if its output is in the cache")
+parser.add_argument('--runId', default=None, help="re-using a run id skips rows that are already up to date for it (see ogrScheduler.py)")
+parser.add_argument('--autotune', action='store_true', help="time a few GDAL settings on a sample of each source table, and save the fastest to tuningFile (see ogrTuning.py)")
+args = parser.parse_args()
+if tuningProfile not in ogrTuning.profiles:
+    print("tuningProfile must be one of: {}; exiting script.".format(", ".join(ogrTuning.profiles))), sys.exit()
+
 # paramsFileName = 'ogrParams_999.csv' 
 ogrParamsFile = checkParamsFile(paramsFileName) # FUNCTION CALL - make sure the params file exists
 
@@ -557,24 +658,80 @@ else:
 # Run each set of parameters through the ogr2ogr call
 
 outPathList = [] # needed to know when to overwrite folders
+jobs = [] # each row's ogr2ogr job is built first (in file order), then all jobs are run together by ogrScheduler
 for n in range(paramNum): # paramNum is the number of parameter rows in your .csv file
     paramStr = resultantLists[n].strip() # get string value of the cell i.e. outPath, outName, curDate, sqlQuery, outType
     paramList = [x.strip() for x in paramStr.split(",")]
     name = list(nameDict.keys())[n]
     print(paramList)
     rsltDict = getVariableDicts(paramList, name, dList, nameDict, paramsFileName) # FUNCTION CALL
+    rsltDict['paramName'] = name
     outPathList.append(rsltDict['outPath'])
     # print(rsltDict.items()) # optional - Verbose!
-    ogrList = ogrFromBCGW(user, pWord, n, rsltDict['outPath'], rsltDict['outName'], rsltDict['sqlQuery'], rsltDict['outType'])
-
-# def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", overWrite = "Y", makeFriendlySQL = "N", outCRS=3005, coordPrec=1, nameField=None):   
+    job = ogrFromBCGW(user, pWord, n, rsltDict['outPath'], rsltDict['outName'], rsltDict['sqlQuery'], rsltDict['outType'],
+                      makeFriendlySQL=getOptionalParam(name, 'makeFriendlySQL', 'N'), runNow="N", keepColumns=getOptionalParam(name, 'keepColumns'),
+                      coordPrec=getOptionalParam(name, 'coordPrec') or 1, snapGrid=getOptionalParam(name, 'snapGrid'), simplify=getOptionalParam(name, 'simplify'))
+    job['incremental'] = ogrIncremental.incrementalSettings(name, getOptionalParam(name, 'watermarkColumn'), getOptionalParam(name, 'keyColumn'),
+                                                            getOptionalParam(name, 'fullRefreshDays')) # FUNCTION CALL - None unless the row has a watermarkColumn
+    job['chunk'] = ogrChunked.chunkSettings(name, getOptionalParam(name, 'chunkTiles'), getOptionalParam(name, 'keyColumn'), getOptionalParam(name, 'chunkGeomColumn'),
+                                            getOptionalParam(name, 'chunkExtent'), getOptionalParam(name, 'chunkRetries')) # FUNCTION CALL - None unless the row has chunkTiles
+    job['keyColumn'] = getOptionalParam(name, 'keyColumn') # lets --plan chunk big rows
+    job['cacheDateColumn'] = getOptionalParam(name, 'cacheDateColumn')
+    job['dependsOn'] = ogrScheduler.parseDependsOn(getOptionalParam(name, 'dependsOn')) # FUNCTION CALL - paramNames of the rows this row uses
+    jobs.append(job)
+
+try:
+    ogrScheduler.dependencyOrder(jobs) # FUNCTION CALL - checks every dependsOn value is a paramName, and that no rows depend on each other in a loop
+except ValueError as error:
+    print("\n{} in {}; exiting script.".format(error, paramsFileName)), sys.exit()
+
+# def ogrFromBCGW(user, pWord, n, outPath, outName, sqlQuery, outType="GPKG", overWrite = "Y", makeFriendlySQL = "N", outCRS=3005, coordPrec=1, nameField=None, runNow="Y", keepColumns=None, snapGrid=None, simplify=None):   
 ##################################################################################
 
-msg ="{} ogr strings created and executed successfully.".format(len(cliStringList))
+upToDateResults = []
+if args.runId: # rows already up to date for this run id aren't run again
+    allJobs, runStatePath = list(jobs), ogrScheduler.runStatePath(r"T:\tempQueryFolder", args.runId) # FUNCTION CALL
+    runState = ogrScheduler.readRunState(runStatePath) # FUNCTION CALL
+    jobs, upToDateResults = ogrScheduler.skipUpToDate(jobs, runState) # FUNCTION CALL
+
+cachedResults = []
+if useCache == "Y" and not args.no_cache:
+    jobs, cachedResults = ogrCache.restoreCachedJobs(jobs) # FUNCTION CALL - rows whose output is already cached are copied into place now, not run
+
+if args.plan:
+    jobs = ogrPlanner.planJobs(jobs, method=args.planMethod) # FUNCTION CALL - prints the plan table, returns the jobs longest first
+    if input("Run the rows in this order? Type Y or N.").upper() != "Y":
+        print("Nothing was run."), sys.exit()
+
+ogrTuning.setProcessCache(ogrTuning.profiles[tuningProfile]) # FUNCTION CALL - the profile's GDAL_CACHEMAX, for the "gdal" engine (every row runs in this Python)
+if args.autotune:
+    ogrTuning.autotune(jobs, ogrEngines.getRunner(ogrEngine), tuningFile) # FUNCTION CALL - prints and saves the fastest settings for each source table
+
+runner = ogrChunked.getChunkedRunner(ogrEngines.getRunner(ogrEngine), maxWorkers, dbConnectionCap) # FUNCTION CALL - rows without chunkTiles run as usual
+runner = ogrIncremental.getIncrementalRunner(runner) # FUNCTION CALL - rows without a watermarkColumn run as usual
+runner = ogrTuning.getTuningRunner(runner, tuningProfile, tuningFile) # FUNCTION CALL - the table's --autotune settings, or else the profile's
+runner = ogrTelemetry.getTelemetryRunner(runner, telemetryLog, args.runId or time.strftime("%Y-%m-%d %H:%M:%S"), ogrEngine) # FUNCTION CALL - one JSON line per row
+if shareScans == "Y":
+    plan = ogrSharedScan.planSharedScans(jobs, r"T:\tempQueryFolder") # FUNCTION CALL - groups rows that can share one database fetch
+    results = ogrSharedScan.runPlannedJobs(plan, maxWorkers, dbConnectionCap, runner) # FUNCTION CALL
+else:
+    results = ogrScheduler.runJobs(jobs, maxWorkers, dbConnectionCap, runner) # FUNCTION CALL
+ogrEngines.closeSources() # FUNCTION CALL
+if useCache == "Y" and not args.no_cache:
+    ogrCache.storeResults(jobs, results) # FUNCTION CALL - saves the new outputs, then trims the cache to ogrCache.maxCacheGB
+results = sorted(results + cachedResults + upToDateResults, key=lambda r: r['n'])
+if args.runId:
+    ogrScheduler.recordRun(runState, runStatePath, allJobs, results) # FUNCTION CALL
+ogrScheduler.printSummaryTable(results) # FUNCTION CALL
+
+msg ="{} of {} ogr strings created and executed successfully.".format(len([r for r in results if r['status'] == 'OK']), len(cliStringList))
 print("\n\n", msg)
 
 for c in cliStringList:
     print("-"*100, "\n{}".format(c))
 print("-"*100, "\n")
 
+if any(r['status'] != 'OK' for r in results):
+    sys.exit(1)
+
 # os.rmdir(r"T:\tempQueryFolder")
\ No newline at end of file
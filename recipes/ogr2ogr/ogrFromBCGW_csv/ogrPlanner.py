@@ -0,0 +1,208 @@
+
+# ogrPlanner.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# The --plan mode: before any ogr2ogr job runs, each row's query is costed against the database -
+# how many rows it returns (Oracle's EXPLAIN PLAN cardinality, or a COUNT(*)) and roughly how many bytes that is
+# (from the column types, plus the average geometry size of a small sample). The plan table is printed,
+# the jobs are re-ordered longest first (so the big rows aren't the last ones still running), and rows over
+# 'autoChunkMB' are switched to chunked extraction (ogrChunked.py) if they have a keyColumn.
+
+"""HOW THE ESTIMATES WORK:
+--------------------------------------------------------------------------------------
+1. Rows:  method="explain" asks Oracle for the optimizer's CARDINALITY and BYTES (EXPLAIN PLAN .. / PLAN_TABLE), which is quick but can be off
+          if the table's statistics are stale. method="count" runs select count(*) over the row's query, which is exact but costs a full read.
+          If EXPLAIN PLAN isn't available (ex. the SQLite / SpatiaLite stand-in used by test_ogrPlanner.py), COUNT(*) is used instead.
+
+2. Bytes: each column's size comes from its type (ex. 8 bytes for a Real, the declared width for a String). Geometry and other variable-size
+          columns are measured on the first 'sampleSize' features. Bytes = rows x bytes per row (or Oracle's BYTES, if it's bigger).
+
+3. Time:  a rough guess from rowsPerSecond / bytesPerSecond, only used to order the jobs and for the plan table.
+          Tune them to what your connection gets (see the 'seconds' column of the job summary after a run).
+"""
+
+import math
+import re
+
+import ogrChunked # companion modules - must be in the same folder as this script
+import ogrEngines
+import sqlDateRewriter
+
+try:
+    from osgeo import gdal, ogr
+except ImportError: # ex. running with a Python that isn't the QGIS / OSGeo4W one
+    gdal, ogr = None, None
+
+rowsPerSecond = 20000.0 # rough OCI fetch rates, for the time estimate only
+bytesPerSecond = 4.0 * 1048576
+sampleSize = 200 # features read to measure geometry / unbounded string sizes
+autoChunkMB = 2048 # rows estimated over this many MB are switched to chunked extraction
+tileMB = 256 # target size of each tile when a row is switched to chunked extraction
+maxTilesPerSide = 8
+
+# Bytes per value for fixed-size column types (OGR field type names)
+typeBytes = {'Integer':4, 'Integer64':8, 'Real':8, 'Date':4, 'Time':4, 'DateTime':8, 'IntegerList':16, 'RealList':32}
+
+###############################################################################################################
+# Functions that run a query and return (columns, rows): columns as [(name, typeName, width)], rows as tuples with geometry as WKB bytes.
+# 'maxRows' limits how many rows are read. One for any GDAL data source (ex. the OCI connection string), one for a DB-API connection (ex. sqlite3)
+def gdalFetcher(ds):
+    def fetch(sqlString, maxRows=None):
+        srcDS = ogrEngines.getSourceDataset(ds) # FUNCTION CALL - opened on first use, then shared with this thread's other lookups
+        lyr = srcDS.ExecuteSQL(sqlString)
+        if lyr is None: # ex. EXPLAIN PLAN, which doesn't return rows
+            return [], []
+        try:
+            defn = lyr.GetLayerDefn()
+            columns = [(defn.GetFieldDefn(i).GetName(), defn.GetFieldDefn(i).GetTypeName(), defn.GetFieldDefn(i).GetWidth()) for i in range(defn.GetFieldCount())]
+            hasGeometry = defn.GetGeomType() != ogr.wkbNone
+            if hasGeometry:
+                columns.append((lyr.GetGeometryColumn() or 'GEOMETRY', 'Geometry', 0))
+            rows = []
+            for feat in lyr:
+                geom = feat.GetGeometryRef()
+                rows.append(tuple(feat.GetField(i) for i in range(defn.GetFieldCount())) +
+                            ((bytes(geom.ExportToWkb()) if geom is not None else None,) if hasGeometry else ()))
+                if maxRows is not None and len(rows) >= maxRows:
+                    break
+            return columns, rows
+        finally:
+            srcDS.ReleaseResultSet(lyr)
+    return fetch
+
+def dbapiFetcher(conn):
+    def fetch(sqlString, maxRows=None):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sqlString)
+            rows = cursor.fetchall() if maxRows is None else cursor.fetchmany(maxRows)
+            names = [d[0] for d in cursor.description or []]
+        finally:
+            cursor.close()
+        # DB-API doesn't give reliable column types, so they're taken from the first non-null value of each column
+        columns = []
+        for i, name in enumerate(names):
+            value = next((r[i] for r in rows if r[i] is not None), None)
+            typeName = 'Integer64' if isinstance(value, int) else 'Real' if isinstance(value, float) else 'Binary' if isinstance(value, (bytes, bytearray, memoryview)) else 'String'
+            columns.append((name, typeName, 0))
+        return columns, rows
+    return fetch
+
+###############################################################################################################
+# Function to remove a top-level ORDER BY (it doesn't change the row count, and sorting is the expensive part)
+def stripOrderBy(sqlString):
+    tokens = sqlDateRewriter.tokenize(sqlString.strip().rstrip(";"))
+    depth = 0
+    for i, (kind, text) in enumerate(tokens):
+        depth += 1 if text == '(' else -1 if text == ')' else 0
+        if depth == 0 and kind == 'ident' and text.upper() == 'ORDER':
+            return "".join(t for k, t in tokens[:i]).rstrip()
+    return "".join(t for k, t in tokens)
+
+# Function to estimate the bytes in one row: fixed-size types from typeBytes, everything else measured on the sample rows
+def estimateRowBytes(columns, sampleRows):
+    total = 0.0
+    for i, (name, typeName, width) in enumerate(columns):
+        if typeName in typeBytes:
+            total += typeBytes[typeName]
+        elif typeName == 'String' and width > 0:
+            total += width
+        else: # Geometry, Binary, and Strings without a width
+            values = [r[i] for r in sampleRows if r[i] is not None]
+            total += sum(len(v) if not isinstance(v, str) else len(v.encode('utf-8')) for v in values) / float(len(values)) if values else 0
+    return total
+
+###############################################################################################################
+# Function to get the row count (and Oracle's own byte estimate) for one query. Returns (rows, bytes or None, method used)
+def estimateRows(fetch, sqlString, statementId, method="explain"):
+    countable = stripOrderBy(sqlString) # FUNCTION CALL
+    if method == "explain":
+        try:
+            fetch("EXPLAIN PLAN SET STATEMENT_ID = '{}' FOR {}".format(statementId, countable))
+            columns, rows = fetch("SELECT CARDINALITY, BYTES FROM PLAN_TABLE WHERE STATEMENT_ID = '{}' AND ID = 0".format(statementId))
+            fetch("DELETE FROM PLAN_TABLE WHERE STATEMENT_ID = '{}'".format(statementId))
+            if rows and rows[0][0] is not None:
+                return int(rows[0][0]), (int(rows[0][1]) if rows[0][1] is not None else None), "explain"
+        except Exception: # ex. not Oracle, or no PLAN_TABLE - fall back to counting
+            pass
+    columns, rows = fetch("select count(*) from ({}) ogrPlanCount".format(countable))
+    return int(rows[0][0]), None, "count"
+
+###############################################################################################################
+# Function to cost one job: rows, bytes and a rough time. 'fetch' is one of the fetchers above
+def planJob(job, fetch, method="explain"):
+    with open(job['sqlFile'], 'r') as thing:
+        sqlString = thing.read()
+    rows, planBytes, usedMethod = estimateRows(fetch, sqlString, "ogrPlan{}".format(job['n']), method) # FUNCTION CALL
+    columns, sampleRows = fetch(stripOrderBy(sqlString), sampleSize) # FUNCTION CALL
+    rowBytes = estimateRowBytes(columns, sampleRows) # FUNCTION CALL
+    estBytes = max(rows * rowBytes, planBytes or 0)
+    return {'n':job['n'], 'paramName':job['paramName'], 'rows':rows, 'method':usedMethod, 'rowBytes':rowBytes, 'bytes':estBytes,
+            'seconds':rows / rowsPerSecond + estBytes / bytesPerSecond, 'action':'', 'error':None}
+
+###############################################################################################################
+# Function to switch a big row to chunked extraction: an n x n grid with roughly 'tileMB' per tile (if it can be chunked at all)
+def autoChunk(job, estimate):
+    if job.get('chunk'):
+        return "chunked ({}x{} in .csv)".format(job['chunk']['cols'], job['chunk']['rows'])
+    if estimate['bytes'] < autoChunkMB * 1048576:
+        return ""
+    if not job.get('keyColumn'):
+        return "big - add a keyColumn to chunk it"
+    if job['outType'] != "GPKG" or job.get('fanOut') or job.get('incremental'):
+        return "big - chunking needs a single GPKG outType"
+    side = min(maxTilesPerSide, max(2, int(math.ceil(math.sqrt(estimate['bytes'] / (tileMB * 1048576.0))))))
+    settings = ogrChunked.chunkSettings(job['paramName'], "{}x{}".format(side, side), job['keyColumn']) # FUNCTION CALL
+    with open(job['sqlFile'], 'r') as thing:
+        sqlString = thing.read()
+    geomColumn = ogrChunked.geomColumnFor(sqlString, settings) # FUNCTION CALL
+    if geomColumn is None or ogrChunked.tileSQL(sqlString, geomColumn, (0, 0, 1, 1)) is None:
+        return "big - can't be chunked (geometry column / UNION)"
+    job['chunk'] = settings
+    return "chunk {}x{}".format(side, side)
+
+###############################################################################################################
+# Function to cost every job, print the plan table, and return the jobs longest first (rows over autoChunkMB switched to chunked extraction).
+# 'fetchFor' is a function returning a fetcher for a job; by default each job's 'ds' is opened with GDAL (once per ds)
+def planJobs(jobs, fetchFor=None, method="explain", chunkBigRows=True):
+    if fetchFor is None:
+        if gdal is None:
+            print("osgeo.gdal is not available in this Python, so the rows can't be costed; running them in file order")
+            return jobs
+        gdal.UseExceptions()
+        fetchers = {}
+        def fetchFor(job):
+            if job['ds'] not in fetchers:
+                fetchers[job['ds']] = gdalFetcher(job['ds']) # FUNCTION CALL
+            return fetchers[job['ds']]
+
+    estimates = {}
+    for job in jobs:
+        try:
+            estimates[job['n']] = planJob(job, fetchFor(job), method) # FUNCTION CALL
+        except Exception as error: # a row that can't be costed is run last, as written
+            estimates[job['n']] = {'n':job['n'], 'paramName':job['paramName'], 'rows':None, 'method':'-', 'rowBytes':0, 'bytes':0,
+                                   'seconds':-1.0, 'action':'', 'error':re.sub(r"\s+", " ", str(error))[:60]}
+        if chunkBigRows and estimates[job['n']]['error'] is None:
+            estimates[job['n']]['action'] = autoChunk(job, estimates[job['n']]) # FUNCTION CALL
+
+    ordered = sorted(jobs, key=lambda job: -estimates[job['n']]['seconds']) # longest first; sorted() keeps file order for ties
+    printPlanTable([estimates[job['n']] for job in ordered]) # FUNCTION CALL
+    return ordered
+
+###############################################################################################################
+def printPlanTable(estimates):
+    header = "{:>3}  {:<30} {:>12} {:<8} {:>10} {:>10}  {}".format("n", "paramName", "rows", "method", "est. MB", "est. min", "action")
+    print("\n\nExport plan (longest first):\n{}\n{}".format(header, "="*len(header)))
+    for e in estimates:
+        if e['error'] is not None:
+            print("{:>3}  {:<30} {:>12} {:<8} {:>10} {:>10}  couldn't cost this row: {}".format(e['n'], str(e['paramName'])[:30], "?", "-", "?", "?", e['error']))
+            continue
+        print("{:>3}  {:<30} {:>12,} {:<8} {:>10.1f} {:>10.1f}  {}".format(e['n'], str(e['paramName'])[:30], e['rows'], e['method'],
+                                                                      e['bytes'] / 1048576.0, e['seconds'] / 60.0, e['action']))
+    costed = [e for e in estimates if e['error'] is None]
+    print("-"*len(header))
+    print("{:,} rows, about {:.1f} MB and {:.1f} min of database time in total (rows run side by side, so the run itself is shorter)\n".format(
+        sum(e['rows'] for e in costed), sum(e['bytes'] for e in costed) / 1048576.0, sum(e['seconds'] for e in costed) / 60.0))
+
+# ex. jobs = planJobs(jobs) # FUNCTION CALL - prints the plan, returns the jobs longest first
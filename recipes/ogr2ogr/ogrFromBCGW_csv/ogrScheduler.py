@@ -0,0 +1,307 @@
+
+# ogrScheduler.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# Runs the ogr2ogr jobs built from each ogrParams.csv row across a bounded pool of worker threads,
+# instead of one row at a time. Each job is a dictionary built by ogrFromBCGW() / ogrFromDB() with (at least) these keys:
+#   n, paramName, database, ogrList, fileName, sqlFile, stagingDir
+# ogr2ogr does the real work in its own process, so threads are enough here - they just wait on subprocess.run()
+
+r"""HOW THE SCHEDULER WORKS:
+--------------------------------------------------------------------------------------
+1. 'maxWorkers' sets how many ogr2ogr processes can run at the same time (all databases combined)
+
+2. 'dbConnectionCap' sets how many of those can be connected to the SAME database at once (ex. IDWPROD1),
+   so a long params file doesn't flood the database with logins
+
+3. Every job gets its own SQL staging folder (see makeJobStagingDir), so concurrent rows never overwrite each other's query.sql
+
+4. Each job's stdout / stderr is captured and written to ogr_stdout.txt / ogr_stderr.txt in its staging folder,
+   and a summary table of all jobs is printed when the last one finishes.
+   A failed row no longer stops the script - the other rows keep running and the failure is shown in the summary.
+
+5. A row can list other rows (by paramName) in its optional 'dependsOn' column, ex. aoiParams;roadsParams, when it uses their outputs.
+   It only starts once all of them have finished OK; rows that don't depend on each other still run at the same time.
+   If a row fails, only the rows downstream of it are skipped (status SKIPPED); everything else keeps running.
+
+6. With a run id (ex. --runId weekly), each row's SQL / options and the size and time stamp of its outputs (and of the outputs it depends on)
+   are kept in T:\tempQueryFolder\runs\<runId>.json. Running again with the same run id skips rows that are already up to date,
+   i.e. nothing about the row or its outputs changed, and every row it depends on is up to date too.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextlib
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+
+printLock = threading.Lock() # keeps the progress lines from different workers from interleaving
+_jobSlot = threading.local() # the running job's database semaphore (and all of runJobs' semaphores), for runners that start jobs of their own
+
+###############################################################################################################
+def printSafe(msg):
+    with printLock:
+        print(msg)
+
+###############################################################################################################
+# Function to create an isolated SQL staging folder for one job, ex. T:\tempQueryFolder\job003_harvestParams_x8k2p1\
+def makeJobStagingDir(stagingRoot, n, paramName):
+    if not os.path.exists(stagingRoot):
+        os.makedirs(stagingRoot)
+    prefix = "job{:03d}_{}_".format(n, str(paramName).replace(" ", "_"))
+    return tempfile.mkdtemp(prefix=prefix, dir=stagingRoot) # mkdtemp guarantees a unique folder, even if the script is run twice at once
+
+###############################################################################################################
+# Every runner returns a result dictionary with these keys (status stays 'FAILED' until the runner says otherwise)
+def newJobResult(job):
+    return {'n':job['n'], 'paramName':job['paramName'], 'database':job.get('database'), 'fileName':job.get('fileName'),
+            'returncode':None, 'status':'FAILED', 'seconds':0.0, 'stdout':'', 'stderr':''}
+
+###############################################################################################################
+# Function to run a single job's ogr2ogr command and capture its output. Returns a result dictionary; never calls sys.exit()
+def runOgrJob(job):
+    result = newJobResult(job) # FUNCTION CALL
+    start = time.time()
+    try:
+        rc = subprocess.run(job['ogrList'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        result['returncode'], result['stdout'], result['stderr'] = rc.returncode, rc.stdout, rc.stderr
+        result['status'] = 'OK' if rc.returncode == 0 else 'FAILED'
+    except OSError as error: # ex. ogr2ogr.exe not found
+        result['stderr'] = str(error)
+    result['seconds'] = time.time() - start
+    writeJobOutput(job, result) # FUNCTION CALL
+    return result
+
+###############################################################################################################
+# Function to keep a job's captured output next to its query.sql, so a failed row can be checked after the run
+def writeJobOutput(job, result):
+    stagingDir = job.get('stagingDir')
+    if stagingDir and os.path.isdir(stagingDir):
+        for stream in ['stdout', 'stderr']:
+            with open(os.path.join(stagingDir, "ogr_{}.txt".format(stream)), 'w') as thing:
+                thing.write(result[stream] or "")
+
+###############################################################################################################
+# Function to list a job's output files (one per format for rows with several outTypes)
+def jobOutputs(job):
+    return [spec['fileName'] for spec in job['fanOut']] if job.get('fanOut') else [job['fileName']]
+
+###############################################################################################################
+# Function to split a row's 'dependsOn' value (paramNames separated by semicolons) into a list
+def parseDependsOn(value):
+    return [d.strip() for d in re.split(r"[;,]", value or "") if d.strip()]
+
+# Function to sort jobs so every job comes after the jobs it depends on (otherwise in their current order).
+# Raises ValueError for an unknown paramName or a circular dependency
+def dependencyOrder(jobs):
+    byName = dict((job['paramName'], job) for job in jobs)
+    for job in jobs:
+        for d in job.get('dependsOn') or []:
+            if d not in byName:
+                raise ValueError("{} depends on '{}', which isn't a paramName in the params file".format(job['paramName'], d))
+    ordered, state = [], {} # state: 'visiting' while a job's dependencies are being walked, then 'done'
+
+    def visit(job, path):
+        name = job['paramName']
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError("circular dependsOn: {}".format(" -> ".join(path + [name])))
+        state[name] = 'visiting'
+        for d in job.get('dependsOn') or []:
+            visit(byName[d], path + [name])
+        state[name] = 'done'
+        ordered.append(job)
+
+    for job in jobs:
+        visit(job, [])
+    return ordered
+
+###############################################################################################################
+# Function to sort out which waiting jobs can start: a job is ready once every job it depends on (that's part of this run) finished OK,
+# and is skipped as soon as one of them didn't. Jobs it depends on that aren't part of this run (ex. already up to date) count as finished
+def _readyJobs(waiting, finished, names):
+    ready, skipped, changed = [], [], True
+    while changed:
+        changed = False
+        for job in list(waiting):
+            deps = [d for d in job.get('dependsOn') or [] if d in names]
+            failed = [d for d in deps if d in finished and finished[d] != 'OK']
+            if failed:
+                result = newJobResult(job) # FUNCTION CALL
+                result['status'] = 'SKIPPED'
+                result['stderr'] = "Not run, because {} didn't finish OK".format(", ".join(failed))
+                finished[job['paramName']] = 'SKIPPED'
+                skipped.append(result)
+                waiting.remove(job)
+                changed = True # a skipped job can make the jobs downstream of it skip too
+            elif all(finished.get(d) == 'OK' for d in deps):
+                ready.append(job)
+                waiting.remove(job)
+    return ready, skipped
+
+###############################################################################################################
+def _runWithCap(job, dbSemaphore, runner, dbSemaphores=None):
+    with dbSemaphore: # blocks here if this job's database already has 'dbConnectionCap' jobs running
+        printSafe("\tStarted  job {:>3}: {} ({})".format(job['n'], job['paramName'], job.get('database')))
+        _jobSlot.semaphore, _jobSlot.semaphores = dbSemaphore, dbSemaphores
+        try:
+            result = runner(job)
+        finally:
+            _jobSlot.semaphore, _jobSlot.semaphores = None, None
+    printSafe("\tFinished job {:>3}: {} - {} in {:.1f} s".format(job['n'], job['paramName'], result['status'], result['seconds']))
+    return result
+
+###############################################################################################################
+# Function for a runner that runs jobs of its own (ex. a chunked row's tiles): returns the per-database semaphores of the
+# runJobs() running the current job (None outside runJobs), so its jobs share the same connection cap
+def currentSemaphores():
+    return getattr(_jobSlot, 'semaphores', None)
+
+# Function to give up the current job's database slot while its own jobs run (they take a slot each), and take it back afterwards
+@contextlib.contextmanager
+def releasedSlot():
+    semaphore = getattr(_jobSlot, 'semaphore', None)
+    if semaphore is None:
+        yield
+        return
+    semaphore.release()
+    try:
+        yield
+    finally:
+        semaphore.acquire()
+
+###############################################################################################################
+# Function to run a list of jobs across a bounded worker pool, with a per-database connection cap.
+# Jobs with 'dependsOn' wait for those jobs to finish OK (and are skipped if one of them doesn't).
+# 'runner' is the function that executes one job (default: ogr2ogr via subprocess); returns results in job order.
+# 'dbSemaphores' shares another runJobs' connection cap (see currentSemaphores) instead of starting a new one
+def runJobs(jobs, maxWorkers=4, dbConnectionCap=2, runner=runOgrJob, dbSemaphores=None):
+    maxWorkers, dbConnectionCap = max(1, int(maxWorkers)), max(1, int(dbConnectionCap))
+    dbSemaphores = {} if dbSemaphores is None else dbSemaphores
+    for job in jobs:
+        dbSemaphores.setdefault(job.get('database'), threading.BoundedSemaphore(dbConnectionCap))
+
+    msg = "Running {} job(s) with up to {} worker(s), max {} connection(s) per database..".format(len(jobs), maxWorkers, dbConnectionCap)
+    print("\n{}\n{}".format(msg, "-"*len(msg)))
+
+    results, waiting, finished, futures = [], list(jobs), {}, {}
+    names = set(job['paramName'] for job in jobs)
+    with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+        while waiting or futures:
+            ready, skipped = _readyJobs(waiting, finished, names) # FUNCTION CALL
+            for result in skipped:
+                printSafe("\tSkipped  job {:>3}: {} - {}".format(result['n'], result['paramName'], result['stderr']))
+            results += skipped
+            for job in ready: # in list order, so --plan's longest-first order still holds among the jobs that are ready
+                futures[pool.submit(_runWithCap, job, dbSemaphores[job.get('database')], runner, dbSemaphores)] = job
+            if not futures:
+                break
+            done, pending = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as error: # a bug in a runner shouldn't take down the other jobs
+                    result = newJobResult(job) # FUNCTION CALL
+                    result['stderr'] = repr(error)
+                finished[job['paramName']] = result['status']
+                results.append(result)
+    return sorted(results, key=lambda r: r['n'])
+
+###############################################################################################################
+# Run ids: each row's signature and output stamps, kept per run id so a re-run can skip rows that are already up to date
+def runStatePath(stagingRoot, runId):
+    return os.path.join(stagingRoot, "runs", "{}.json".format(re.sub(r"[^\w.-]", "_", runId)))
+
+def readRunState(path):
+    try:
+        with open(path, 'r') as thing:
+            return json.load(thing)
+    except (OSError, ValueError): # first run with this run id (or an unreadable state file) - nothing is up to date
+        return {'rows':{}}
+
+def _fileStamp(fileName):
+    try:
+        stat = os.stat(fileName)
+        return [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        return None
+
+# Function to hash what a row does: its staged SQL and its ogr2ogr options (without the login or the staging folder, which change every run)
+def jobSignature(job):
+    with open(job['sqlFile'], 'r') as thing:
+        sqlString = thing.read()
+    options = [arg for arg in job['ogrList'] if arg not in (job['ds'], "@{}".format(job['sqlFile']))]
+    return hashlib.sha1(json.dumps([" ".join(sqlString.split()), options]).encode('utf-8')).hexdigest()
+
+def _upstreamStamps(job, byName):
+    return dict((d, [_fileStamp(f) for f in jobOutputs(byName[d])]) for d in job.get('dependsOn') or [] if d in byName)
+
+###############################################################################################################
+# Function to drop the jobs that are up to date for this run id. Returns (jobs left to run, results for the skipped jobs)
+def skipUpToDate(jobs, runState):
+    byName = dict((job['paramName'], job) for job in jobs)
+    upToDate, results = set(), []
+    for job in dependencyOrder(jobs): # FUNCTION CALL - upstream rows are checked first
+        record = runState['rows'].get(job['paramName'])
+        current = (record is not None and record['signature'] == jobSignature(job) # FUNCTION CALL
+                   and record['outputs'] == [_fileStamp(f) for f in jobOutputs(job)] and None not in record['outputs']
+                   and record['upstream'] == _upstreamStamps(job, byName) # FUNCTION CALL
+                   and all(d in upToDate for d in job.get('dependsOn') or []))
+        if current:
+            upToDate.add(job['paramName'])
+            result = newJobResult(job) # FUNCTION CALL
+            result['status'], result['returncode'] = 'OK', 0
+            result['stdout'] = "up to date since {}".format(record['finished'])
+            results.append(result)
+    toRun = [job for job in jobs if job['paramName'] not in upToDate]
+    if upToDate:
+        print("\n{} row(s) already up to date for this run id: {}".format(len(upToDate), ", ".join(sorted(upToDate))))
+    return toRun, results
+
+# Function to save the signature and output stamps of every row that finished OK (including rows that were up to date)
+def recordRun(runState, path, jobs, results):
+    byName = dict((job['paramName'], job) for job in jobs)
+    for r in results:
+        job = byName.get(r['paramName'])
+        if job is None:
+            continue
+        if r['status'] != 'OK':
+            runState['rows'].pop(job['paramName'], None) # so the row runs again next time
+            continue
+        runState['rows'][job['paramName']] = {'signature':jobSignature(job), 'outputs':[_fileStamp(f) for f in jobOutputs(job)], # FUNCTION CALL
+                                              'upstream':_upstreamStamps(job, byName), 'finished':time.strftime("%Y-%m-%d %H:%M:%S")}
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmpPath = path + ".tmp"
+    with open(tmpPath, 'w') as thing:
+        json.dump(runState, thing, indent=2)
+    os.replace(tmpPath, path) # replace in one step, so a crash never leaves half a state file
+
+###############################################################################################################
+# Function to print a summary table of job results, plus the tail of stderr for any failed job
+def printSummaryTable(results):
+    header = "{:>3}  {:<30} {:<10} {:<7} {:>9}  {}".format("n", "paramName", "database", "status", "seconds", "output")
+    print("\n\nJob summary:\n{}\n{}".format(header, "="*len(header)))
+    for r in results:
+        print("{:>3}  {:<30} {:<10} {:<7} {:>9.1f}  {}".format(r['n'], str(r['paramName'])[:30], str(r['database'])[:10],
+                                                            r['status'], r['seconds'], r['fileName']))
+    totalSecs = sum(r['seconds'] for r in results)
+    print("-"*len(header))
+    print("{} OK, {} failed, {} skipped; {:.1f} s of ogr2ogr time in total\n".format(len([r for r in results if r['status'] == 'OK']),
+        len([r for r in results if r['status'] not in ('OK', 'SKIPPED')]), len([r for r in results if r['status'] == 'SKIPPED']), totalSecs))
+
+    for r in results:
+        if r['status'] == 'SKIPPED':
+            print("Job {} ({}) was skipped: {}\n".format(r['n'], r['paramName'], r['stderr']))
+        elif r['status'] != 'OK':
+            print("Job {} ({}) failed with return code {}; last lines of stderr:".format(r['n'], r['paramName'], r['returncode']))
+            for line in (r['stderr'] or "").strip().splitlines()[-10:]:
+                print("\t{}".format(line))
+            print("")
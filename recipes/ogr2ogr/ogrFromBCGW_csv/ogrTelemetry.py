@@ -0,0 +1,149 @@
+
+# ogrTelemetry.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# Writes one JSON record per row run (JSON Lines - one record per line) to the file in the 'telemetryLog' variable, so a slow run can be picked apart
+# afterwards instead of guessing from the printed CLI strings. Each record has:
+#   ts, runId, n, paramName, database, engine, outType, status, exitCode
+#   totalSeconds - the whole row, including retries of chunked tiles and the GPKG index build
+#   querySeconds - time until the database returned the first feature (null where the engine can't tell, see below); writeSeconds - the rest
+#   rows         - features in the output layer; bytesOut - size of the output file(s)
+#   peakRssMB    - this Python's peak memory so far (the "gdal" engine does its work inside it); childPeakRssMB - the largest ogr2ogr.exe so far (not on Windows)
+
+r"""NOTES ON THE TELEMETRY:
+--------------------------------------------------------------------------------------
+1. querySeconds is measured where the engine reads the database itself: rows with several outTypes (the "gdal" engine times the query and first fetch;
+   the "subprocess" engine times its 'database read' step), and shared-scan fetches (paramName sharedScan0, sharedScan1 ..), which only query.
+   A single-format row is one gdal.VectorTranslate / ogr2ogr.exe call, so its query and write time can't be split; querySeconds is null for those.
+   Rows made from a shared-scan scratch file don't query the database at all, so their querySeconds is 0.
+
+2. Peak memory is a high-water mark for the whole process, not for one row - with maxWorkers > 1 it includes whatever else was running.
+   Run with maxWorkers = 1 to see one row's peak.
+
+3. Load the log into pandas with  pandas.read_json(r"T:\tempQueryFolder\ogrTelemetry.jsonl", lines=True)
+"""
+
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import ogrEngines # companion modules - must be in the same folder as this script
+import ogrScheduler
+
+try:
+    import resource # not on Windows
+except ImportError:
+    resource = None
+
+_logLock = threading.Lock()
+
+###############################################################################################################
+# Function to return this process's peak memory in MB so far (Windows: peak working set; Linux / Mac: ru_maxrss)
+def peakRssMB():
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class _MemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD), ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t), ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = _MemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+        return round(counters.PeakWorkingSetSize / 1048576.0, 1)
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1048576.0 if sys.platform == 'darwin' else 1024.0), 1) # bytes on Mac, KB on Linux
+
+def childPeakRssMB():
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / (1048576.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+###############################################################################################################
+# Function to add up the size of a row's output files (a shapefile's .shp / .shx / .dbf .. all count)
+def bytesOut(job):
+    total = 0
+    for fileName in ogrScheduler.jobOutputs(job): # FUNCTION CALL
+        base, ext = os.path.splitext(fileName)
+        parts = [base + p for p in ('.shp', '.shx', '.dbf', '.prj', '.cpg')] if ext.lower() == '.shp' else [fileName]
+        total += sum(os.path.getsize(p) for p in parts if os.path.isfile(p))
+    return total
+
+# Function to count the features written, from the fan-out runner's message or by opening the (first) output layer
+def outputRows(job, result):
+    m = re.match(r"^(\d+) feature\(s\) read once", result.get('stdout') or "")
+    if m:
+        return int(m.group(1))
+    if ogrEngines.ogr is None or result['status'] != 'OK':
+        return None
+    fileName = ogrScheduler.jobOutputs(job)[0] # FUNCTION CALL
+    layerName = ogrEngines._ogrOption(job['ogrList'], '-nln')
+    try:
+        outDS = ogrEngines.ogr.Open(fileName)
+        lyr = (outDS.GetLayerByName(layerName) if layerName else None) or outDS.GetLayer(0)
+        return lyr.GetFeatureCount()
+    except Exception: # an output the driver can't re-open shouldn't fail the row
+        return None
+
+###############################################################################################################
+# Function to build one row's telemetry record from its job and result
+def makeRecord(job, result, totalSeconds, runId=None, engine=None):
+    querySeconds = result.get('querySeconds')
+    if querySeconds is None and job.get('database') == 'scratch':
+        querySeconds = 0.0 # made from a shared-scan scratch file
+    elif querySeconds is None and job['n'] < 0:
+        querySeconds = totalSeconds # a shared-scan fetch only reads the database
+    return {'ts':datetime.datetime.now().isoformat(timespec='seconds'), 'runId':runId, 'n':job['n'], 'paramName':job['paramName'],
+            'database':job.get('database'), 'engine':engine, 'outType':job.get('outType'), 'status':result['status'], 'exitCode':result['returncode'],
+            'totalSeconds':round(totalSeconds, 3), 'querySeconds':None if querySeconds is None else round(querySeconds, 3),
+            'writeSeconds':None if querySeconds is None else round(max(0.0, totalSeconds - querySeconds), 3),
+            'rows':outputRows(job, result), 'bytesOut':bytesOut(job), 'peakRssMB':peakRssMB(), 'childPeakRssMB':childPeakRssMB(), # FUNCTION CALLS
+            'output':result.get('fileName')}
+
+def writeRecord(logPath, record):
+    with _logLock: # one line per record, even with several workers writing at once
+        if not os.path.exists(os.path.dirname(logPath) or "."):
+            os.makedirs(os.path.dirname(logPath))
+        with open(logPath, 'a') as thing:
+            thing.write(json.dumps(record, default=str) + "\n")
+
+###############################################################################################################
+# Function to wrap a runner so every job it runs appends a telemetry record to logPath. Returns a new runner
+def getTelemetryRunner(runner, logPath, runId=None, engine=None):
+    if not logPath:
+        return runner
+    def runJob(job):
+        start = time.time()
+        try:
+            result = runner(job)
+        except Exception as error: # recorded as FAILED, then passed on to ogrScheduler.runJobs as before
+            result = ogrScheduler.newJobResult(job) # FUNCTION CALL
+            result['stderr'] = repr(error)
+            writeRecord(logPath, makeRecord(job, result, time.time() - start, runId, engine)) # FUNCTION CALL
+            raise
+        writeRecord(logPath, makeRecord(job, result, time.time() - start, runId, engine)) # FUNCTION CALL
+        return result
+    return runJob
+
+# Function to read the records back, optionally just one run id's
+def readRecords(logPath, runId=None):
+    records = []
+    if not os.path.isfile(logPath):
+        return records
+    with open(logPath, 'r') as thing:
+        for line in thing:
+            if line.strip():
+                record = json.loads(line)
+                if runId is None or record.get('runId') == runId:
+                    records.append(record)
+    return records
+
+# ex. runner = getTelemetryRunner(ogrEngines.getRunner("gdal"), r"T:\tempQueryFolder\ogrTelemetry.jsonl", "weekly", "gdal") # FUNCTION CALL
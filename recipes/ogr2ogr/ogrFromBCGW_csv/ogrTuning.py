@@ -0,0 +1,179 @@
+
+# ogrTuning.py
+# Companion module for ogrFromBCGW_csv_FINAL.py / ogrFromDB_csv.py
+
+# GDAL / OGR tuning for every row: a named profile (the 'tuningProfile' variable) adds GDAL_CACHEMAX, OGR_SQLITE_CACHE and -gt (features per
+# transaction) to each row's ogr2ogr options when it runs. --autotune tries a small grid of those settings on a sample of one row per source table,
+# and saves the fastest for that table to 'tuningFile'; later runs use the saved settings for rows reading that table instead of the profile.
+#   "default"    - GDAL's own defaults (and the row's own options, ex. the gpkgFastWrite profile)
+#   "bulk"       - big caches and one transaction per output, for big rows on a machine with memory to spare
+#   "low-memory" - small caches and small transactions, for running many rows at once on a small machine
+
+r"""NOTES ON TUNING:
+--------------------------------------------------------------------------------------
+1. Tuned settings replace the row's own --config / -gt values with the same names, ex. "low-memory" turns gpkgFastWrite's -gt unlimited into -gt 10000.
+   Outputs are the same either way, so the output cache (ogrCache.py) and --runId don't treat a tuning change as a change to the row.
+
+2. GDAL reads GDAL_CACHEMAX once per process. The "subprocess" engine starts an ogr2ogr.exe per row, so each row gets its own value;
+   the "gdal" engine runs every row in this Python, so the profile's GDAL_CACHEMAX is set once for the whole run (setProcessCache) and per-table values
+   only change OGR_SQLITE_CACHE and -gt.
+
+3. GDAL's Oracle (OCI) driver has no setting for its fetch array size, so the profiles can't change how many rows come back per round trip.
+
+4. --autotune reads 'sampleRows' features of the first row for each table (select * from ( <sqlQuery> ) where rownum <= sampleRows),
+   once to warm up the database, then once for each setting in 'trialGrid'. A setting is only saved if it beats the row's own options ("default")
+   by 'minGain' (5%); otherwise the table is saved as "default", so a noisy sample doesn't pin a table to odd settings. Delete tuningFile (or re-run --autotune) to start over.
+"""
+
+import datetime
+import json
+import os
+import shutil
+import time
+
+import ogrColumns # companion modules - must be in the same folder as this script
+import ogrEngines
+import ogrScheduler
+import sqlDateRewriter
+
+profiles = {'default':{},
+            'bulk':{'config':{'GDAL_CACHEMAX':'1024', 'OGR_SQLITE_CACHE':'1024'}, 'gt':'unlimited'},
+            'low-memory':{'config':{'GDAL_CACHEMAX':'64', 'OGR_SQLITE_CACHE':'32'}, 'gt':'10000'}}
+
+# Settings tried by --autotune (GDAL_CACHEMAX and OGR_SQLITE_CACHE are in MB)
+trialGrid = [('default', {})] + [("cache {} MB, -gt {}".format(cache, gt), {'config':{'GDAL_CACHEMAX':cache, 'OGR_SQLITE_CACHE':cache}, 'gt':gt})
+                                 for cache in ('64', '512') for gt in ('10000', '100000', 'unlimited')]
+sampleRows = 50000
+minGain = 0.05
+
+###############################################################################################################
+# Function to return a row's source table(s) as a key for the tuning file, ex. "IDWPROD1:WHSE_LAND_AND_NATURAL_RESOURCE.PROT_CURRENT_FIRE_POLYS_SP".
+# None if the query isn't a plain select (those rows just use the profile)
+def tableKey(job):
+    if not job.get('sqlFile') or not os.path.isfile(job['sqlFile']):
+        return None
+    with open(job['sqlFile'], 'r') as thing:
+        parsed = ogrColumns._parseQuery(sqlDateRewriter.tokenize(thing.read())) # FUNCTION CALL
+    if not parsed or not parsed['tables']:
+        return None
+    return "{}:{}".format(job.get('database'), "+".join(sorted(t[0].upper() for t in parsed['tables'])))
+
+def readTunings(tuningPath):
+    if not tuningPath or not os.path.isfile(tuningPath):
+        return {}
+    with open(tuningPath, 'r') as thing:
+        return json.load(thing)
+
+def writeTunings(tuningPath, tunings):
+    if not os.path.exists(os.path.dirname(tuningPath) or "."):
+        os.makedirs(os.path.dirname(tuningPath))
+    with open(tuningPath, 'w') as thing:
+        json.dump(tunings, thing, indent=2, sort_keys=True)
+
+###############################################################################################################
+# Function to put one setting's --config and -gt values into an ogr2ogr option list, replacing any the list already has
+def tuneOptions(args, settings):
+    options, config = ogrEngines.splitConfigOptions(args) # FUNCTION CALL
+    config.update(settings.get('config', {}))
+    if settings.get('gt'):
+        gtPos = [i for i, arg in enumerate(options) if arg == '-gt']
+        options = [arg for i, arg in enumerate(options) if not any(i in (p, p + 1) for p in gtPos)] + ['-gt', settings['gt']]
+    return options + sum([['--config', key, value] for key, value in config.items()], [])
+
+# Function to return a copy of a job with the setting applied to its own options and each fanned-out format's
+def tuneJob(job, settings):
+    if not settings:
+        return job
+    fanOut = [dict(spec, formatOptions=tuneOptions(spec['formatOptions'], settings), ogrList=tuneOptions(spec['ogrList'], settings)) for spec in job.get('fanOut') or []]
+    return dict(job, ogrList=tuneOptions(job['ogrList'], settings), fanOut=fanOut)
+
+# Function to set the profile's GDAL_CACHEMAX for this whole Python (the "gdal" engine). Returns the previous value, in bytes
+def setProcessCache(settings):
+    gdal = ogrEngines.gdal
+    cacheMB = settings.get('config', {}).get('GDAL_CACHEMAX') if settings else None
+    if gdal is None or cacheMB is None:
+        return None
+    previous = gdal.GetCacheMax()
+    gdal.SetCacheMax(int(cacheMB) * 1048576)
+    return previous
+
+###############################################################################################################
+# Function to wrap a runner so every job runs with its table's saved settings, or else the profile's. Returns a new runner
+def getTuningRunner(runner, profileName="default", tuningPath=None):
+    profile, tunings = profiles[profileName], readTunings(tuningPath)
+    if not profile and not tunings:
+        return runner
+    def runTunedJob(job):
+        tuned = tunings.get(tableKey(job)) if tunings else None # FUNCTION CALL
+        return runner(tuneJob(job, tuned['settings'] if tuned else profile))
+    return runTunedJob
+
+###############################################################################################################
+# Function to build a job that writes the first 'rows' features of a row's query to a scratch file in its staging folder
+def makeSampleJob(job, rows=sampleRows):
+    sampleDir = os.path.join(job['stagingDir'], "autotune")
+    if os.path.exists(sampleDir):
+        shutil.rmtree(sampleDir)
+    os.makedirs(sampleDir)
+    with open(job['sqlFile'], 'r') as thing:
+        innerSQL = thing.read().strip().rstrip(";")
+    limit = "where rownum <= {}".format(rows) if job['ds'].upper().startswith("OCI:") else "limit {}".format(rows)
+    sampleSqlFile = os.path.join(sampleDir, "sample_query.sql")
+    with open(sampleSqlFile, 'w') as thing:
+        thing.write("select * from (\n{}\n) tune_src\n{}".format(innerSQL, limit))
+    samplePath = os.path.join(sampleDir, "sample" + os.path.splitext(job['fileName'])[1])
+    ogrList = [samplePath if arg == job['fileName'] else "@{}".format(sampleSqlFile) if arg == "@{}".format(job['sqlFile']) else arg for arg in job['ogrList']]
+    if '-overwrite' not in ogrList:
+        ogrList.append('-overwrite')
+    return dict(job, ogrList=ogrList, fileName=samplePath, sqlFile=sampleSqlFile, stagingDir=sampleDir, fanOut=[], chunk=None, incremental=None, gpkgFastWrite=False)
+
+# Function to time every setting in trialGrid on one row per source table, save the fastest for each table to tuningPath, and print them.
+# 'runner' is a plain engine runner, ex. ogrEngines.getRunner("gdal")
+def autotune(jobs, runner, tuningPath, rows=sampleRows):
+    tunings, tableRows, seen = readTunings(tuningPath), [], set()
+    for job in jobs:
+        key = tableKey(job) # FUNCTION CALL
+        if key is None or key in seen or job.get('database') == 'scratch':
+            continue
+        seen.add(key)
+        sampleJob = makeSampleJob(job, rows) # FUNCTION CALL
+        ogrScheduler.printSafe("\tAutotune: {} ({}), {} sample rows".format(key, job['paramName'], rows))
+        if runner(sampleJob)['status'] != 'OK': # warm-up, so the first setting isn't the one that waits for the database's cold cache
+            tableRows.append((key, job['paramName'], "sample failed, see {}".format(sampleJob['stagingDir']), "", ""))
+            continue
+
+        timings = {}
+        for name, settings in trialGrid:
+            previous = setProcessCache(settings) # FUNCTION CALL
+            start = time.time()
+            result = runner(tuneJob(sampleJob, settings))
+            if previous is not None:
+                ogrEngines.gdal.SetCacheMax(previous)
+            if result['status'] == 'OK':
+                timings[name] = time.time() - start
+        if not timings:
+            tableRows.append((key, job['paramName'], "every setting failed", "", ""))
+            continue
+
+        best = min(timings, key=timings.get)
+        if 'default' in timings and timings[best] > timings['default'] * (1 - minGain):
+            best = 'default' # not clearly faster than the row's own options
+        tunings[key] = {'name':best, 'settings':dict(trialGrid)[best], 'seconds':round(timings[best], 3), 'sampleRows':rows,
+                        'paramName':job['paramName'], 'tuned':datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        tableRows.append((key, job['paramName'], best, "{:.2f}".format(timings[best]), "{:.2f}".format(timings.get('default', float('nan')))))
+        shutil.rmtree(sampleJob['stagingDir'], ignore_errors=True)
+
+    if tuningPath:
+        writeTunings(tuningPath, tunings) # FUNCTION CALL
+    printTuningTable(tableRows, tuningPath)
+    return tunings
+
+def printTuningTable(tableRows, tuningPath):
+    columns = ['table', 'row', 'fastest setting', 'seconds', 'default s']
+    widths = [max([len(c)] + [len(str(r[i])) for r in tableRows]) for i, c in enumerate(columns)]
+    line = "  ".join("{:<{}}".format(c, w) for c, w in zip(columns, widths))
+    print("\nAutotune results (saved to {})\n{}\n{}".format(tuningPath, line, "="*len(line)))
+    for r in tableRows:
+        print("  ".join("{:<{}}".format(str(v), w) for v, w in zip(r, widths)))
+
+# ex. runner = getTuningRunner(ogrEngines.getRunner("gdal"), "bulk", r"T:\tempQueryFolder\ogrTuning.json") # FUNCTION CALL
@@ -0,0 +1,145 @@
+'''
+test_ogrCache.py
+description: checks ogrCache's key, source fingerprint, hits and misses, count-only expiry and LRU eviction
+with a stand-in for the fingerprint query and a temporary cacheRoot (no osgeo / BCGW needed).
+
+run with:  python -m pytest test_ogrCache.py
+'''
+
+import json
+import os
+import time
+
+import pytest
+
+import ogrCache
+import ogrScheduler
+
+SQL = """select CROWN_LANDS_FILE, TENURE_STAGE, WHEN_UPDATED, SHAPE
+from WHSE_TANTALIS.TA_CROWN_TENURES_SVW where TENURE_STAGE = 'TENURE'"""
+
+###############################################################################################################
+def _makeJob(tmpDir, n=0, sqlString=SQL, login="user/pass", extraOptions=()):
+    sqlFile = os.path.join(str(tmpDir), "query{}.sql".format(n))
+    with open(sqlFile, 'w') as thing:
+        thing.write(sqlString)
+    fileName = os.path.join(str(tmpDir), "out", "tenures{}.gpkg".format(n))
+    ds = 'OCI:{}@IDWPROD1:no_Table'.format(login)
+    return {'n':n, 'paramName':'tenureParams', 'database':'IDWPROD1', 'ds':ds, 'outType':'GPKG', 'fileName':fileName, 'sqlFile':sqlFile,
+            'fanOut':[], 'ogrList':['ogr2ogr', '-f', 'GPKG', '-overwrite', fileName, ds, '-sql', '@' + sqlFile, '-nln', 'tenures'] + list(extraOptions)}
+
+def _standInFetch(source):
+    # answers the fingerprint query from 'source' ({'rows':.., 'maxDate':..}) and logs each query it was asked
+    def fetchFor(job):
+        def fetch(sqlString):
+            source.setdefault('queries', []).append(sqlString)
+            return ['COUNT', 'MAX'], [(source['rows'], source['maxDate'])]
+        return fetch
+    return fetchFor
+
+def _runAndStore(jobs, text="features"):
+    # stands in for ogr2ogr: writes each job's output, then saves it to the cache
+    results = []
+    for job in jobs:
+        os.makedirs(os.path.dirname(job['fileName']), exist_ok=True)
+        with open(job['fileName'], 'w') as thing:
+            thing.write(text)
+        result = ogrScheduler.newJobResult(job)
+        result['status'] = 'OK'
+        results.append(result)
+    ogrCache.storeResults(jobs, results)
+
+@pytest.fixture(autouse=True)
+def cacheRoot(tmp_path, monkeypatch):
+    monkeypatch.setattr(ogrCache, 'cacheRoot', str(tmp_path / "ogrCache"))
+    return tmp_path / "ogrCache"
+
+###############################################################################################################
+def test_key_ignores_layout_login_and_paths(tmp_path):
+    ''' Whitespace, the login and the output path don't change the key; the SQL, options and fingerprint do '''
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    job = _makeJob(tmp_path / "a")
+    fingerprint = {'rows':10, 'dateColumn':'WHEN_UPDATED', 'maxDate':'2024-03-01 10:00:00'}
+    key = ogrCache.cacheKey(job, SQL, fingerprint)
+    assert ogrCache.cacheKey(_makeJob(tmp_path / "b", login="someoneElse/secret"), "  ".join(SQL.split()), fingerprint) == key
+
+    assert ogrCache.cacheKey(job, SQL.replace("'TENURE'", "'APPLICATION'"), fingerprint) != key
+    assert ogrCache.cacheKey(job, SQL, dict(fingerprint, rows=11)) != key
+    assert ogrCache.cacheKey(job, SQL, dict(fingerprint, maxDate='2024-03-02 08:00:00')) != key
+    assert ogrCache.cacheKey(_makeJob(tmp_path / "a", extraOptions=['-t_srs', 'EPSG:4326']), SQL, fingerprint) != key
+    assert ogrCache.cacheKey(dict(job, ds='OCI:user/pass@IDWTEST1:no_Table'), SQL, fingerprint) != key
+
+def test_fingerprint_query(tmp_path):
+    ''' The update date column comes from cacheDateColumn, else the select list; without one only COUNT(*) is asked for '''
+    source = {'rows':10, 'maxDate':'2024-03-01 10:00:00'}
+    job = _makeJob(tmp_path)
+    assert ogrCache.sourceFingerprint(job, SQL + " order by 1", _standInFetch(source)(job)) == {'rows':10, 'dateColumn':'WHEN_UPDATED', 'maxDate':'2024-03-01 10:00:00'}
+    assert source['queries'][-1].startswith("select count(*), max(WHEN_UPDATED) from (") and "order by" not in source['queries'][-1]
+
+    noDate = SQL.replace("WHEN_UPDATED, ", "")
+    assert ogrCache.sourceFingerprint(job, noDate, _standInFetch(source)(job))['dateColumn'] is None
+    assert source['queries'][-1].startswith("select count(*) from (")
+    assert ogrCache.sourceFingerprint(dict(job, cacheDateColumn='TENURE_EXPIRY'), noDate, _standInFetch(source)(job))['dateColumn'] == 'TENURE_EXPIRY'
+
+def test_unchanged_source_hits_and_changes_miss(tmp_path):
+    ''' A stored row is restored while its fingerprint and options are unchanged; a new row count, update date or option misses '''
+    source = {'rows':10, 'maxDate':'2024-03-01 10:00:00'}
+    jobs, hits = ogrCache.restoreCachedJobs([_makeJob(tmp_path)], _standInFetch(source))
+    assert (len(jobs), hits) == (1, [])
+    _runAndStore(jobs)
+    os.remove(jobs[0]['fileName'])
+
+    jobs, hits = ogrCache.restoreCachedJobs([_makeJob(tmp_path)], _standInFetch(source))
+    assert jobs == [] and hits[0]['status'] == 'OK'
+    with open(_makeJob(tmp_path)['fileName']) as thing:
+        assert thing.read() == "features"
+
+    for changed in [dict(source, rows=11), dict(source, maxDate='2024-03-02 08:00:00')]:
+        jobs, hits = ogrCache.restoreCachedJobs([_makeJob(tmp_path)], _standInFetch(changed))
+        assert (len(jobs), hits) == (1, [])
+    jobs, hits = ogrCache.restoreCachedJobs([_makeJob(tmp_path, extraOptions=['-lco', 'FID=OBJECTID'])], _standInFetch(source))
+    assert (len(jobs), hits) == (1, [])
+
+def test_count_only_entries_expire(tmp_path, monkeypatch):
+    ''' Entries with no update date column are only used for noDateMaxHours; entries with one don't expire '''
+    noDate = SQL.replace("WHEN_UPDATED, ", "")
+    source = {'rows':10, 'maxDate':'2024-03-01 10:00:00'}
+    _runAndStore(ogrCache.restoreCachedJobs([_makeJob(tmp_path, 0, noDate), _makeJob(tmp_path, 1)], _standInFetch(source))[0])
+
+    later = time.time() + (ogrCache.noDateMaxHours + 1) * 3600
+    monkeypatch.setattr(ogrCache.time, 'time', lambda: later)
+    jobs, hits = ogrCache.restoreCachedJobs([_makeJob(tmp_path, 0, noDate), _makeJob(tmp_path, 1)], _standInFetch(source))
+    assert [job['n'] for job in jobs] == [0]
+    assert [r['n'] for r in hits] == [1]
+
+def test_rows_that_build_on_their_output_are_not_cached(tmp_path):
+    ''' Incremental rows, rows without -overwrite and rows with dependsOn always run, without a fingerprint query '''
+    source = {'rows':10, 'maxDate':'2024-03-01 10:00:00'}
+    job = _makeJob(tmp_path)
+    jobs = [dict(job, incremental={'watermarkColumn':'WHEN_UPDATED'}), dict(job, ogrList=[a for a in job['ogrList'] if a != '-overwrite']),
+            dict(job, dependsOn=['otherParams'])]
+    toRun, hits = ogrCache.restoreCachedJobs(jobs, _standInFetch(source))
+    assert (len(toRun), hits, 'queries' in source) == (3, [], False)
+    assert not any('cacheKey' in j for j in toRun)
+
+def test_rows_that_skipped_the_cache_are_not_stored(tmp_path, cacheRoot):
+    ''' With --no-cache restoreCachedJobs isn't called, so no row has a cacheKey and storeResults saves nothing '''
+    _runAndStore([_makeJob(tmp_path)])
+    assert not cacheRoot.exists() or not any(p.is_file() for p in cacheRoot.rglob("*"))
+
+def test_eviction_keeps_the_cache_under_its_size(tmp_path):
+    ''' Least recently used entries are deleted until the cache fits; the ones used last are kept '''
+    source = {'rows':10, 'maxDate':'2024-03-01 10:00:00'}
+    jobs = [_makeJob(tmp_path, n, SQL.replace("'TENURE'", "'TENURE{}'".format(n))) for n in range(4)]
+    _runAndStore(ogrCache.restoreCachedJobs(jobs, _standInFetch(source))[0], text="x" * 1000)
+    for lastUsed, job in enumerate(jobs): # n=0 used longest ago
+        entryPath = os.path.join(ogrCache.entryDir(job['cacheKey']), ogrCache.entryFileName)
+        with open(entryPath) as thing:
+            entry = json.load(thing)
+        ogrCache._writeEntry(os.path.dirname(entryPath), dict(entry, lastUsed=lastUsed))
+
+    assert ogrCache.evictEntries(maxGB=2500 / 1024**3) == 2
+    kept = [job['n'] for job in jobs if os.path.isdir(ogrCache.entryDir(job['cacheKey']))]
+    assert kept == [2, 3]
+    assert ogrCache.evictEntries(maxGB=2500 / 1024**3) == 0
@@ -0,0 +1,104 @@
+'''
+test_ogrChunked.py
+description: checks ogrChunked's tile SQL, duplicate removal, resume file and retries with a stand-in runner and a SQLite stand-in
+for the merged GeoPackage (no ogr2ogr / BCGW needed).
+
+run with:  python -m pytest test_ogrChunked.py
+'''
+
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import ogrChunked
+import ogrScheduler
+
+###############################################################################################################
+def _makeJob(tmpDir, chunkTiles="2x2", chunkRetries=None):
+    sqlFile = os.path.join(str(tmpDir), "query.sql")
+    with open(sqlFile, 'w') as thing:
+        thing.write("select FEATURE_ID, SHAPE from WHSE_FOREST_VEGETATION.VEG_COMP_LYR_R1_POLY where PROJECTED_DATE is not null")
+    fileName = os.path.join(str(tmpDir), "vri.gpkg")
+    stagingDir = os.path.join(str(tmpDir), "staging")
+    os.makedirs(stagingDir)
+    ds = 'OCI:user/pass@IDWPROD1:no_Table'
+    return {'n':0, 'paramName':'vriParams', 'database':'IDWPROD1', 'ds':ds, 'outType':'GPKG', 'outName':'vri', 'fileName':fileName,
+            'sqlFile':sqlFile, 'stagingDir':stagingDir, 'fanOut':[],
+            'ogrList':['ogr2ogr', '-f', 'GPKG', fileName, ds, '-sql', '@' + sqlFile, '-nln', 'vri', '-a_srs', 'EPSG:3005'],
+            'chunk':ogrChunked.chunkSettings('vriParams', chunkTiles, 'FEATURE_ID', None, '0,0,100,100', chunkRetries)}
+
+def _standInRunner(pulled, failing=()):
+    # writes each tile's file and logs its tile id, unless the tile id is in 'failing'
+    lock = threading.Lock()
+    def runJob(job):
+        result = ogrScheduler.newJobResult(job)
+        with lock:
+            pulled.append(job['tileId'])
+        if job['tileId'] not in failing:
+            with open(job['fileName'], 'w') as thing:
+                thing.write(job['tileId'])
+            result['status'] = 'OK'
+        return result
+    return runJob
+
+@pytest.fixture
+def merged(monkeypatch):
+    # stands in for the GDAL merge: records which tiles were merged
+    calls = []
+    monkeypatch.setattr(ogrChunked, 'mergeTiles', lambda job, tilePaths, layerName, keyColumn: calls.append(
+        [os.path.basename(p) for p in tilePaths]) or (len(tilePaths), 0))
+    return calls
+
+###############################################################################################################
+def test_tile_sql_adds_the_filter_to_the_top_level_where():
+    ''' The tile's SDO_FILTER goes in the outer WHERE clause, before ORDER BY; UNION queries aren't chunked '''
+    sqlString = "select t.ID, t.SHAPE from T t where t.ID in (select ID from U where X = 1) order by t.ID"
+    tiled = ogrChunked.tileSQL(sqlString, 't.SHAPE', (0, 0, 50, 50))
+    assert "where SDO_FILTER(t.SHAPE" in tiled and "SDO_ORDINATE_ARRAY(0.000, 0.000, 50.000, 50.000)" in tiled
+    assert tiled.index("and (t.ID in (select ID from U where X = 1))") < tiled.index("order by t.ID")
+    assert ogrChunked.tileSQL("select ID, SHAPE from T union select ID, SHAPE from U", 'SHAPE', (0, 0, 1, 1)) is None
+
+def test_features_on_tile_edges_are_kept_once(tmp_path):
+    ''' A feature that came back in several tiles keeps its first copy; features without a key are all kept '''
+    fileName = str(tmp_path / "vri.gpkg")
+    conn = sqlite3.connect(fileName)
+    conn.execute('CREATE TABLE "vri" (fid INTEGER PRIMARY KEY AUTOINCREMENT, FEATURE_ID INTEGER, TILE TEXT)')
+    conn.executemany('INSERT INTO "vri" (FEATURE_ID, TILE) VALUES (?, ?)',
+                     [(1, 'r00c00'), (2, 'r00c00'), (2, 'r00c01'), (3, 'r00c01'), (2, 'r01c01'), (None, 'r00c00'), (None, 'r01c00')])
+    conn.commit()
+    conn.close()
+    assert ogrChunked.dropDuplicates(fileName, 'vri', 'FEATURE_ID') == (5, 2)
+    conn = sqlite3.connect(fileName)
+    assert conn.execute('SELECT FEATURE_ID, TILE FROM "vri" ORDER BY fid').fetchall() == [
+        (1, 'r00c00'), (2, 'r00c00'), (3, 'r00c01'), (None, 'r00c00'), (None, 'r01c00')]
+    conn.close()
+
+def test_retries_then_resume_pulls_only_missing_tiles(tmp_path, merged):
+    ''' A failing tile is retried chunkRetries times; the next run only pulls the tiles not in the resume file, then merges all of them '''
+    job = _makeJob(tmp_path, chunkRetries="1")
+    pulled = []
+    result = ogrChunked.getChunkedRunner(_standInRunner(pulled, failing=('r01c00',)), 2, 2)(job)
+    assert result['status'] == 'FAILED' and "r01c00" in result['stderr']
+    assert sorted(pulled) == ['r00c00', 'r00c01', 'r01c00', 'r01c00', 'r01c01'] # one retry of the failed tile
+    with open(ogrChunked.resumePath(job['fileName'])) as thing:
+        assert json.load(thing)['done'] == ['r00c00', 'r00c01', 'r01c01']
+    assert merged == []
+
+    pulled = []
+    result = ogrChunked.getChunkedRunner(_standInRunner(pulled), 2, 2)(job)
+    assert result['status'] == 'OK' and pulled == ['r01c00']
+    assert merged == [['r00c00.gpkg', 'r00c01.gpkg', 'r01c00.gpkg', 'r01c01.gpkg']]
+    assert not os.path.exists(ogrChunked.resumePath(job['fileName'])) and not os.path.exists(job['fileName'] + "_tiles")
+
+def test_changed_query_starts_over(tmp_path, merged):
+    ''' Tiles recorded for a different query (or grid) are pulled again '''
+    job = _makeJob(tmp_path)
+    ogrChunked.getChunkedRunner(_standInRunner([], failing=('r00c00',)), 2, 2)(job)
+    with open(job['sqlFile'], 'a') as thing:
+        thing.write(" and SPECIES_CD_1 = 'FD'")
+    pulled = []
+    assert ogrChunked.getChunkedRunner(_standInRunner(pulled), 2, 2)(job)['status'] == 'OK'
+    assert sorted(pulled) == ['r00c00', 'r00c01', 'r01c00', 'r01c01']
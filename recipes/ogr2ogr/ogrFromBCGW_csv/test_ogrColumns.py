@@ -0,0 +1,89 @@
+'''
+test_ogrColumns.py
+description: checks ogrColumns' select * expansion with a stand-in for Oracle's ALL_TAB_COLUMNS (no osgeo / BCGW needed):
+LOB and annotation columns are left out, keepColumns limits the list, aliases and t.* are qualified, and each table is looked up once.
+
+run with:  python -m pytest test_ogrColumns.py
+'''
+
+import re
+
+import pytest
+
+import ogrColumns
+
+DS = 'OCI:user/pass@IDWPROD1:no_Table'
+
+# {(OWNER, TABLE): [(COLUMN_NAME, DATA_TYPE), ..]} in column order, like ALL_TAB_COLUMNS
+CATALOG = {('WHSE_TANTALIS', 'TA_CROWN_TENURES_SVW'): [('CROWN_LANDS_FILE', 'VARCHAR2'), ('TENURE_STAGE', 'VARCHAR2'), ('TENURE_EXPIRY', 'DATE'),
+                                                      ('TENURE_DOCUMENT', 'CLOB'), ('SE_ANNO_CAD_DATA', 'BLOB'), ('SHAPE', 'SDO_GEOMETRY')],
+           ('WHSE_TANTALIS', 'TA_INTEREST_HOLDER_VW'): [('CROWN_LANDS_FILE', 'VARCHAR2'), ('INTEREST_HOLDER', 'VARCHAR2'), ('NOTES', 'LONG')]}
+
+###############################################################################################################
+def _standInFetch(queries):
+    # answers the ALL_TAB_COLUMNS query from CATALOG and logs each query it was asked
+    def fetch(sqlString):
+        queries.append(sqlString)
+        owner, table = re.search(r"OWNER = '(\w+)' AND TABLE_NAME = '(\w+)'", sqlString).groups()
+        return ['COLUMN_NAME', 'DATA_TYPE'], CATALOG.get((owner, table), [])
+    return fetch
+
+@pytest.fixture(autouse=True)
+def catalogCache():
+    ogrColumns.clearCatalogCache()
+    yield
+    ogrColumns.clearCatalogCache()
+
+###############################################################################################################
+def test_lob_and_annotation_columns_left_out():
+    ''' select * becomes the table's columns without CLOB / BLOB / SE_ANNO_CAD_DATA; the geometry and the rest of the query are kept '''
+    newSQL, message = ogrColumns.expandSelectStar("select * from WHSE_TANTALIS.TA_CROWN_TENURES_SVW where TENURE_STAGE = 'TENURE'", _standInFetch([]), DS)
+    assert newSQL == "select CROWN_LANDS_FILE, TENURE_STAGE, TENURE_EXPIRY, SHAPE from WHSE_TANTALIS.TA_CROWN_TENURES_SVW where TENURE_STAGE = 'TENURE'"
+    assert message == "select * expanded to 4 column(s); left out 2 column(s): TENURE_DOCUMENT (CLOB), SE_ANNO_CAD_DATA (BLOB)"
+
+def test_keep_columns_limits_the_list():
+    ''' keepColumns keeps just those columns plus the geometry, and reports names the table doesn't have '''
+    newSQL, message = ogrColumns.expandSelectStar("select * from WHSE_TANTALIS.TA_CROWN_TENURES_SVW", _standInFetch([]), DS,
+                                                  keepColumns="crown_lands_file; TENURE_EXPIRY;NOT_A_COLUMN")
+    assert newSQL == "select CROWN_LANDS_FILE, TENURE_EXPIRY, SHAPE from WHSE_TANTALIS.TA_CROWN_TENURES_SVW"
+    assert message.startswith("select * expanded to 3 column(s)")
+    assert message.endswith("keepColumns not found in the table(s): NOT_A_COLUMN")
+
+def test_alias_star_and_joins_are_qualified():
+    ''' t.* only expands t's table, with the alias in front; other select list items are left alone '''
+    sqlString = """select t.*, h.INTEREST_HOLDER
+from WHSE_TANTALIS.TA_CROWN_TENURES_SVW t
+join WHSE_TANTALIS.TA_INTEREST_HOLDER_VW h on h.CROWN_LANDS_FILE = t.CROWN_LANDS_FILE"""
+    newSQL, message = ogrColumns.expandSelectStar(sqlString, _standInFetch([]), DS)
+    assert newSQL.splitlines()[0] == "select t.CROWN_LANDS_FILE, t.TENURE_STAGE, t.TENURE_EXPIRY, t.SHAPE, h.INTEREST_HOLDER"
+    assert newSQL.splitlines()[1:] == sqlString.splitlines()[1:]
+
+    # a bare * over two tables qualifies each column with its own table's alias, and LONG columns are left out too
+    newSQL = ogrColumns.expandSelectStar(sqlString.replace("t.*, h.INTEREST_HOLDER", "*"), _standInFetch([]), DS)[0]
+    assert newSQL.splitlines()[0] == ("select t.CROWN_LANDS_FILE, t.TENURE_STAGE, t.TENURE_EXPIRY, t.SHAPE, "
+                                      "h.CROWN_LANDS_FILE, h.INTEREST_HOLDER")
+
+def test_queries_left_as_written():
+    ''' No *, a subquery in FROM, a table without an owner or an unknown table all come back unchanged '''
+    queries = []
+    for sqlString in ["select CROWN_LANDS_FILE, SHAPE from WHSE_TANTALIS.TA_CROWN_TENURES_SVW",
+                      "select count(*) from WHSE_TANTALIS.TA_CROWN_TENURES_SVW",
+                      "select * from (select * from WHSE_TANTALIS.TA_CROWN_TENURES_SVW)",
+                      "select * from TA_CROWN_TENURES_SVW",
+                      "select * from WHSE_TANTALIS.NOT_A_TABLE"]:
+        assert ogrColumns.expandSelectStar(sqlString, _standInFetch(queries), DS)[0] == sqlString
+    assert len(queries) == 1 # only NOT_A_TABLE got as far as ALL_TAB_COLUMNS
+
+def test_each_table_looked_up_once_per_database():
+    ''' The catalog is cached per (database, owner, table), whatever case the query used '''
+    queries = []
+    fetch = _standInFetch(queries)
+    for sqlString in ["select * from WHSE_TANTALIS.TA_CROWN_TENURES_SVW",
+                      "select t.* from whse_tantalis.ta_crown_tenures_svw t where t.TENURE_STAGE = 'TENURE'"]:
+        ogrColumns.expandSelectStar(sqlString, fetch, DS)
+    assert len(queries) == 1
+    ogrColumns.expandSelectStar("select * from WHSE_TANTALIS.TA_CROWN_TENURES_SVW", fetch, 'OCI:user/pass@IDWTEST1:no_Table')
+    assert len(queries) == 2
+    ogrColumns.clearCatalogCache()
+    ogrColumns.expandSelectStar("select * from WHSE_TANTALIS.TA_CROWN_TENURES_SVW", fetch, DS)
+    assert len(queries) == 3
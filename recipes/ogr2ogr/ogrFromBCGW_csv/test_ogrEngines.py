@@ -0,0 +1,53 @@
+'''
+test_ogrEngines.py
+description: checks ogrEngines' coordinate precision options and the GDAL version check that leaves -xyRes out on GDAL older than 3.9,
+with a stand-in 'ogr2ogr --version' launcher (no osgeo / OSGeo4W needed).
+
+run with:  python -m pytest test_ogrEngines.py
+'''
+
+import os
+import sys
+
+import pytest
+
+import ogrEngines
+
+###############################################################################################################
+def _standInLauncher(tmpDir, versionLine):
+    # a launcher that answers --version like ogr2ogr.exe does
+    script = os.path.join(str(tmpDir), "ogr2ogr_{}.py".format(versionLine.split()[1]))
+    with open(script, 'w') as thing:
+        thing.write("print({!r})\n".format(versionLine))
+    return [sys.executable, script]
+
+@pytest.fixture(autouse=True)
+def gdalVersions(monkeypatch):
+    monkeypatch.setattr(ogrEngines, '_gdalVersions', {})
+    monkeypatch.setattr(ogrEngines, 'gdal', None) # the launcher's GDAL is what counts, not this Python's
+
+###############################################################################################################
+def test_precision_options():
+    ''' coordPrec becomes -xyRes in metres (GeoJSON also gets COORDINATE_PRECISION); snapGrid overrides it '''
+    assert ogrEngines.precisionOptions("KML", 1, simplify=2) == ['-simplify', '2', '-xyRes', '0.1 m']
+    assert ogrEngines.precisionOptions("GPKG", 1, snapGrid=0.5) == ['-xyRes', '0.5 m']
+    assert ogrEngines.precisionOptions("GeoJSON", 2, geographic=True) == ['-xyRes', '0.01 m', '-lco', 'COORDINATE_PRECISION=7']
+    assert ogrEngines.precisionOptions("GPKG", "none") == []
+    with pytest.raises(ValueError):
+        ogrEngines.precisionOptions("GPKG", "one")
+
+def test_old_gdal_leaves_xyres_out():
+    ''' xyRes=False drops -xyRes; GeoJSON is still rounded with COORDINATE_PRECISION '''
+    assert ogrEngines.precisionOptions("GPKG", 1, xyRes=False) == []
+    assert ogrEngines.precisionOptions("GeoJSON", 1, simplify=2, xyRes=False) == ['-simplify', '2', '-lco', 'COORDINATE_PRECISION=1']
+
+def test_launcher_gdal_version(tmp_path):
+    ''' The launcher's ogr2ogr --version decides -xyRes; a launcher that can't be run (and no osgeo) counts as too old '''
+    old = _standInLauncher(tmp_path, "GDAL 3.8.4, released 2024/02/08")
+    new = _standInLauncher(tmp_path, "GDAL 3.9.1 \"Ballina\", released 2024/06/22")
+    assert (ogrEngines.gdalVersionNum(old), ogrEngines.hasXyRes(old)) == (3080400, False)
+    assert (ogrEngines.gdalVersionNum(new), ogrEngines.hasXyRes(new)) == (3090100, True)
+    assert ogrEngines.hasXyRes([os.path.join(str(tmp_path), "missing", "ogr2ogr.exe")]) is False
+
+    os.remove(new[1]) # the version is only looked up once per launcher
+    assert ogrEngines.hasXyRes(new) is True
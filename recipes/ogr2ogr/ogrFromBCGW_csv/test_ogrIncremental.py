@@ -0,0 +1,109 @@
+'''
+test_ogrIncremental.py
+description: checks ogrIncremental's full / incremental decision, delta SQL, watermark handling and delta job
+without osgeo or BCGW (the upsert itself needs GDAL and isn't run here).
+
+run with:  python -m pytest test_ogrIncremental.py
+'''
+
+import datetime
+import os
+
+import pytest
+
+import ogrIncremental
+
+SQL = "select FIRE_NUMBER, LOAD_DATE, SHAPE from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_CURRENT_FIRE_POLYS_SP"
+NOW = datetime.datetime(2023, 6, 8, 9, 0, 0)
+
+###############################################################################################################
+def _makeJob(tmpDir, outType="GPKG", fullRefreshDays=None):
+    sqlFile = os.path.join(str(tmpDir), "query.sql")
+    with open(sqlFile, 'w') as thing:
+        thing.write(SQL)
+    fileName = os.path.join(str(tmpDir), "fires.gpkg")
+    with open(fileName, 'w') as thing:
+        thing.write("previous output")
+    ds = 'OCI:user/pass@IDWPROD1:no_Table'
+    return {'n':0, 'paramName':'fireParams', 'ds':ds, 'outType':outType, 'fileName':fileName, 'sqlFile':sqlFile, 'stagingDir':str(tmpDir),
+            'fanOut':[], 'ogrList':['ogr2ogr', '-f', outType, fileName, ds, '-sql', '@' + sqlFile, '-nln', 'fires', '-overwrite'],
+            'incremental':ogrIncremental.incrementalSettings('fireParams', 'load_date', 'fire_number', fullRefreshDays)}
+
+def _state(**changes):
+    state = {'layerName':'fires', 'watermarkColumn':'LOAD_DATE', 'keyColumn':'FIRE_NUMBER', 'watermark':'2023-06-07 14:30:00',
+             'sqlHash':ogrIncremental.sqlHash(SQL), 'lastFullRefresh':'2023-06-05 09:00:00', 'lastRun':'2023-06-07 15:00:00', 'lastMode':'full'}
+    state.update(changes)
+    return state
+
+@pytest.fixture(autouse=True)
+def standInGdal(monkeypatch):
+    monkeypatch.setattr(ogrIncremental, 'gdal', object()) # planRun only checks osgeo is there for the upsert
+
+###############################################################################################################
+def test_incremental_when_nothing_changed(tmp_path):
+    ''' Same SQL (whitespace aside), columns and a recorded watermark within fullRefreshDays: an incremental run '''
+    job = _makeJob(tmp_path, fullRefreshDays='7')
+    with open(job['sqlFile'], 'w') as thing:
+        thing.write(SQL.replace(" from ", "\n  from "))
+    assert ogrIncremental.planRun(job, _state(), NOW) == ('incremental', "rows with LOAD_DATE >= 2023-06-07 14:30:00")
+
+def test_full_run_reasons(tmp_path, monkeypatch):
+    ''' Every reason a row falls back to a full -overwrite run '''
+    job = _makeJob(tmp_path, fullRefreshDays='7')
+    cases = [(dict(job, fanOut=[{'outType':'KML'}]), _state(), "several outTypes"),
+             (dict(job, outType='GeoJSON'), _state(), "need a GPKG output"),
+             (job, None, "no previous output"),
+             (dict(job, fileName=job['fileName'] + ".missing"), _state(), "no previous output"),
+             (job, _state(sqlHash=ogrIncremental.sqlHash(SQL + " where FIRE_SIZE_HECTARES > 10")), "sqlQuery changed"),
+             (job, _state(keyColumn='OBJECTID'), "keyColumn changed"),
+             (job, _state(watermarkColumn='UPDATE_DATE'), "keyColumn changed"),
+             (job, _state(watermark=None), "no high-water mark"),
+             (job, _state(lastFullRefresh='2023-06-01 09:00:00'), "7 day(s) since the last full refresh")]
+    for caseJob, state, reason in cases:
+        mode, message = ogrIncremental.planRun(caseJob, state, NOW)
+        assert mode == 'full' and reason in message, (reason, message)
+
+    assert ogrIncremental.planRun(job, _state(lastFullRefresh='2023-06-01 09:00:01'), NOW)[0] == 'incremental' # 6 days and 23:59:59
+    assert ogrIncremental.planRun(dict(job, incremental=dict(job['incremental'], fullRefreshDays=None)), _state(lastFullRefresh='2020-01-01 00:00:00'), NOW)[0] == 'incremental'
+    monkeypatch.setattr(ogrIncremental, 'gdal', None)
+    assert ogrIncremental.planRun(job, _state(), NOW) == ('full', "osgeo is not available for the upsert")
+
+def test_delta_sql_literals():
+    ''' Oracle gets TO_DATE, GeoPackage / SpatiaLite sources get ISO 8601 text; '>=' keeps same-second records '''
+    assert ogrIncremental.watermarkLiteral('2023-06-07 14:30:00', 'OCI:user/pass@IDWPROD1:no_Table') == "TO_DATE('2023-06-07 14:30:00', 'YYYY-MM-DD HH24:MI:SS')"
+    assert ogrIncremental.watermarkLiteral('2023-06-07 14:30:00', r'C:\data\fires.gpkg') == "'2023-06-07T14:30:00'"
+    assert ogrIncremental.deltaSQL(SQL + ";\n", 'LOAD_DATE', '2023-06-07 14:30:00', 'oci:user/pass@IDWPROD1:no_Table') == (
+        "select * from (\n{}\n) delta_src\nwhere delta_src.LOAD_DATE >= TO_DATE('2023-06-07 14:30:00', 'YYYY-MM-DD HH24:MI:SS')".format(SQL))
+
+def test_normalize_watermark():
+    ''' The date strings GDAL reads back all become 'YYYY-MM-DD HH:MM:SS' '''
+    assert ogrIncremental.normalizeWatermark('2023-05-01T12:00:00Z') == '2023-05-01 12:00:00'
+    assert ogrIncremental.normalizeWatermark('2023/05/01 12:00:00+00') == '2023-05-01 12:00:00'
+    assert ogrIncremental.normalizeWatermark('2023-05-01T12:00') == '2023-05-01 12:00:00'
+    assert ogrIncremental.normalizeWatermark('2023-05-01') == '2023-05-01 00:00:00'
+    assert [ogrIncremental.normalizeWatermark(v) for v in (None, '', '01-MAY-23')] == [None, None, None]
+
+def test_delta_job_swaps_paths(tmp_path):
+    ''' The delta job writes delta.gpkg from delta_query.sql with the row's other options, and is never chunked or finished '''
+    job = dict(_makeJob(tmp_path), chunk={'tiles':'2x2'}, gpkgFastWrite=True)
+    with open(os.path.join(str(tmp_path), "delta.gpkg"), 'w') as thing:
+        thing.write("last run's delta")
+    deltaJob = ogrIncremental.makeDeltaJob(job, '2023-06-07 14:30:00')
+    deltaPath, deltaSqlFile = os.path.join(str(tmp_path), "delta.gpkg"), os.path.join(str(tmp_path), "delta_query.sql")
+    assert deltaJob['ogrList'] == ['ogr2ogr', '-f', 'GPKG', deltaPath, job['ds'], '-sql', '@' + deltaSqlFile, '-nln', 'fires', '-overwrite']
+    assert (deltaJob['fileName'], deltaJob['sqlFile'], deltaJob['chunk'], deltaJob['gpkgFastWrite']) == (deltaPath, deltaSqlFile, None, False)
+    assert job['ogrList'][3] == job['fileName'] # the row's own job is left alone
+    assert not os.path.exists(deltaPath)
+    with open(deltaSqlFile) as thing:
+        assert thing.read() == ogrIncremental.deltaSQL(SQL, 'LOAD_DATE', '2023-06-07 14:30:00', job['ds'])
+
+def test_state_file_round_trip(tmp_path):
+    ''' The state file is written in one step next to the output; a missing or broken one reads as no state '''
+    fileName = os.path.join(str(tmp_path), "fires.gpkg")
+    assert ogrIncremental.readState(fileName) is None
+    ogrIncremental.writeState(fileName, _state())
+    assert ogrIncremental.readState(fileName) == _state()
+    assert os.listdir(str(tmp_path)) == ["fires.gpkg.ogrstate.json"]
+    with open(ogrIncremental.statePath(fileName), 'w') as thing:
+        thing.write('{"watermark": ')
+    assert ogrIncremental.readState(fileName) is None
@@ -0,0 +1,120 @@
+'''
+test_ogrPlanner.py
+description: checks ogrPlanner's estimates, ordering and automatic chunking against a SQLite stand-in for BCGW.
+SQLite has no EXPLAIN PLAN / PLAN_TABLE, so this also checks the fall back to COUNT(*).
+
+run with:  python -m pytest test_ogrPlanner.py
+'''
+
+import os
+import sqlite3
+import struct
+
+import ogrPlanner
+import ogrScheduler
+import ogrSharedScan
+
+TABLES = {'WHSE_FOREST_VEGETATION.VEG_COMP_LYR_R1_POLY': 5000, 'WHSE_LAND_AND_NATURAL_RESOURCE.PROT_HISTORICAL_FIRE_POLYS_SP': 800,
+          'WHSE_BASEMAPPING.NTS_250K_GRID': 20}
+
+###############################################################################################################
+def _square(x, y, size, nVertices):
+    # WKB polygon with 'nVertices' points, so geometry size differs between the tables like real layers do
+    points = [(x + size * (i % 2), y + size * ((i // 2) % 2)) for i in range(nVertices - 1)] + [(x, y)]
+    return struct.pack('<BII', 1, 3, 1) + struct.pack('<I', len(points)) + b"".join(struct.pack('<dd', px, py) for px, py in points)
+
+def _standInDatabase():
+    # SQLite stand-in for BCGW: schema names are ATTACHed databases, geometry is a WKB blob in a SHAPE column
+    conn = sqlite3.connect(":memory:")
+    for schema in set(t.split(".")[0] for t in TABLES):
+        conn.execute("ATTACH DATABASE ':memory:' AS {}".format(schema))
+    for t, (table, nRows) in enumerate(TABLES.items()):
+        conn.execute("CREATE TABLE {} (FEATURE_ID INTEGER, LABEL TEXT, AREA_HA REAL, SHAPE BLOB)".format(table))
+        conn.executemany("INSERT INTO {} VALUES (?, ?, ?, ?)".format(table),
+                         [(i, "feature {}".format(i), i * 1.5, _square(i, i, 10, 5 + 20 * t)) for i in range(nRows)])
+    return conn
+
+def _makeJob(tmpDir, n, sqlString, **extra):
+    sqlFile = os.path.join(str(tmpDir), "query_{}.sql".format(n))
+    with open(sqlFile, 'w') as thing:
+        thing.write(sqlString)
+    job = {'n':n, 'paramName':'row{}'.format(n), 'database':'IDWPROD1', 'ds':'standIn', 'outType':'GPKG', 'sqlFile':sqlFile, 'fanOut':[], 'chunk':None}
+    job.update(extra)
+    return job
+
+###############################################################################################################
+def test_strip_order_by():
+    ''' Only a top-level ORDER BY is removed before counting '''
+    assert ogrPlanner.stripOrderBy("select a from t where b = 1 order by a;") == "select a from t where b = 1"
+    sqlString = "select a, (select max(x) from u order by x) m from t"
+    assert ogrPlanner.stripOrderBy(sqlString) == sqlString
+
+def test_row_bytes_from_types_and_sample():
+    ''' Fixed-size types come from typeBytes, declared String widths are used as is, other columns are measured '''
+    columns = [('FEATURE_ID', 'Integer64', 0), ('AREA_HA', 'Real', 0), ('CODE', 'String', 10), ('LABEL', 'String', 0), ('SHAPE', 'Geometry', 0)]
+    sampleRows = [(1, 2.0, 'A', 'abcd', b'x' * 100), (2, 3.0, 'B', 'ab', b'x' * 300)]
+    assert ogrPlanner.estimateRowBytes(columns, sampleRows) == 8 + 8 + 10 + 3 + 200
+
+def test_counts_and_longest_first(tmp_path):
+    ''' EXPLAIN PLAN isn't available in SQLite, so rows are counted exactly; the biggest row is planned first '''
+    conn = _standInDatabase()
+    fetch = ogrPlanner.dbapiFetcher(conn)
+    jobs = [_makeJob(tmp_path, n, "select FEATURE_ID, LABEL, SHAPE from {} order by FEATURE_ID".format(table)) for n, table in enumerate(TABLES)]
+    ordered = ogrPlanner.planJobs(list(reversed(jobs)), fetchFor=lambda job: fetch, chunkBigRows=False)
+    assert [job['n'] for job in ordered] == [0, 1, 2]
+
+    estimates = [ogrPlanner.planJob(job, fetch) for job in jobs]
+    assert [e['rows'] for e in estimates] == list(TABLES.values())
+    assert all(e['method'] == 'count' for e in estimates)
+    # a polygon with 5 vertices is 9 + 4 + 5 x 16 bytes of WKB
+    assert estimates[0]['rowBytes'] > 8 + 93
+
+def test_rows_that_cant_be_costed_run_last(tmp_path):
+    ''' A row whose query fails is reported in the plan, not dropped '''
+    fetch = ogrPlanner.dbapiFetcher(_standInDatabase())
+    jobs = [_makeJob(tmp_path, 0, "select * from NO_SUCH_TABLE"), _makeJob(tmp_path, 1, "select FEATURE_ID, SHAPE from WHSE_BASEMAPPING.NTS_250K_GRID")]
+    ordered = ogrPlanner.planJobs(jobs, fetchFor=lambda job: fetch)
+    assert [job['n'] for job in ordered] == [1, 0]
+
+def test_big_rows_are_chunked(tmp_path, monkeypatch):
+    ''' Rows over autoChunkMB with a keyColumn and a single GPKG output are switched to chunked extraction '''
+    monkeypatch.setattr(ogrPlanner, 'autoChunkMB', 0.1)
+    monkeypatch.setattr(ogrPlanner, 'tileMB', 0.05)
+    fetch = ogrPlanner.dbapiFetcher(_standInDatabase())
+    sqlString = "select v.FEATURE_ID, v.LABEL, v.SHAPE from WHSE_FOREST_VEGETATION.VEG_COMP_LYR_R1_POLY v"
+    keyed = _makeJob(tmp_path, 0, sqlString, keyColumn='FEATURE_ID')
+    noKey = _makeJob(tmp_path, 1, sqlString)
+    kml = _makeJob(tmp_path, 2, sqlString, keyColumn='FEATURE_ID', outType='KML')
+    small = _makeJob(tmp_path, 3, "select FEATURE_ID, SHAPE from WHSE_BASEMAPPING.NTS_250K_GRID", keyColumn='FEATURE_ID')
+    ogrPlanner.planJobs([keyed, noKey, kml, small], fetchFor=lambda job: fetch)
+
+    assert keyed['chunk']['keyColumn'] == 'FEATURE_ID' and keyed['chunk']['cols'] == keyed['chunk']['rows'] >= 2
+    assert noKey['chunk'] is None and kml['chunk'] is None and small['chunk'] is None
+
+def test_plan_order_survives_shared_scans(tmp_path):
+    ''' With shareScans on, the rows (and the shared fetch standing in for its group) still start longest first '''
+    fetch = ogrPlanner.dbapiFetcher(_standInDatabase())
+    jobs = []
+    for n, table in enumerate(list(TABLES) + ['WHSE_BASEMAPPING.NTS_250K_GRID']): # rows 2 and 3 read the same table, so they share a fetch
+        stagingDir = os.path.join(str(tmp_path), "job{}".format(n))
+        os.makedirs(stagingDir)
+        job = _makeJob(tmp_path, n, "select FEATURE_ID, {}, SHAPE from {}".format('LABEL' if n < 3 else 'AREA_HA', table), stagingDir=stagingDir)
+        job.update(paramName='row{}'.format(n), fileName=os.path.join(stagingDir, "out.gpkg"),
+                   ogrList=['ogr2ogr', '-a_srs', 'EPSG:3005', '-f', 'GPKG', os.path.join(stagingDir, "out.gpkg"), 'standIn', '-sql', '@' + job['sqlFile']])
+        jobs.append(job)
+    ordered = ogrPlanner.planJobs([jobs[2], jobs[3], jobs[1], jobs[0]], fetchFor=lambda job: fetch, chunkBigRows=False)
+    assert [job['n'] for job in ordered] == [0, 1, 2, 3]
+
+    plan = ogrSharedScan.planSharedScans([jobs[1], jobs[2], jobs[0], jobs[3]], str(tmp_path / "staging"))
+    assert [job['n'] for job in plan['firstJobs']] == [1, -1, 0] and [job['n'] for job in plan['directJobs']] == [1, 0]
+
+    started = []
+    def runner(job):
+        started.append(job['n'])
+        result = ogrScheduler.newJobResult(job)
+        result['status'] = 'OK'
+        return result
+    plan = ogrSharedScan.planSharedScans(ordered, str(tmp_path / "staging"))
+    results = ogrSharedScan.runPlannedJobs(plan, 1, 1, runner)
+    assert started[:3] == [0, 1, -1] and sorted(started[3:]) == [2, 3]
+    assert [r['n'] for r in results] == [0, 1, 2, 3]
@@ -0,0 +1,113 @@
+'''
+test_ogrScheduler.py
+description: checks ogrScheduler's dependsOn ordering, failure skipping, run id state and connection cap with a stand-in runner (no ogr2ogr needed).
+
+run with:  python -m pytest test_ogrScheduler.py
+'''
+
+import os
+import threading
+import time
+
+import pytest
+
+import ogrChunked
+import ogrScheduler
+
+###############################################################################################################
+def _makeJob(tmpDir, n, paramName, dependsOn=""):
+    sqlFile = os.path.join(str(tmpDir), "query_{}.sql".format(n))
+    with open(sqlFile, 'w') as thing:
+        thing.write("select * from {}".format(paramName))
+    fileName = os.path.join(str(tmpDir), "{}.gpkg".format(paramName))
+    return {'n':n, 'paramName':paramName, 'database':'IDWPROD1', 'ds':'OCI:user/pass@IDWPROD1:no_Table', 'fileName':fileName, 'sqlFile':sqlFile,
+            'ogrList':['ogr2ogr', '-f', 'GPKG', fileName, 'OCI:user/pass@IDWPROD1:no_Table', '-sql', '@' + sqlFile], 'fanOut':[],
+            'dependsOn':ogrScheduler.parseDependsOn(dependsOn)}
+
+def _standInRunner(log, failing=()):
+    # writes the job's output and logs when it started / finished, unless its paramName is in 'failing'
+    lock = threading.Lock()
+    def runJob(job):
+        result = ogrScheduler.newJobResult(job)
+        with lock:
+            log.append(('start', job['paramName']))
+        time.sleep(0.05)
+        if job['paramName'] not in failing:
+            with open(job['fileName'], 'w') as thing:
+                thing.write(job['paramName'])
+            result['status'] = 'OK'
+        with lock:
+            log.append(('end', job['paramName']))
+        return result
+    return runJob
+
+###############################################################################################################
+def test_dependency_order_and_errors(tmp_path):
+    ''' Jobs come after the jobs they depend on; unknown paramNames and loops are reported '''
+    jobs = [_makeJob(tmp_path, 0, 'clipParams', 'aoiParams'), _makeJob(tmp_path, 1, 'aoiParams'), _makeJob(tmp_path, 2, 'roadsParams')]
+    assert [j['paramName'] for j in ogrScheduler.dependencyOrder(jobs)] == ['aoiParams', 'clipParams', 'roadsParams']
+    with pytest.raises(ValueError, match="isn't a paramName"):
+        ogrScheduler.dependencyOrder([_makeJob(tmp_path, 0, 'clipParams', 'noSuchParams')])
+    with pytest.raises(ValueError, match="circular"):
+        ogrScheduler.dependencyOrder([_makeJob(tmp_path, 0, 'a', 'b'), _makeJob(tmp_path, 1, 'b', 'a')])
+
+def test_downstream_waits_and_branches_run_together(tmp_path):
+    ''' A row starts only after the rows it depends on; an independent row runs alongside them '''
+    log = []
+    jobs = [_makeJob(tmp_path, 0, 'clipParams', 'aoiParams'), _makeJob(tmp_path, 1, 'aoiParams'), _makeJob(tmp_path, 2, 'roadsParams')]
+    results = ogrScheduler.runJobs(jobs, 4, 4, _standInRunner(log))
+    assert [r['status'] for r in results] == ['OK', 'OK', 'OK']
+    assert log.index(('end', 'aoiParams')) < log.index(('start', 'clipParams'))
+    assert log.index(('start', 'roadsParams')) < log.index(('end', 'aoiParams'))
+
+def test_failure_skips_only_downstream(tmp_path):
+    ''' A failed row skips the rows downstream of it (and theirs), nothing else '''
+    jobs = [_makeJob(tmp_path, 0, 'aoiParams'), _makeJob(tmp_path, 1, 'clipParams', 'aoiParams'), _makeJob(tmp_path, 2, 'summaryParams', 'clipParams'),
+            _makeJob(tmp_path, 3, 'roadsParams')]
+    results = ogrScheduler.runJobs(jobs, 2, 2, _standInRunner([], failing=('aoiParams',)))
+    assert [r['status'] for r in results] == ['FAILED', 'SKIPPED', 'SKIPPED', 'OK']
+
+def test_run_id_skips_up_to_date_rows(tmp_path):
+    ''' With the same run id, unchanged rows are skipped; a changed upstream output re-runs the rows downstream of it '''
+    statePath = ogrScheduler.runStatePath(str(tmp_path), "weekly")
+    jobs = [_makeJob(tmp_path, 0, 'aoiParams'), _makeJob(tmp_path, 1, 'clipParams', 'aoiParams'), _makeJob(tmp_path, 2, 'roadsParams')]
+    runState = ogrScheduler.readRunState(statePath)
+    ogrScheduler.recordRun(runState, statePath, jobs, ogrScheduler.runJobs(jobs, 2, 2, _standInRunner([])))
+
+    toRun, skipped = ogrScheduler.skipUpToDate(jobs, ogrScheduler.readRunState(statePath))
+    assert toRun == [] and len(skipped) == 3
+
+    with open(jobs[0]['fileName'], 'w') as thing: # the AOI is rebuilt by hand
+        thing.write("a different AOI")
+    toRun, skipped = ogrScheduler.skipUpToDate(jobs, ogrScheduler.readRunState(statePath))
+    assert [j['paramName'] for j in toRun] == ['aoiParams', 'clipParams']
+
+def _makeChunkedJob(tmpDir, n, paramName, chunkTiles="2x2"):
+    job = _makeJob(tmpDir, n, paramName)
+    job['ogrList'] += ['-nln', paramName]
+    job['stagingDir'] = os.path.join(str(tmpDir), "staging_{}".format(n))
+    os.makedirs(job['stagingDir'])
+    job.update(outType='GPKG', outName=paramName, chunk=ogrChunked.chunkSettings(paramName, chunkTiles, 'FEATURE_ID', 'SHAPE', '0,0,100,100'))
+    return job
+
+def test_chunked_rows_share_the_connection_cap(tmp_path, monkeypatch):
+    ''' Tiles of chunked rows and plain rows together never have more than dbConnectionCap logged in to the database '''
+    lock, open_, peak = threading.Lock(), [0], [0]
+    def countingRunner(job): # stands in for one ogr2ogr login
+        with lock:
+            open_[0] += 1
+            peak[0] = max(peak[0], open_[0])
+        time.sleep(0.02)
+        with open(job['fileName'], 'w') as thing:
+            thing.write(job['paramName'])
+        with lock:
+            open_[0] -= 1
+        result = ogrScheduler.newJobResult(job)
+        result['status'] = 'OK'
+        return result
+    monkeypatch.setattr(ogrChunked, 'mergeTiles', lambda job, tilePaths, layerName, keyColumn: (len(tilePaths), 0))
+
+    jobs = [_makeChunkedJob(tmp_path, 0, 'vriParams'), _makeChunkedJob(tmp_path, 1, 'resultsParams'), _makeJob(tmp_path, 2, 'roadsParams')]
+    results = ogrScheduler.runJobs(jobs, 4, 2, ogrChunked.getChunkedRunner(countingRunner, 4, 2))
+    assert [r['status'] for r in results] == ['OK', 'OK', 'OK']
+    assert peak[0] == 2
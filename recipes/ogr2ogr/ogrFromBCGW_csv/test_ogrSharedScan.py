@@ -0,0 +1,144 @@
+'''
+test_ogrSharedScan.py
+description: checks ogrSharedScan's grouping, the union of columns and the split of one fetch into each row's output,
+with a stand-in runner that runs the SQL against a SQLite stand-in for BCGW (no ogr2ogr needed).
+
+run with:  python -m pytest test_ogrSharedScan.py
+'''
+
+import os
+import sqlite3
+
+import ogrScheduler
+import ogrSharedScan
+
+TABLE = 'WHSE_LAND_AND_NATURAL_RESOURCE.PROT_HISTORICAL_FIRE_POLYS_SP'
+
+###############################################################################################################
+def _standInDatabase():
+    # SQLite stand-in for BCGW: the schema is an ATTACHed database, geometry is a blob in a SHAPE column
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("ATTACH DATABASE ':memory:' AS WHSE_LAND_AND_NATURAL_RESOURCE")
+    conn.execute("CREATE TABLE {} (FIRE_NUMBER TEXT, FIRE_YEAR INTEGER, FIRE_CAUSE TEXT, SIZE_HA REAL, SHAPE BLOB)".format(TABLE))
+    conn.executemany("INSERT INTO {} VALUES (?, ?, ?, ?, ?)".format(TABLE),
+                     [("K{:04d}".format(i), 2000 + i % 20, ['Lightning', 'Person'][i % 2], i * 2.5, b'shape%d' % i) for i in range(200)])
+    return conn
+
+def _makeJob(tmpDir, n, sqlString, ds='standIn', database='IDWPROD1', srs='EPSG:3005', **extra):
+    stagingDir = os.path.join(str(tmpDir), "job{}".format(n))
+    os.makedirs(stagingDir)
+    sqlFile = os.path.join(stagingDir, "query.sql")
+    with open(sqlFile, 'w') as thing:
+        thing.write(sqlString)
+    fileName = os.path.join(stagingDir, "out{}.gpkg".format(n))
+    job = {'n':n, 'paramName':'row{}'.format(n), 'database':database, 'ds':ds, 'outType':'GPKG', 'sqlFile':sqlFile, 'stagingDir':stagingDir,
+           'fileName':fileName, 'fanOut':[], 'chunk':None, 'ogrList':['ogr2ogr', '-a_srs', srs, '-f', 'GPKG', fileName, ds, '-sql', '@' + sqlFile]}
+    job.update(extra)
+    return job
+
+def _standInRunner(conn, log):
+    # runs the job's SQL against the stand-in (or the scratch copy a fetch made) and writes the rows to its output in the same table layout
+    def runJob(job):
+        result = ogrScheduler.newJobResult(job)
+        sqlFile = [arg for arg in job['ogrList'] if arg.startswith('@')][0][1:]
+        with open(sqlFile, 'r') as thing:
+            sqlString = thing.read()
+        source = conn if job['ds'] == 'standIn' else sqlite3.connect(job['ds'])
+        cursor = source.execute(sqlString)
+        names, rows = [d[0] for d in cursor.description], cursor.fetchall()
+        log.append((job['n'], job['ds'], len(rows)))
+        layer = ogrSharedScan.scratchLayer if job['n'] < 0 else "out"
+        out = sqlite3.connect(job['fileName'])
+        out.execute('CREATE TABLE "{}" (fid INTEGER PRIMARY KEY, {})'.format(layer, ", ".join('"{}"'.format(c) for c in names)))
+        out.executemany('INSERT INTO "{}" ({}) VALUES ({})'.format(layer, ", ".join('"{}"'.format(c) for c in names), ", ".join("?" * len(names))), rows)
+        out.commit()
+        out.close()
+        result['status'], result['returncode'] = 'OK', 0
+        return result
+    return runJob
+
+def _outputRows(fileName):
+    conn = sqlite3.connect(fileName)
+    try:
+        cursor = conn.execute('SELECT * FROM "out"')
+        return [d[0].upper() for d in cursor.description][1:], [row[1:] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+###############################################################################################################
+def test_parse_simple_select():
+    ''' Simple queries are split into items / table / alias / where / order by; joins, select * and unaliased expressions aren't '''
+    parsed = ogrSharedScan.parseSimpleSelect("select f.FIRE_NUMBER, NVL(f.SIZE_HA, 0) size_ha, f.SHAPE from {} f where f.FIRE_YEAR > 2010 order by f.FIRE_NUMBER".format(TABLE))
+    assert parsed['items'] == [('FIRE_NUMBER', 'f.FIRE_NUMBER'), ('SIZE_HA', 'NVL(f.SIZE_HA, 0) size_ha'), ('SHAPE', 'f.SHAPE')]
+    assert (parsed['table'], parsed['alias'], parsed['where']) == (TABLE, 'F', 'f.FIRE_YEAR > 2010')
+    assert ogrSharedScan.parseSimpleSelect("select * from {}".format(TABLE)) is None
+    assert ogrSharedScan.parseSimpleSelect("select FIRE_YEAR + 1 from {}".format(TABLE)) is None
+    assert ogrSharedScan.parseSimpleSelect("select a.X from A a join B b on a.ID = b.ID") is None
+
+def test_only_same_source_and_where_are_grouped(tmp_path):
+    ''' Rows share a fetch only with the same database, source, CRS, table and WHERE clause (case and spacing don't matter) '''
+    where = "where FIRE_YEAR >= 2010"
+    jobs = [_makeJob(tmp_path, 0, "select FIRE_NUMBER, SHAPE from {} {}".format(TABLE, where)),
+            _makeJob(tmp_path, 1, "select FIRE_CAUSE, SHAPE from {} WHERE  fire_year >= 2010".format(TABLE)),
+            _makeJob(tmp_path, 2, "select FIRE_NUMBER, SHAPE from {} where FIRE_YEAR >= 2015".format(TABLE)),
+            _makeJob(tmp_path, 3, "select FIRE_NUMBER, SHAPE from {} {}".format(TABLE, where), ds='otherDatabase', database='IDWTEST1'),
+            _makeJob(tmp_path, 4, "select FIRE_NUMBER, SHAPE from {} {}".format(TABLE, where), srs='EPSG:4326'),
+            _makeJob(tmp_path, 5, "select FIRE_NUMBER, SHAPE from {} {}".format(TABLE, where), incremental={'watermarkColumn':'FIRE_YEAR'})]
+    plan = ogrSharedScan.planSharedScans(jobs, str(tmp_path / "staging"))
+    assert [group['members'] for group in plan['groups']] == [[(0, 'row0', ['FIRE_NUMBER', 'SHAPE']), (1, 'row1', ['FIRE_CAUSE', 'SHAPE'])]]
+    assert [job['n'] for job in plan['directJobs']] == [2, 3, 4, 5]
+    assert [job['n'] for job in plan['derivedJobs']] == [0, 1] and all(job['database'] == 'scratch' for job in plan['derivedJobs'])
+
+def test_conflicting_names_and_missing_geometry_run_on_their_own(tmp_path):
+    ''' A row reusing a column name for a different expression isn't shared; neither is a group without a geometry column '''
+    jobs = [_makeJob(tmp_path, 0, "select FIRE_NUMBER, SHAPE from {}".format(TABLE)),
+            _makeJob(tmp_path, 1, "select FIRE_CAUSE, SHAPE from {}".format(TABLE)),
+            _makeJob(tmp_path, 2, "select FIRE_CAUSE FIRE_NUMBER, SHAPE from {}".format(TABLE)),
+            _makeJob(tmp_path, 3, "select FIRE_NUMBER from {} where SIZE_HA > 1".format(TABLE)),
+            _makeJob(tmp_path, 4, "select FIRE_CAUSE from {} where SIZE_HA > 1".format(TABLE))]
+    plan = ogrSharedScan.planSharedScans(jobs, str(tmp_path / "staging"))
+    assert [[m[0] for m in group['members']] for group in plan['groups']] == [[0, 1]]
+    assert [job['n'] for job in plan['directJobs']] == [2, 3, 4]
+
+def test_order_is_kept(tmp_path):
+    ''' Unshared rows and fetches keep the incoming order (ex. longest first from --plan), not file order '''
+    jobs = [_makeJob(tmp_path, 2, "select FIRE_NUMBER, SHAPE from {} where FIRE_YEAR = 2002".format(TABLE)),
+            _makeJob(tmp_path, 0, "select FIRE_NUMBER, SHAPE from {} where FIRE_YEAR = 2000".format(TABLE)),
+            _makeJob(tmp_path, 3, "select FIRE_CAUSE, SHAPE from {} where FIRE_YEAR = 2003".format(TABLE)),
+            _makeJob(tmp_path, 4, "select FIRE_NUMBER, SHAPE from {} where FIRE_YEAR = 2003".format(TABLE)),
+            _makeJob(tmp_path, 1, "select FIRE_NUMBER, SHAPE from {} where FIRE_YEAR = 2001".format(TABLE))]
+    plan = ogrSharedScan.planSharedScans(jobs, str(tmp_path / "staging"))
+    assert [job['n'] for job in plan['firstJobs']] == [2, 0, -1, 1]
+
+def test_one_fetch_split_into_each_rows_output(tmp_path):
+    ''' A group is fetched once with the union of its columns; each row's output matches running its own query, in its own order '''
+    conn = _standInDatabase()
+    queries = ["select f.FIRE_NUMBER, f.SIZE_HA, f.SHAPE from {} f where f.FIRE_CAUSE = 'Lightning' order by f.SIZE_HA desc".format(TABLE),
+               "select f.FIRE_NUMBER, f.FIRE_YEAR, f.SHAPE from {} f where f.FIRE_CAUSE = 'Lightning' order by f.FIRE_YEAR, f.FIRE_NUMBER".format(TABLE),
+               "select FIRE_NUMBER, SHAPE from {} where FIRE_CAUSE = 'Person'".format(TABLE)]
+    jobs = [_makeJob(tmp_path, n, q) for n, q in enumerate(queries)]
+    plan = ogrSharedScan.planSharedScans(jobs, str(tmp_path / "staging"))
+    assert plan['groups'][0]['columns'] == ['FIRE_NUMBER', 'SIZE_HA', 'SHAPE', 'FIRE_YEAR']
+
+    log = []
+    results = ogrSharedScan.runPlannedJobs(plan, 1, 1, _standInRunner(conn, log))
+    assert [r['status'] for r in results] == ['OK', 'OK', 'OK']
+    assert sorted(n for n, ds, rows in log if ds == 'standIn') == [-1, 2] # rows 0 and 1 only read the scratch copy
+    for job, sqlString in zip(jobs, queries):
+        cursor = conn.execute(sqlString)
+        assert _outputRows(job['fileName']) == ([d[0].upper() for d in cursor.description], cursor.fetchall())
+
+def test_failed_fetch_fails_its_rows(tmp_path):
+    ''' If a group's fetch fails, its rows fail with the fetch's error and other rows still run '''
+    jobs = [_makeJob(tmp_path, 0, "select FIRE_NUMBER, SHAPE from {}".format(TABLE)), _makeJob(tmp_path, 1, "select FIRE_CAUSE, SHAPE from {}".format(TABLE)),
+            _makeJob(tmp_path, 2, "select FIRE_NUMBER, SHAPE from {} where FIRE_YEAR = 2001".format(TABLE))]
+    plan = ogrSharedScan.planSharedScans(jobs, str(tmp_path / "staging"))
+    def runner(job):
+        result = ogrScheduler.newJobResult(job)
+        if job['n'] < 0:
+            result['stderr'] = "ORA-12170: TNS:Connect timeout occurred"
+        else:
+            result['status'] = 'OK'
+        return result
+    results = ogrSharedScan.runPlannedJobs(plan, 2, 2, runner)
+    assert [r['status'] for r in results] == ['FAILED', 'FAILED', 'OK'] and "ORA-12170" in results[0]['stderr']
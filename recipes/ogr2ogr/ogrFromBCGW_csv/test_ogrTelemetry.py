@@ -0,0 +1,87 @@
+'''
+test_ogrTelemetry.py
+description: checks ogrTelemetry's JSON Lines records with a stand-in runner (no ogr2ogr needed):
+one record per row with the documented fields, records read back per run id, and rows whose runner raised.
+
+run with:  python -m pytest test_ogrTelemetry.py
+'''
+
+import os
+import time
+
+import pytest
+
+import ogrScheduler
+import ogrTelemetry
+
+FIELDS = ['ts', 'runId', 'n', 'paramName', 'database', 'engine', 'outType', 'status', 'exitCode', 'totalSeconds', 'querySeconds', 'writeSeconds',
+          'rows', 'bytesOut', 'peakRssMB', 'childPeakRssMB', 'output']
+
+###############################################################################################################
+def _makeJob(tmpDir, n, paramName, outTypes=("GPKG",)):
+    ext = {'GPKG':'.gpkg', 'KML':'.kml'}
+    fileName = os.path.join(str(tmpDir), paramName + ext[outTypes[0]])
+    fanOut = [{'outType':t, 'fileName':os.path.join(str(tmpDir), paramName + ext[t])} for t in outTypes] if len(outTypes) > 1 else []
+    return {'n':n, 'paramName':paramName, 'database':'IDWPROD1', 'ds':'OCI:user/pass@IDWPROD1:no_Table', 'outType':outTypes[0], 'fileName':fileName,
+            'ogrList':['ogr2ogr', '-f', outTypes[0], fileName, 'OCI:user/pass@IDWPROD1:no_Table', '-nln', paramName], 'fanOut':fanOut}
+
+def _standInRunner(failing=(), raising=()):
+    # writes 100 bytes to each of the job's outputs, unless its paramName is in 'failing'; raises for paramNames in 'raising'.
+    # Rows with several outTypes report their query time and feature count, like the fan-out runner
+    def runJob(job):
+        if job['paramName'] in raising:
+            raise RuntimeError("stand-in runner bug")
+        result = ogrScheduler.newJobResult(job)
+        time.sleep(0.02)
+        if job['paramName'] in failing:
+            result['returncode'] = 1
+            return result
+        for fileName in ogrScheduler.jobOutputs(job):
+            with open(fileName, 'w') as thing:
+                thing.write("x" * 100)
+        result['returncode'], result['status'] = 0, 'OK'
+        if job['fanOut']:
+            result['querySeconds'], result['stdout'] = 0.01, "42 feature(s) read once, written to {} format(s)".format(len(job['fanOut']))
+        return result
+    return runJob
+
+###############################################################################################################
+def test_one_record_per_row(tmp_path):
+    ''' Each row run appends one record with the documented fields; querySeconds is only known for fanned-out rows '''
+    logPath = os.path.join(str(tmp_path), "logs", "ogrTelemetry.jsonl")
+    jobs = [_makeJob(tmp_path, 0, 'fires'), _makeJob(tmp_path, 1, 'blocks', ("GPKG", "KML")), _makeJob(tmp_path, 2, 'roads')]
+    runner = ogrTelemetry.getTelemetryRunner(_standInRunner(failing=['roads']), logPath, "weekly", "subprocess")
+    results = ogrScheduler.runJobs(jobs, maxWorkers=3, dbConnectionCap=2, runner=runner)
+    assert [r['status'] for r in results] == ['OK', 'OK', 'FAILED']
+
+    records = sorted(ogrTelemetry.readRecords(logPath), key=lambda r: r['n'])
+    assert [sorted(r) for r in records] == [sorted(FIELDS)] * 3
+    fires, blocks, roads = records
+    assert (fires['runId'], fires['engine'], fires['status'], fires['exitCode'], fires['bytesOut']) == ("weekly", "subprocess", 'OK', 0, 100)
+    assert fires['querySeconds'] is None and fires['writeSeconds'] is None and fires['totalSeconds'] >= 0.02
+    assert (blocks['rows'], blocks['bytesOut'], blocks['querySeconds']) == (42, 200, 0.01)
+    assert blocks['writeSeconds'] == pytest.approx(blocks['totalSeconds'] - 0.01, abs=0.002)
+    assert (roads['status'], roads['exitCode'], roads['bytesOut'], roads['rows']) == ('FAILED', 1, 0, None)
+
+def test_records_filtered_by_run(tmp_path):
+    ''' readRecords(logPath, runId) only gives that run's records; no log file means no records '''
+    logPath = os.path.join(str(tmp_path), "ogrTelemetry.jsonl")
+    assert ogrTelemetry.readRecords(logPath) == []
+    job = _makeJob(tmp_path, 0, 'fires')
+    for runId in ["monday", "tuesday", "monday"]:
+        ogrTelemetry.getTelemetryRunner(_standInRunner(), logPath, runId)(job)
+    assert [r['runId'] for r in ogrTelemetry.readRecords(logPath, "monday")] == ["monday", "monday"]
+    assert len(ogrTelemetry.readRecords(logPath)) == 3
+    runJob = _standInRunner()
+    assert ogrTelemetry.getTelemetryRunner(runJob, "", "monday") is runJob # no log file set - the runner isn't wrapped
+
+def test_runner_exception_is_recorded(tmp_path):
+    ''' A runner that raises still gets a FAILED record, and the scheduler still reports the row as failed '''
+    logPath = os.path.join(str(tmp_path), "ogrTelemetry.jsonl")
+    jobs = [_makeJob(tmp_path, 0, 'fires'), _makeJob(tmp_path, 1, 'blocks')]
+    runner = ogrTelemetry.getTelemetryRunner(_standInRunner(raising=['blocks']), logPath, "weekly", "gdal")
+    results = ogrScheduler.runJobs(jobs, maxWorkers=2, dbConnectionCap=2, runner=runner)
+    assert [r['status'] for r in results] == ['OK', 'FAILED'] and "stand-in runner bug" in results[1]['stderr']
+    records = {r['paramName']: r for r in ogrTelemetry.readRecords(logPath, "weekly")}
+    assert sorted(records) == ['blocks', 'fires']
+    assert (records['blocks']['status'], records['blocks']['exitCode'], records['blocks']['rows']) == ('FAILED', None, None)
@@ -0,0 +1,124 @@
+'''
+test_ogrTuning.py
+description: checks ogrTuning's option rewriting, table keys, tuning file and --autotune's 5% rule
+with a stand-in runner and clock (no ogr2ogr / BCGW needed).
+
+run with:  python -m pytest test_ogrTuning.py
+'''
+
+import os
+import types
+
+import pytest
+
+import ogrScheduler
+import ogrTuning
+
+FIRES = "select FIRE_NUMBER, SHAPE from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_CURRENT_FIRE_POLYS_SP fires where FIRE_STATUS <> 'Out'"
+BLOCKS = """select b.CUT_BLOCK_ID, b.GEOMETRY, f.CLIENT_NUMBER from WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW b
+join WHSE_FOREST_TENURE.FTEN_HARVEST_AUTH_POLY_SVW f on f.FOREST_FILE_ID = b.CUT_BLOCK_FOREST_FILE_ID"""
+FAST_WRITE = ['-nln', 'fires', '-gt', 'unlimited', '-lco', 'SPATIAL_INDEX=NO', '--config', 'OGR_SQLITE_SYNCHRONOUS', 'OFF',
+              '--config', 'OGR_SQLITE_CACHE', '512']
+
+###############################################################################################################
+def _makeJob(tmpDir, n, sqlString, database='IDWPROD1'):
+    stagingDir = os.path.join(str(tmpDir), "job{}".format(n))
+    os.makedirs(stagingDir)
+    sqlFile = os.path.join(stagingDir, "query.sql")
+    with open(sqlFile, 'w') as thing:
+        thing.write(sqlString)
+    fileName = os.path.join(str(tmpDir), "out{}.gpkg".format(n))
+    ds = 'OCI:user/pass@{}:no_Table'.format(database)
+    return {'n':n, 'paramName':'params{}'.format(n), 'database':database, 'ds':ds, 'outType':'GPKG', 'fileName':fileName, 'sqlFile':sqlFile,
+            'stagingDir':stagingDir, 'fanOut':[], 'ogrList':['ogr2ogr', '-f', 'GPKG', fileName, ds, '-sql', '@' + sqlFile, '-overwrite'] + FAST_WRITE}
+
+def _standInRunner(clock, seconds):
+    # 'runs' a sample by moving the clock on by seconds(table, options) - the table is read from the sample's query
+    def runJob(job):
+        with open(job['sqlFile'], 'r') as thing:
+            table = 'fires' if 'PROT_CURRENT_FIRE_POLYS_SP' in thing.read() else 'blocks'
+        clock.now += seconds(table, job['ogrList'])
+        result = ogrScheduler.newJobResult(job)
+        result['status'] = 'OK'
+        return result
+    return runJob
+
+def _option(ogrList, option, key=None):
+    if key is not None:
+        return [ogrList[i + 2] for i in range(len(ogrList) - 2) if ogrList[i] == option and ogrList[i + 1] == key]
+    return [ogrList[i + 1] for i in range(len(ogrList) - 1) if ogrList[i] == option]
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ogrTuning, 'time', types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+###############################################################################################################
+def test_tune_options_replace_not_duplicate():
+    ''' A setting's --config and -gt values replace the row's own ones with the same name; the rest are kept '''
+    tuned = ogrTuning.tuneOptions(FAST_WRITE, ogrTuning.profiles['low-memory'])
+    assert _option(tuned, '-gt') == ['10000']
+    assert _option(tuned, '--config', 'OGR_SQLITE_CACHE') == ['32']
+    assert _option(tuned, '--config', 'OGR_SQLITE_SYNCHRONOUS') == ['OFF']
+    assert _option(tuned, '--config', 'GDAL_CACHEMAX') == ['64']
+    assert tuned[:4] == ['-nln', 'fires', '-lco', 'SPATIAL_INDEX=NO']
+
+    # without -gt in the setting, the row's own -gt stays; without one in the row, it's added
+    tuned = ogrTuning.tuneOptions(FAST_WRITE, {'config':{'OGR_SQLITE_CACHE':'1024'}})
+    assert _option(tuned, '-gt') == ['unlimited'] and _option(tuned, '--config', 'OGR_SQLITE_CACHE') == ['1024']
+    assert ogrTuning.tuneOptions(['-nln', 'fires'], ogrTuning.profiles['bulk']) == ['-nln', 'fires', '-gt', 'unlimited', '--config', 'GDAL_CACHEMAX', '1024',
+                                                                                    '--config', 'OGR_SQLITE_CACHE', '1024']
+
+def test_tune_job_and_fan_out(tmp_path):
+    ''' tuneJob tunes the row's own options and every fanned-out format's, and leaves the original job alone '''
+    job = _makeJob(tmp_path, 0, FIRES)
+    job['fanOut'] = [{'outType':'KML', 'formatOptions':['-nln', 'fires'], 'ogrList':['ogr2ogr', '-f', 'KML', 'fires.kml', '-nln', 'fires']}]
+    assert ogrTuning.tuneJob(job, {}) is job
+    tuned = ogrTuning.tuneJob(job, ogrTuning.profiles['bulk'])
+    assert _option(tuned['ogrList'], '--config', 'OGR_SQLITE_CACHE') == ['1024']
+    assert _option(tuned['fanOut'][0]['formatOptions'], '-gt') == ['unlimited'] and _option(tuned['fanOut'][0]['ogrList'], '-gt') == ['unlimited']
+    assert _option(job['ogrList'], '--config', 'OGR_SQLITE_CACHE') == ['512'] and job['fanOut'][0]['formatOptions'] == ['-nln', 'fires']
+
+def test_table_key(tmp_path):
+    ''' The key is the database and the query's table(s); anything that isn't a plain select has none '''
+    assert ogrTuning.tableKey(_makeJob(tmp_path, 0, FIRES)) == "IDWPROD1:WHSE_LAND_AND_NATURAL_RESOURCE.PROT_CURRENT_FIRE_POLYS_SP"
+    assert ogrTuning.tableKey(_makeJob(tmp_path, 1, BLOCKS, 'IDWTEST1')) == "IDWTEST1:WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW+WHSE_FOREST_TENURE.FTEN_HARVEST_AUTH_POLY_SVW"
+    assert ogrTuning.tableKey(_makeJob(tmp_path, 2, "select * from (select FIRE_NUMBER from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_CURRENT_FIRE_POLYS_SP)")) is None
+    assert ogrTuning.tableKey(dict(_makeJob(tmp_path, 3, FIRES), sqlFile=os.path.join(str(tmp_path), "missing.sql"))) is None
+
+def test_tuning_file_round_trip(tmp_path):
+    ''' readTunings gives {} until there's a file; writeTunings makes its folder '''
+    tuningPath = os.path.join(str(tmp_path), "settings", "ogrTuning.json")
+    assert ogrTuning.readTunings(tuningPath) == {} and ogrTuning.readTunings(None) == {}
+    tunings = {"IDWPROD1:A.B": {'name':'default', 'settings':{}, 'seconds':1.5}}
+    ogrTuning.writeTunings(tuningPath, tunings)
+    assert ogrTuning.readTunings(tuningPath) == tunings
+
+def test_autotune_needs_a_five_percent_gain(tmp_path, clock, capsys):
+    ''' A setting is only saved if it beats "default" by minGain; one job per table is sampled, and the runner then uses the saved setting '''
+    def seconds(table, ogrList):
+        gt = (_option(ogrList, '-gt') or [None])[-1]
+        cache = (_option(ogrList, '--config', 'GDAL_CACHEMAX') or [None])[-1]
+        if cache is None: # default (the row's own -gt unlimited) and the warm-up
+            return 10.0
+        if table == 'fires':
+            return 9.7 if (cache, gt) == ('512', 'unlimited') else 11.0 # 3% faster - not enough
+        return 8.0 if (cache, gt) == ('512', '100000') else 10.5 # 20% faster
+    jobs = [_makeJob(tmp_path, 0, FIRES), _makeJob(tmp_path, 1, BLOCKS), _makeJob(tmp_path, 2, FIRES.replace("<> 'Out'", "= 'Out'"))]
+    tuningPath = os.path.join(str(tmp_path), "ogrTuning.json")
+
+    tunings = ogrTuning.autotune(jobs, _standInRunner(clock, seconds), tuningPath, rows=100)
+    firesKey, blocksKey = ogrTuning.tableKey(jobs[0]), ogrTuning.tableKey(jobs[1])
+    assert sorted(tunings) == sorted([firesKey, blocksKey])
+    assert (tunings[firesKey]['name'], tunings[firesKey]['settings']) == ('default', {})
+    assert tunings[blocksKey]['name'] == "cache 512 MB, -gt 100000" and tunings[blocksKey]['seconds'] == 8.0
+    assert ogrTuning.readTunings(tuningPath) == tunings
+    assert "Autotune results" in capsys.readouterr().out
+    assert not os.path.exists(os.path.join(jobs[0]['stagingDir'], "autotune")) # the sample is cleaned up
+
+    ran = []
+    runner = ogrTuning.getTuningRunner(lambda job: ran.append(job['ogrList']), "low-memory", tuningPath)
+    for job in jobs:
+        runner(job)
+    assert [_option(ogrList, '-gt') for ogrList in ran] == [['unlimited'], ['100000'], ['unlimited']] # saved settings beat the profile
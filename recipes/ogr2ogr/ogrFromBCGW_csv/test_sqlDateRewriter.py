@@ -0,0 +1,154 @@
+'''
+test_sqlDateRewriter.py
+description: checks sqlDateRewriter against the usage-example queries from readme.md / ogrParams.csv.
+Each rewritten query is also run through SQLite's EXPLAIN QUERY PLAN, as a stand-in for Oracle's EXPLAIN PLAN,
+to check the date column's index is used (SEARCH) rather than a full table scan (SCAN).
+
+run with:  python -m pytest test_sqlDateRewriter.py
+'''
+
+import datetime
+import sqlite3
+
+import sqlDateRewriter
+
+TODAY = datetime.date(2023, 6, 1) # fixes the RR two-digit-year window, so the expected SQL doesn't change over time
+
+# (query as a user would write it in ogrParams.csv, expected rewritten query)
+CORPUS = [
+    ("""select b.CUT_BLOCK_FOREST_FILE_ID, b.CUT_BLOCK_ID, b.BLOCK_STATUS_DATE, b.GEOMETRY
+from WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW b
+where b.BLOCK_STATUS_DATE >= '01-SEP-17'
+and b.GEOGRAPHIC_DISTRICT_CODE IN ('DSE')""",
+     """select b.CUT_BLOCK_FOREST_FILE_ID, b.CUT_BLOCK_ID, b.BLOCK_STATUS_DATE, b.GEOMETRY
+from WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW b
+where b.BLOCK_STATUS_DATE >= TO_DATE('2017-09-01', 'YYYY-MM-DD')
+and b.GEOGRAPHIC_DISTRICT_CODE IN ('DSE')"""),
+
+    ("""select FIRE_NUMBER, SHAPE, FIRE_YEAR, FIRE_DATE
+from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_HISTORICAL_FIRE_POLYS_SP fires
+where FIRE_DATE BETWEEN '01-JUL-18' AND '31-AUG-18' and FIRE_NUMBER like 'N%'""",
+     """select FIRE_NUMBER, SHAPE, FIRE_YEAR, FIRE_DATE
+from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_HISTORICAL_FIRE_POLYS_SP fires
+where (FIRE_DATE >= TO_DATE('2018-07-01', 'YYYY-MM-DD') AND FIRE_DATE < TO_DATE('2018-09-01', 'YYYY-MM-DD')) and FIRE_NUMBER like 'N%'"""),
+
+    # two date terms on one line, one of them written 'backwards'
+    ("""select owner_name, issue_date, good_to_date, geometry
+from WHSE_MINERAL_TENURE.MTA_ACQUIRED_TENURE_SVW ten
+where ten.ISSUE_DATE > '31-DEC-15' and '01-JAN-2025' >= ten.GOOD_TO_DATE""",
+     """select owner_name, issue_date, good_to_date, geometry
+from WHSE_MINERAL_TENURE.MTA_ACQUIRED_TENURE_SVW ten
+where ten.ISSUE_DATE >= TO_DATE('2016-01-01', 'YYYY-MM-DD') and ten.GOOD_TO_DATE < TO_DATE('2025-01-02', 'YYYY-MM-DD')"""),
+
+    ("""select FIRE_NUMBER, LOAD_DATE, SHAPE
+from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_CURRENT_FIRE_POLYS_SP fires
+where fires.LOAD_DATE = '2023-05-01'""",
+     """select FIRE_NUMBER, LOAD_DATE, SHAPE
+from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_CURRENT_FIRE_POLYS_SP fires
+where (fires.LOAD_DATE >= TO_DATE('2023-05-01', 'YYYY-MM-DD') AND fires.LOAD_DATE < TO_DATE('2023-05-02', 'YYYY-MM-DD'))"""),
+]
+
+# Queries that must come back unchanged: an explicit to_date() is already index-friendly, and FIRE_YEAR isn't a date column
+UNCHANGED = [
+    """select CUT_BLOCK_FOREST_FILE_ID, GEOMETRY from WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW
+where GEOGRAPHIC_DISTRICT_CODE IN ('DSE')
+and BLOCK_STATUS_DATE >= to_date('01-JUL-18', 'DD-MON-YY')""",
+    """select FIRE_NUMBER, shape from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_HISTORICAL_FIRE_POLYS_SP fires
+where FIRE_YEAR >= 2015 and FIRE_NUMBER like 'N%'""",
+]
+
+###############################################################################################################
+def _standInDatabase():
+    # SQLite stand-in for BCGW: schema names are ATTACHed databases, each view is a table with an index on its date columns
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("TO_DATE", 2, lambda text, fmt: text) # dates are stored as ISO text, so TO_DATE('2017-09-01', 'YYYY-MM-DD') is the text itself
+    tables = {'WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW': ['CUT_BLOCK_FOREST_FILE_ID', 'CUT_BLOCK_ID', 'BLOCK_STATUS_DATE', 'GEOGRAPHIC_DISTRICT_CODE', 'GEOMETRY'],
+              'WHSE_LAND_AND_NATURAL_RESOURCE.PROT_HISTORICAL_FIRE_POLYS_SP': ['FIRE_NUMBER', 'FIRE_YEAR', 'FIRE_DATE', 'SHAPE'],
+              'WHSE_LAND_AND_NATURAL_RESOURCE.PROT_CURRENT_FIRE_POLYS_SP': ['FIRE_NUMBER', 'LOAD_DATE', 'SHAPE'],
+              'WHSE_MINERAL_TENURE.MTA_ACQUIRED_TENURE_SVW': ['OWNER_NAME', 'ISSUE_DATE', 'GOOD_TO_DATE', 'GEOMETRY']}
+    for schema in set(t.split(".")[0] for t in tables):
+        conn.execute("ATTACH DATABASE ':memory:' AS {}".format(schema))
+    for table, columns in tables.items():
+        conn.execute("CREATE TABLE {} ({})".format(table, ", ".join(columns)))
+        dateColumns = [c for c in columns if 'DATE' in c]
+        for c in dateColumns:
+            conn.execute("CREATE INDEX {0}.IX_{1}_{2} ON {1} ({2})".format(table.split(".")[0], table.split(".")[1], c))
+    return conn
+
+def _planSteps(conn, sqlString, binds=None):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sqlString, binds or {})]
+
+###############################################################################################################
+def test_corpus_rewritten_sql():
+    ''' Date comparisons in the usage-example queries become TO_DATE range predicates '''
+    for original, expected in CORPUS:
+        newSQL, binds, count = sqlDateRewriter.rewriteDatePredicates(original, today=TODAY)
+        assert newSQL == expected
+        assert binds == {}
+        assert count >= 1
+
+def test_unchanged_queries():
+    ''' Queries without a date literal comparison are left exactly as written '''
+    for original in UNCHANGED:
+        newSQL, binds, count = sqlDateRewriter.rewriteDatePredicates(original, today=TODAY)
+        assert (newSQL, count) == (original, 0)
+
+def test_bind_variables():
+    ''' useBinds=True returns :d0, :d1 .. placeholders and their datetime values '''
+    newSQL, binds, count = sqlDateRewriter.rewriteDatePredicates(CORPUS[1][0], useBinds=True, today=TODAY)
+    assert "(FIRE_DATE >= :d0 AND FIRE_DATE < :d1)" in newSQL
+    assert binds == {'d0': datetime.datetime(2018, 7, 1), 'd1': datetime.datetime(2018, 9, 1)}
+    assert count == 1
+
+def test_operators_compare_by_calendar_day():
+    ''' Each operator keeps the calendar-day meaning of the old EXTRACT rewrite '''
+    expected = {'=':  "(D_DATE >= TO_DATE('2017-09-01', 'YYYY-MM-DD') AND D_DATE < TO_DATE('2017-09-02', 'YYYY-MM-DD'))",
+                '<>': "(D_DATE < TO_DATE('2017-09-01', 'YYYY-MM-DD') OR D_DATE >= TO_DATE('2017-09-02', 'YYYY-MM-DD'))",
+                '>':  "D_DATE >= TO_DATE('2017-09-02', 'YYYY-MM-DD')",
+                '>=': "D_DATE >= TO_DATE('2017-09-01', 'YYYY-MM-DD')",
+                '<':  "D_DATE < TO_DATE('2017-09-01', 'YYYY-MM-DD')",
+                '<=': "D_DATE < TO_DATE('2017-09-02', 'YYYY-MM-DD')"}
+    for operator, predicate in expected.items():
+        newSQL = sqlDateRewriter.rewriteDatePredicates("where D_DATE {} '01-SEP-17'".format(operator), today=TODAY)[0]
+        assert newSQL == "where " + predicate
+    newSQL = sqlDateRewriter.rewriteDatePredicates("where D_DATE not between '01-JAN-20' and '02-JAN-20'", today=TODAY)[0]
+    assert newSQL == "where (D_DATE < TO_DATE('2020-01-01', 'YYYY-MM-DD') OR D_DATE >= TO_DATE('2020-01-03', 'YYYY-MM-DD'))"
+
+def test_two_digit_years():
+    ''' Two digit years fall within the past 100 years, like Oracle's RR format '''
+    assert sqlDateRewriter.parseDateLiteral("'01-JUL-18'", TODAY) == datetime.date(2018, 7, 1)
+    assert sqlDateRewriter.parseDateLiteral("'01-JUL-98'", TODAY) == datetime.date(1998, 7, 1)
+    assert sqlDateRewriter.parseDateLiteral("'31-FEB-20'", TODAY) is None
+    assert sqlDateRewriter.parseDateLiteral("'N40101'", TODAY) is None
+
+def test_explain_plan_uses_date_index():
+    ''' The rewritten queries SEARCH the date column's index; the old EXTRACT-style comparison can only SCAN the table '''
+    conn = _standInDatabase()
+    for original, expected in CORPUS:
+        steps = _planSteps(conn, sqlDateRewriter.rewriteDatePredicates(original, today=TODAY)[0])
+        assert any(step.startswith("SEARCH") and "USING INDEX IX_" in step for step in steps), steps
+
+    # bind variable version too
+    newSQL, binds, count = sqlDateRewriter.rewriteDatePredicates(CORPUS[0][0], useBinds=True, today=TODAY)
+    steps = _planSteps(conn, newSQL, {k: v.date().isoformat() for k, v in binds.items()})
+    assert any(step.startswith("SEARCH") for step in steps), steps
+
+    # what the old rewrite produced - comparing a function of the column hides the index
+    oldStyle = """select * from WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW b
+where ( strftime('%Y', b.BLOCK_STATUS_DATE) > '2017'
+or ( strftime('%Y', b.BLOCK_STATUS_DATE) = '2017' and strftime('%m', b.BLOCK_STATUS_DATE) >= '09'))"""
+    assert all(step.startswith("SCAN") for step in _planSteps(conn, oldStyle))
+
+def test_date_with_time_on_the_boundary_day():
+    ''' > and <= compare by calendar day, so a DATE with a time on the boundary day changes sides (why makeFriendlySQL is opt in) '''
+    conn = _standInDatabase()
+    conn.executemany("INSERT INTO PROT_HISTORICAL_FIRE_POLYS_SP (FIRE_NUMBER, FIRE_DATE) VALUES (?, ?)",
+                     [('N10001', '2020-01-01 00:00:00'), ('N10002', '2020-01-01 15:00:00'), ('N10003', '2020-01-02 09:30:00')])
+    for original, asWritten, rewritten in [("FIRE_DATE > '01-JAN-20'", ['N10002', 'N10003'], ['N10003']),
+                                           ("FIRE_DATE <= '01-JAN-20'", ['N10001'], ['N10001', 'N10002'])]:
+        newSQL = sqlDateRewriter.rewriteDatePredicates(original, today=TODAY)[0]
+        sqlString = "select FIRE_NUMBER from WHSE_LAND_AND_NATURAL_RESOURCE.PROT_HISTORICAL_FIRE_POLYS_SP where {} order by 1"
+        # as written, Oracle reads '01-JAN-20' as midnight on Jan 1st
+        literal = "'2020-01-01 00:00:00'"
+        assert [r[0] for r in conn.execute(sqlString.format(original.replace("'01-JAN-20'", literal)))] == asWritten
+        assert [r[0] for r in conn.execute(sqlString.format(newSQL))] == rewritten
@@ -0,0 +1,230 @@
+"""
+Benchmarks for py_spatialSQLqueries.py, run against a SpatiaLite stand-in
+(connect_to_spatialite) so no BCGW login is needed.
+
+    python py_oracle_benchmark.py aoi --vertices 10000,50000
+
+aoi - compares the old WKT path (simplify until the WKT fits in 4000 characters)
+      with the full-resolution WKB bind and a one-time generalization: time to
+      prepare the AOI, bytes bound, vertices sent, area lost, and the hits
+      and query time against a synthetic dataset around the AOI's edge.
+
+    python py_oracle_benchmark.py report --rows 10000,100000
+
+report - writes a one-sheet report of synthetic rows (in chunk_rows chunks) with the
+         old writer (pandas concat + to_excel + add_table) and with the
+         constant_memory writer (generate_report): peak memory (tracemalloc), seconds and file size.
+
+    python py_oracle_benchmark.py cache --vertices 10000
+
+cache - runs the same AOI / dataset three times through the result cache
+        (cold, warm, then --refresh): seconds, rows and AOIs read from the cache.
+
+    python py_oracle_benchmark.py decode --rows 100000,1000000
+
+decode - builds a GeoDataFrame from fetched rows (an id, a name and a WKB polygon)
+         row by row (shapely.wkb.loads per row, as for SDO_GEOMETRY objects) and
+         with to_chunk (the whole WKB column in one shapely.from_wkb call).
+"""
+
+import argparse
+import math
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+import shapely
+import shapely.affinity
+import shapely.wkb
+
+import py_spatialSQLqueries as q
+
+
+def make_aoi (vertices, radius=20000, seed=1):
+    """Returns a roughly round polygon with a wiggly, coastline-like edge and this many vertices.
+       Only the distance from the centre varies, so the polygon is always valid"""
+    rnd = random.Random(seed)
+    waves = [(rnd.uniform(0.005, 0.02), rnd.randint(20, 400), rnd.uniform(0, 2 * math.pi)) for i in range(12)]
+    points = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * (1 + sum(a * math.sin(k * angle + p) for a, k, p in waves) + rnd.uniform(-0.001, 0.001))
+        points.append((r * math.cos(angle), r * math.sin(angle)))
+    return shapely.Polygon(points)
+
+
+def make_dataset (connection, count, radius=20000, size=100, seed=2):
+    """Creates a TENURES table of small squares scattered along the AOI's edge, where simplification changes the answer"""
+    rnd = random.Random(seed)
+    connection.execute('CREATE TABLE TENURES (TENURE_ID INTEGER, SHAPE BLOB)')
+    rows = []
+    for i in range(count):
+        angle, r = rnd.uniform(0, 2 * math.pi), radius * rnd.uniform(0.96, 1.04)
+        x, y = r * math.cos(angle), r * math.sin(angle)
+        rows.append((i, shapely.box(x, y, x + size, y + size).wkt))
+    connection.executemany('INSERT INTO TENURES VALUES (?, GeomFromText(?, 3005))', rows)
+    return {'table': 'TENURES', 'geom_column': 'SHAPE', 'mask': 'ANYINTERACT'}
+
+
+def legacy_wkt (geom):
+    """The old get_wkt_srid loop: simplify from 50 m, 10 m more each pass, until the WKT fits in 4000 characters"""
+    wkt = geom.wkt
+    if len(wkt) < 4000:
+        return wkt
+    s = 50
+    wkt_sim = geom.simplify(s).wkt
+    while len(wkt_sim) > 4000:
+        s += 10
+        wkt_sim = geom.simplify(s).wkt
+    return wkt_sim
+
+
+def print_table (title, columns, rows):
+    widths = [max([len(str(c))] + [len(str(r[i])) for r in rows]) for i, c in enumerate(columns)]
+    line = '  '.join('{:>{}}'.format(c, w) for c, w in zip(columns, widths))
+    print ('\n{}\n{}\n{}'.format(title, line, '=' * len(line)))
+    for r in rows:
+        print ('  '.join('{:>{}}'.format(str(v), w) for v, w in zip(r, widths)))
+
+
+def bench_aoi (args):
+    connection = q.connect_to_spatialite()
+    dataset = make_dataset(connection, args.features)
+    q.aoi_cache_dir = tempfile.mkdtemp() # start with an empty generalization cache
+    rows = []
+    for vertices in [int(v) for v in args.vertices.split(',')]:
+        aoi = make_aoi(vertices)
+        full_wkb = shapely.to_wkb(aoi)
+        paths = [('old WKT loop', lambda: shapely.to_wkb(shapely.from_wkt(legacy_wkt(aoi)))),
+                 ('WKB bind', lambda: full_wkb),
+                 ('generalize {} m'.format(args.tolerance), lambda: q.generalize_wkb(full_wkb, args.tolerance)),
+                 ('generalize (cached)', lambda: q.generalize_wkb(full_wkb, args.tolerance))]
+        for name, prepare in paths:
+            start = time.perf_counter()
+            wkb = prepare()
+            prep_seconds = time.perf_counter() - start
+            geom = shapely.from_wkb(wkb)
+
+            start = time.perf_counter()
+            df = q.query_dataset(connection, dataset, {'aoi': wkb}, 3005, dialect='spatialite')
+            query_seconds = time.perf_counter() - start
+
+            rows.append([vertices, name, '{:.4f}'.format(prep_seconds), len(wkb), shapely.get_num_coordinates(geom),
+                         '{:.3f}'.format(100.0 * abs(geom.area - aoi.area) / aoi.area), len(df), '{:.3f}'.format(query_seconds)])
+
+    print_table ('AOI preparation ({} dataset features)'.format(args.features),
+                 ['vertices', 'path', 'prep s', 'bytes bound', 'vertices sent', 'area lost %', 'hits', 'query s'], rows)
+
+
+def make_chunks (rows, chunk_size, seed=3):
+    """Yields chunks of report rows shaped like a tenure query result"""
+    rnd = random.Random(seed)
+    for start in range(0, rows, chunk_size):
+        n = min(chunk_size, rows - start)
+        yield pd.DataFrame({'AOI_ID': ['feature {}'.format(rnd.randint(0, 50)) for i in range(n)],
+                            'INTRID_SID': range(start, start + n),
+                            'TENURE_PURPOSE': [rnd.choice(['AQUACULTURE', 'COMMERCIAL', 'UTILITY']) for i in range(n)],
+                            'TENURE_AREA_IN_HECTARES': [round(rnd.uniform(0.1, 500), 3) for i in range(n)],
+                            'TENURE_EXPIRY': pd.Timestamp('2030-01-01') + pd.to_timedelta([rnd.randint(0, 3650) for i in range(n)], unit='D')})
+
+
+def legacy_report (workspace, chunks, sheet, filename):
+    """The old generate_report: the whole result in one dataframe, then to_excel and an Excel table"""
+    df = pd.concat(list(chunks), ignore_index=True)
+    out_file = os.path.join(workspace, filename + '.xlsx')
+    writer = pd.ExcelWriter(out_file, engine='xlsxwriter')
+    df.to_excel(writer, sheet_name=sheet, startrow=1, header=False, index=False)
+    worksheet = writer.sheets[sheet]
+    col_names = [{'header': col_name} for col_name in df.columns]
+    worksheet.add_table(0, 0, df.shape[0] + 1, df.shape[1] - 1, {'columns': col_names, 'total_row': True})
+    writer.close()
+
+
+def bench_report (args):
+    workspace = tempfile.mkdtemp()
+    rows = []
+    for count in [int(r) for r in args.rows.split(',')]:
+        writers = [('old (to_excel)', lambda: legacy_report(workspace, make_chunks(count, q.chunk_rows), 'Tenures', 'old')),
+                   ('constant_memory', lambda: q.generate_report(workspace, [make_chunks(count, q.chunk_rows)], ['Tenures'], 'streamed'))]
+        for (name, write), filename in zip(writers, ['old', 'streamed']):
+            tracemalloc.start()
+            start = time.perf_counter()
+            write()
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows.append([count, name, '{:.1f}'.format(peak / 1048576.0), '{:.2f}'.format(seconds),
+                         '{:.1f}'.format(os.path.getsize(os.path.join(workspace, filename + '.xlsx')) / 1048576.0)])
+
+    print_table ('Report writer ({} rows per chunk)'.format(q.chunk_rows), ['rows', 'writer', 'peak MB', 'seconds', 'file MB'], rows)
+
+
+def bench_cache (args):
+    connection = q.connect_to_spatialite()
+    dataset = make_dataset(connection, args.features)
+    q.result_cache_dir = tempfile.mkdtemp()
+    wkb_dict = {'feature {}'.format(i): shapely.to_wkb(shapely.affinity.translate(make_aoi(int(args.vertices.split(',')[0])), i * 100))
+                for i in range(3)}
+    rows = []
+    for name, refresh in [('cold', False), ('warm', False), ('refresh', True)]:
+        cached = []
+        start = time.perf_counter()
+        hits = sum(c.shape[0] for c in q.iter_cached_dataset(connection, 'Tenures', dataset, wkb_dict, 3005, 'spatialite', refresh=refresh, cached=cached))
+        rows.append([name, '{:.3f}'.format(time.perf_counter() - start), hits, len(cached)])
+
+    print_table ('Result cache ({} AOIs, {} dataset features)'.format(len(wkb_dict), args.features), ['run', 'seconds', 'hits', 'cached AOIs'], rows)
+
+
+def make_rows (count, vertices=20, seed=4):
+    """Returns fetched-looking rows: (id, name, WKB polygon of this many vertices)"""
+    rnd = random.Random(seed)
+    ring = [(math.cos(2 * math.pi * i / vertices), math.sin(2 * math.pi * i / vertices)) for i in range(vertices)]
+    rows = []
+    for i in range(count):
+        x, y, r = rnd.uniform(0, 1e6), rnd.uniform(0, 1e6), rnd.uniform(10, 500)
+        rows.append((i, 'TENURE {}'.format(i % 1000), shapely.to_wkb(shapely.Polygon([(x + r * a, y + r * b) for a, b in ring]))))
+    return rows
+
+
+def row_by_row (rows, names, geometry_column, srid):
+    """Decodes one geometry at a time into Python lists, then builds the GeoDataFrame"""
+    records, geometries = [], []
+    for row in rows:
+        record = dict(zip(names, row))
+        geometries.append(shapely.wkb.loads(record.pop(geometry_column)))
+        records.append(record)
+    return q.gpd.GeoDataFrame(records, geometry=geometries, crs=srid)
+
+
+def bench_decode (args):
+    names = ['TENURE_ID', 'TENURE_NAME', 'SHAPE']
+    rows = []
+    for count in [int(r) for r in args.rows.split(',')]:
+        fetched = make_rows(count)
+        for name, build in [('row by row', row_by_row), ('to_chunk (vectorized)', q.to_chunk)]:
+            start = time.perf_counter()
+            gdf = build(fetched, names, 'SHAPE', 3005)
+            seconds = time.perf_counter() - start
+            rows.append([count, name, '{:.2f}'.format(seconds), '{:,.0f}'.format(count / seconds), len(gdf)])
+        del fetched, gdf
+
+    print_table ('WKB to GeoDataFrame (20-vertex polygons)', ['rows', 'decode', 'seconds', 'rows/s', 'features'], rows)
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='Benchmarks for py_spatialSQLqueries.py against a SpatiaLite stand-in')
+    parser.add_argument('benchmark', choices=['aoi', 'report', 'cache', 'decode'])
+    parser.add_argument('--vertices', default='10000,50000', help='AOI sizes (vertices), separated by commas (aoi and cache benchmarks)')
+    parser.add_argument('--rows', default='10000,100000', help='sizes (rows), separated by commas (report and decode benchmarks)')
+    parser.add_argument('--features', type=int, default=5000, help='features in the synthetic dataset')
+    parser.add_argument('--tolerance', type=float, default=5, help='generalization tolerance in m (aoi benchmark)')
+    args = parser.parse_args()
+
+    {'aoi': bench_aoi, 'report': bench_report, 'cache': bench_cache, 'decode': bench_decode}[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main ()
@@ -1,12 +1,97 @@
+import argparse
+import contextlib
+import datetime
+import functools
+import hashlib
+import json
 import os
-import cx_Oracle
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 #import fiona
 import geopandas as gpd
+import shapely
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
+
+try:
+    import cx_Oracle
+except ImportError: # only needed to connect to the BCGW; the query builders also run against SpatiaLite
+    cx_Oracle = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError: # only needed for iter_query(..., as_arrow=True) and the result cache
+    pyarrow = None
+
+
+# Datasets to screen the AOI against. Each one is a single query covering every AOI
+#  - table: BCGW table or view, always aliased as t
+#  - where: (optional) attribute filter on t
+#  - mask: SDO_RELATE mask, ex. ANYINTERACT, INSIDE, CONTAINS
+#  - columns: (optional) columns of t to return with the geometry (default: all of them)
+#  - group_by: (optional) columns of t to break the --summary counts and areas down by
+#  - freshness: (optional) query returning one value that changes when the data does,
+#    ex. "SELECT MAX(WHEN_UPDATED) FROM ...". Without one, cached hits are only kept for
+#    result_cache_ttl_no_freshness (see source_token)
+datasets = {
+    'Aquaculture Tenures': {
+        'table': 'WHSE_TANTALIS.TA_CROWN_TENURES_SVW',
+        'where': "t.TENURE_PURPOSE = 'AQUACULTURE' AND t.TENURE_STAGE = 'TENURE'",
+        'geom_column': 'SHAPE',
+        'mask': 'ANYINTERACT',
+        'group_by': ['TENURE_TYPE', 'TENURE_SUBTYPE'],
+        'freshness': "SELECT TO_CHAR(MAX(WHEN_UPDATED), 'YYYY-MM-DD HH24:MI:SS') || ' ' || COUNT(*) FROM WHSE_TANTALIS.TA_CROWN_TENURES_SVW"},
+    }
+
+# AOIs bound into one statement. Larger AOI files are sent in batches of this many
+aoi_batch_size = 100
+
+# Streaming fetch: rows per round trip (cursor.arraysize / prefetchrows) and rows per chunk yielded by iter_query
+fetch_arraysize = 5000
+fetch_prefetchrows = 5000
+chunk_rows = 50000
+
+# Sessions in the connection pool (also the most dataset queries running at once),
+# and statements each session keeps parsed
+pool_size = 4
+stmt_cache_size = 50
+
+# Report: rows sampled (from the start of each sheet) to size the columns, and the widest a column gets.
+# Sheets past Excel's row limit carry on in a new sheet, ex. 'Aquaculture Tenures (2)'
+width_sample_rows = 1000
+max_column_width = 60
+max_sheet_rows = 1048574 # 1 048 576 rows, less the header and Total rows
+
+# Generalized AOIs are kept here, so each AOI is only simplified once per tolerance
+aoi_cache_dir = os.path.join(tempfile.gettempdir(), 'py_oracle_aoi_cache')
+
+# Each AOI's hits per dataset are kept here as GeoParquet (needs pyarrow), so re-running unchanged
+# AOIs / datasets reads them from disk instead of querying again. None turns the cache off.
+# Cached hits older than result_cache_ttl seconds are queried again, or result_cache_ttl_no_freshness
+# for datasets without a 'freshness' query (their default token misses edits to the rows)
+result_cache_dir = os.path.join(tempfile.gettempdir(), 'py_oracle_result_cache')
+result_cache_ttl = 7 * 24 * 3600
+result_cache_ttl_no_freshness = 24 * 3600
+
+# --summary: SDO_GEOM tolerance (m) for the intersection areas
+sdo_tolerance = 0.005
+
+# SpatiaLite equivalents of the SDO_RELATE masks (geometry1 is the dataset's, geometry2 the AOI)
+spatialite_masks = {'ANYINTERACT': 'ST_Intersects', 'INSIDE': 'ST_Within', 'CONTAINS': 'ST_Contains',
+                    'TOUCH': 'ST_Touches', 'EQUAL': 'ST_Equals', 'OVERLAPBDYINTERSECT': 'ST_Overlaps'}
 
 
 def connect_to_DB (username,password,hostname):
     """ Returns a connection to Oracle database"""
+    if cx_Oracle is None:
+        raise Exception('cx_Oracle is not installed - it is needed to connect to the BCGW')
     try:
         connection = cx_Oracle.connect(username, password, hostname, encoding="UTF-8")
         print  ("Successffuly connected to the database")
@@ -16,6 +101,101 @@ def connect_to_DB (username,password,hostname):
     return connection
 
 
+def connect_to_spatialite (db_path=':memory:', cached_statements=None):
+    """Returns a sqlite3 connection that stands in for the BCGW in tests and benchmarks.
+       Uses mod_spatialite if this Python's sqlite3 can load it; otherwise the few
+       SpatiaLite functions the queries use are registered with shapely"""
+    connection = sqlite3.connect(db_path, check_same_thread=False, cached_statements=cached_statements or stmt_cache_size)
+    try:
+        connection.enable_load_extension(True)
+        connection.load_extension('mod_spatialite')
+    except (AttributeError, sqlite3.OperationalError):
+        connection.create_function('GeomFromWKB', 2, lambda wkb, srid: wkb)
+        connection.create_function('AsBinary', 1, lambda wkb: wkb)
+        connection.create_function('GeomFromText', 2, lambda wkt, srid: shapely.to_wkb(shapely.from_wkt(wkt)))
+        geometry = functools.lru_cache(maxsize=256)(shapely.from_wkb) # the AOI is the same for every row of a query
+        connection.create_function('ST_Intersection', 2, lambda a, b: shapely.to_wkb(shapely.intersection(geometry(a), geometry(b))))
+        connection.create_function('ST_Area', 1, lambda wkb: float(shapely.area(shapely.from_wkb(wkb))))
+        for name, predicate in [('ST_Intersects', shapely.intersects), ('ST_Within', shapely.within), ('ST_Contains', shapely.contains),
+                                ('ST_Touches', shapely.touches), ('ST_Equals', shapely.equals), ('ST_Overlaps', shapely.overlaps)]:
+            connection.create_function(name, 2, lambda a, b, predicate=predicate: int(predicate(geometry(a), geometry(b))))
+
+    return connection
+
+
+class ConnectionPool:
+    """A pool of up to 'size' connections made by 'connect' as they're needed.
+       Use oracle_pool() for the BCGW, or spatialite_pool() for a SpatiaLite stand-in"""
+
+    def __init__ (self, connect, size=4, shutdown=None):
+        self.size = size
+        self._connect = connect
+        self._shutdown = shutdown
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._connections = []
+
+    def acquire (self):
+        """Returns an idle connection, or a new one; waits while all 'size' are in use"""
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            connection = self._connect()
+        except:
+            self._slots.release()
+            raise
+        self._connections.append(connection)
+        return connection
+
+    def release (self, connection):
+        self._idle.put(connection)
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def connection (self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close (self):
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+        if self._shutdown:
+            self._shutdown()
+
+
+def oracle_pool (username, password, hostname, size=None, stmt_cache=None):
+    """Returns a ConnectionPool of BCGW sessions from a cx_Oracle SessionPool,
+       each keeping its last stmt_cache statements parsed"""
+    if cx_Oracle is None:
+        raise Exception('cx_Oracle is not installed - it is needed to connect to the BCGW')
+    size = size or pool_size
+    try:
+        session_pool = cx_Oracle.SessionPool(username, password, hostname, min=1, max=size, increment=1,
+                                             encoding="UTF-8", threaded=True, getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT)
+        print  ("Successffuly connected to the database")
+    except:
+        raise Exception('Connection failed! Please verifiy your login parameters')
+
+    def connect():
+        connection = session_pool.acquire()
+        connection.stmtcachesize = stmt_cache or stmt_cache_size
+        return connection
+
+    return ConnectionPool(connect, size, session_pool.close) # closing a pooled connection hands it back to the SessionPool
+
+
+def spatialite_pool (db_path, size=None, stmt_cache=None):
+    """Returns a ConnectionPool of SpatiaLite stand-in connections to one database file"""
+    return ConnectionPool(lambda: connect_to_spatialite(db_path, stmt_cache), size or pool_size)
+
+
 def esri_to_gdf (aoi):
     """Returns a Geopandas file (gdf) based on 
        an ESRI format vector (shp or featureclass/gdb)"""
@@ -35,89 +215,609 @@ def esri_to_gdf (aoi):
     return gdf
     
       
-def get_wkt_srid (gdf):
-    """Returns the SRID and WKT string of each feature in a gdf"""
-    
-    #gdf['wkt'] = gdf.apply(lambda row:row['geometry'].wkt, axis=1)
+def get_wkb_srid (gdf, tolerance=None):
+    """Returns the SRID and full-resolution WKB of each feature in a gdf.
+       The WKB is bound as a BLOB, so there's no VARCHAR2 length limit and
+       no need to simplify. If a tolerance (m) is given, each AOI is generalized once"""
     
     srid = gdf.crs.to_epsg()
     if srid != 3005:
         raise Exception ('Shape must be in BC Albers Projection!')
     
-    # Generate WKT strings. 
-    #If WKT string is larger then 4000 characters (ORACLE VARCHAR2 limit), 
-     # OPTION A: algorithm will simplify the geometry until limit is reached.
-    
-    wkt_dict = {}
-    for index, row in gdf.iterrows():
+    wkb_dict = {}
+    for index, wkb in zip(gdf.index, shapely.to_wkb(gdf.geometry.values)):
         f = 'feature '+ str(index) # Replace index with another ID column (name ?)
-        wkt = row['geometry'].wkt
-    
-        if len(wkt) < 4000:
-            print ('{} - FULL WKT returned: within Oracle VARCHAR limit'.format(f)) 
-            wkt_dict [f] = wkt
-            
-        else:
-            print ('Geometry will be Simplified for {} - beyond Oracle VARCHAR limit'.format (f))
-            s = 50
-            wkt_sim = row['geometry'].simplify(s).wkt
+        wkb_dict [f] = generalize_wkb(wkb, tolerance) if tolerance else wkb
+        print ('{} - {} vertices sent'.format(f, shapely.get_num_coordinates(shapely.from_wkb(wkb_dict [f]))))
+
+    return wkb_dict, srid
 
-            while len(wkt_sim) > 4000:
-                s += 10
-                wkt_sim = row['geometry'].simplify(s).wkt
 
-            print ('Geometry Simplified with Tolerance {} m'.format (s))            
-            wkt_dict [f] = wkt_sim 
-                
-            #Option B: just generate an Envelope Geometry
-            #wkt_env = row['geometry'].envelope.wkt
-            #wkt_dict [f] = wkt_env
+def generalize_wkb (wkb, tolerance):
+    """Returns the WKB of a geometry simplified with the tolerance (m), in one pass.
+       Results are cached in aoi_cache_dir by geometry hash and tolerance"""
+    key = '{}_{}'.format(hashlib.sha1(wkb).hexdigest(), tolerance)
+    cache_file = os.path.join(aoi_cache_dir, key + '.wkb')
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as f:
+            return f.read()
 
-    return wkt_dict, srid
+    simplified = shapely.to_wkb(shapely.simplify(shapely.from_wkb(wkb), float(tolerance), preserve_topology=True))
+    os.makedirs(aoi_cache_dir, exist_ok=True)
+    with open(cache_file, 'wb') as f:
+        f.write(simplified)
+    print ('Geometry Generalized with Tolerance {} m'.format (tolerance))
 
+    return simplified
 
-def read_query(connection,query):
+
+def read_query(connection,query,params=None,input_sizes=None):
     "Returns a df containing SQL Query results"
+    return pd.concat(iter_query(connection, query, params, input_sizes), ignore_index=True)
+
+
+def iter_query (connection, query, params=None, input_sizes=None, chunk_size=None,
+                arraysize=None, prefetchrows=None, geometry_column=None, srid=None, as_arrow=False):
+    """Yields the results of a query in chunks of up to chunk_size rows, so memory
+       depends on the chunk size instead of the size of the result, and the first
+       chunk is ready as soon as its rows arrive. An empty result yields one empty chunk.
+       - arraysize / prefetchrows: rows fetched per round trip (prefetchrows needs cx_Oracle 8+)
+       - geometry_column: a WKB column, decoded per chunk into a GeoDataFrame
+       - as_arrow: yield pyarrow RecordBatches instead of DataFrames"""
     cursor = connection.cursor()
     try:
-        cursor.execute(query)
+        cursor.arraysize = arraysize or fetch_arraysize
+        if hasattr(cursor, 'prefetchrows'):
+            cursor.prefetchrows = prefetchrows or fetch_prefetchrows
+        if cx_Oracle is not None and isinstance(cursor, cx_Oracle.Cursor):
+            cursor.outputtypehandler = lob_output_handler
+        if input_sizes:
+            cursor.setinputsizes(**input_sizes)
+        cursor.execute(query, params or {})
         names = [x[0] for x in cursor.description]
-        rows = cursor.fetchall()
-        return pd.DataFrame(rows, columns=names)
-    
+
+        rows = cursor.fetchmany(chunk_size or chunk_rows)
+        yield to_chunk(rows, names, geometry_column, srid, as_arrow) # an empty result still gives its columns
+        while rows:
+            rows = cursor.fetchmany(chunk_size or chunk_rows)
+            if rows:
+                yield to_chunk(rows, names, geometry_column, srid, as_arrow)
+
+    finally:
+        cursor.close()
+
+
+def lob_output_handler (cursor, name, default_type, size, precision, scale):
+    """cx_Oracle output type handler: fetches BLOBs / CLOBs (ex. SDO_UTIL.TO_WKBGEOMETRY) as bytes / str
+       with the rest of the row, instead of a LOB object and a round trip to read each one"""
+    if default_type == cx_Oracle.DB_TYPE_BLOB:
+        return cursor.var(cx_Oracle.DB_TYPE_LONG_RAW, arraysize=cursor.arraysize)
+    if default_type == cx_Oracle.DB_TYPE_CLOB:
+        return cursor.var(cx_Oracle.DB_TYPE_LONG, arraysize=cursor.arraysize)
+
+
+def to_chunk (rows, names, geometry_column=None, srid=None, as_arrow=False):
+    """Returns fetched rows as a DataFrame, a GeoDataFrame (geometry_column decoded
+       from WKB, the whole column in one shapely.from_wkb call) or a pyarrow RecordBatch"""
+    df = pd.DataFrame(rows, columns=names)
+
+    if as_arrow:
+        if pyarrow is None:
+            raise Exception ('pyarrow is not installed - it is needed for Arrow record batches')
+        return pyarrow.RecordBatch.from_pandas(df, preserve_index=False)
+
+    if geometry_column:
+        wkb = df[geometry_column].to_numpy()
+        if len(wkb) and hasattr(wkb[0], 'read'): # LOB objects, without lob_output_handler
+            wkb = [v.read() for v in wkb]
+        df[geometry_column] = shapely.from_wkb(wkb)
+        df = gpd.GeoDataFrame(df, geometry=geometry_column, crs=srid)
+
+    return df
+
+
+def dataset_columns (connection, dataset):
+    """Returns the names of a dataset's columns, from a query that returns no rows"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT t.* FROM {} t WHERE 1 = 0".format(dataset['table']))
+        return [x[0] for x in cursor.description]
+    finally:
+        cursor.close()
+
+
+def wkb_column (geom, dialect='oracle'):
+    """Returns the select-list item that sends the geometry column as WKB, under its own name"""
+    if dialect == 'oracle':
+        return "SDO_UTIL.TO_WKBGEOMETRY(t.{0}) AS {0}".format(geom)
+
+    return "AsBinary(t.{0}) AS {0}".format(geom)
+
+
+def build_aoi_query (dataset, aoi_count, dialect='oracle', columns='t.*', group_by=None):
+    """Returns one SQL statement relating a dataset to several AOIs at once.
+       The AOIs are bind variables (:aoi_id_0, :aoi_wkb_0, ...) in an 'aoi' CTE,
+       so the statement only changes with the number of AOIs, and each hit
+       comes back with the AOI_ID it intersects.
+       columns / group_by: the select list after AOI_ID, and the columns of t to group it by (see build_summary_query)
+       dialect='spatialite' gives the same query for a SpatiaLite stand-in"""
+    geom = dataset.get('geom_column', 'SHAPE')
+    mask = dataset.get('mask', 'ANYINTERACT').upper()
+
+    if dialect == 'oracle':
+        aoi_row = "SELECT :aoi_id_{0} AS AOI_ID, SDO_GEOMETRY(:aoi_wkb_{0}, :srid) AS SHAPE FROM DUAL" # WKB BLOB constructor
+        relate = "SDO_RELATE (t.{}, aoi.SHAPE, 'mask={}') = 'TRUE'".format(geom, mask)
+        hint = "/*+ ORDERED */ " # drive the join from the AOIs, so t's spatial index is used for each one
+    elif dialect == 'spatialite':
+        aoi_row = "SELECT :aoi_id_{0} AS AOI_ID, GeomFromWKB(:aoi_wkb_{0}, :srid) AS SHAPE"
+        relate = "{} (t.{}, aoi.SHAPE) = 1".format(spatialite_masks[mask], geom)
+        hint = ""
+    else:
+        raise Exception ('Unknown SQL dialect: {}'.format(dialect))
+
+    aoi_rows = "\n                UNION ALL ".join(aoi_row.format(i) for i in range(aoi_count))
+    where = "{} AND ".format(dataset['where']) if dataset.get('where') else ""
+
+    group = ""
+    if group_by is not None:
+        keys = ", ".join(["aoi.AOI_ID"] + ["t.{}".format(c) for c in group_by])
+        group = "\n            GROUP BY {0}\n            ORDER BY {0}".format(keys)
+
+    return """
+            WITH aoi AS (
+                {a})
+            SELECT {h}aoi.AOI_ID, {c}
+            FROM aoi, {t} t
+            WHERE {w}{r}{g}
+            """.format(a= aoi_rows, h= hint, c= columns, t= dataset['table'], w= where, r= relate, g= group)
+
+
+def build_summary_query (dataset, aoi_count, dialect='oracle'):
+    """Returns the --summary statement: the number of features and their area (m2) inside each AOI,
+       by the dataset's group_by columns, added up in the database so only the summary rows come back"""
+    geom = dataset.get('geom_column', 'SHAPE')
+    group_by = dataset.get('group_by', [])
+    if dialect == 'oracle':
+        area = "SDO_GEOM.SDO_AREA(SDO_GEOM.SDO_INTERSECTION(t.{0}, aoi.SHAPE, :tolerance), :tolerance, 'unit=SQ_M')".format(geom)
+    else:
+        area = "ST_Area(ST_Intersection(t.{0}, aoi.SHAPE))".format(geom)
+    columns = ", ".join(["t.{}".format(c) for c in group_by] + ["COUNT(*) AS FEATURE_COUNT", "SUM({}) AS AREA_SQ_M".format(area)])
+
+    return build_aoi_query(dataset, aoi_count, dialect, columns, group_by)
+
+
+def aoi_binds (aoi_items, srid):
+    """Returns the bind variables for build_aoi_query from (AOI id, WKB) pairs"""
+    params = {'srid': srid}
+    for i, (aoi_id, wkb) in enumerate(aoi_items):
+        params['aoi_id_{}'.format(i)] = aoi_id
+        params['aoi_wkb_{}'.format(i)] = wkb
+
+    return params
+
+
+def aoi_input_sizes (aoi_count, dialect='oracle'):
+    """Returns the input sizes that make cx_Oracle bind the WKB as BLOBs
+       (bytes are bound as RAW otherwise, which is limited to 2000 bytes in SQL)"""
+    if dialect != 'oracle' or cx_Oracle is None:
+        return None
+
+    return {'aoi_wkb_{}'.format(i): cx_Oracle.BLOB for i in range(aoi_count)}
+
+
+def iter_dataset (connection, dataset, wkb_dict, srid, dialect='oracle', chunk_size=None):
+    """Yields a dataset's features that relate to any AOI in chunks of GeoDataFrames (see iter_query),
+       with the AOI_ID of each match in the first column and the geometry last.
+       One query per batch of aoi_batch_size AOIs, instead of one per AOI.
+       The geometry is sent as WKB and decoded a chunk at a time, instead of
+       as one SDO_GEOMETRY object per row"""
+    geom = dataset.get('geom_column', 'SHAPE')
+    names = dataset.get('columns') or dataset_columns(connection, dataset)
+    columns = ", ".join(["t.{}".format(c) for c in names if c.upper() != geom.upper()] + [wkb_column(geom, dialect)])
+
+    aoi_items = list(wkb_dict.items())
+    for start in range(0, len(aoi_items), aoi_batch_size):
+        batch = aoi_items[start:start + aoi_batch_size]
+        query = build_aoi_query(dataset, len(batch), dialect, columns)
+        for chunk in iter_query(connection, query, aoi_binds(batch, srid), aoi_input_sizes(len(batch), dialect), chunk_size,
+                                geometry_column=geom, srid=srid):
+            yield chunk
+
+
+def summarize_dataset (connection, dataset, wkb_dict, srid, dialect='oracle', pushdown=True):
+    """Returns a df with the number of a dataset's features related to each AOI and the area (m2)
+       of their intersection with it, by the dataset's group_by columns (AOI_ID, *group_by, FEATURE_COUNT, AREA_SQ_M).
+       pushdown=True adds them up in the database (build_summary_query). pushdown=False fetches
+       each hit's geometry and adds them up here with shapely, one chunk at a time - the same numbers
+       (up to the database's tolerance), for checking the pushdown or for databases without SDO_GEOM"""
+    group_by = list(dataset.get('group_by', []))
+    keys = ['AOI_ID'] + group_by
+    aoi_items = list(wkb_dict.items())
+    summaries = []
+
+    for start in range(0, len(aoi_items), aoi_batch_size):
+        batch = aoi_items[start:start + aoi_batch_size]
+        params = aoi_binds(batch, srid)
+        if pushdown:
+            if dialect == 'oracle':
+                params['tolerance'] = sdo_tolerance
+            query = build_summary_query(dataset, len(batch), dialect)
+            summaries.extend(iter_query(connection, query, params, aoi_input_sizes(len(batch), dialect)))
+            continue
+
+        geom = dataset.get('geom_column', 'SHAPE')
+        columns = ", ".join(["t.{}".format(c) for c in group_by] + [wkb_column(geom, dialect)])
+        query = build_aoi_query(dataset, len(batch), dialect, columns)
+        aois = dict((aoi_id, shapely.from_wkb(wkb)) for aoi_id, wkb in batch)
+        for chunk in iter_query(connection, query, params, aoi_input_sizes(len(batch), dialect), geometry_column=geom, srid=srid):
+            areas = shapely.area(shapely.intersection(chunk.geometry.values, [aois[a] for a in chunk['AOI_ID']]))
+            chunk = pd.DataFrame(chunk[keys]).assign(FEATURE_COUNT=1, AREA_SQ_M=areas)
+            summaries.append(chunk.groupby(keys, dropna=False, as_index=False)[['FEATURE_COUNT', 'AREA_SQ_M']].sum())
+
+    df = pd.concat(summaries, ignore_index=True)
+    if not pushdown: # a group can span chunks
+        df = df.groupby(keys, dropna=False, as_index=False)[['FEATURE_COUNT', 'AREA_SQ_M']].sum()
+
+    return df.sort_values(keys, ignore_index=True)
+
+
+def source_token (connection, dataset, dialect='oracle'):
+    """Returns a value that changes when a dataset's data does, for the result cache.
+       Uses the dataset's 'freshness' query if it has one. Otherwise, on Oracle, the
+       latest LAST_DDL_TIME of the table and the objects it depends on (a view's tables),
+       which changes when they are truncated and reloaded or redefined, but not when rows
+       are inserted, updated or deleted, and only covers the tables this user can see.
+       None if there's no token (cached hits then only expire with cache_ttl)"""
+    if dataset.get('freshness'):
+        query, params = dataset['freshness'], {}
+    elif dialect == 'oracle':
+        owner, _, name = dataset['table'].upper().rpartition('.')
+        query = """
+                SELECT TO_CHAR(MAX(o.LAST_DDL_TIME), 'YYYY-MM-DD HH24:MI:SS')
+                FROM ALL_OBJECTS o
+                WHERE (o.OWNER, o.OBJECT_NAME) IN (
+                    SELECT :owner, :name FROM DUAL
+                    UNION ALL
+                    SELECT d.REFERENCED_OWNER, d.REFERENCED_NAME FROM ALL_DEPENDENCIES d
+                    WHERE d.OWNER = :owner AND d.NAME = :name)
+                """
+        params = {'owner': owner or connection.username.upper(), 'name': name}
+    else:
+        return None
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        row = cursor.fetchone()
     finally:
-        if cursor is not None:
-            cursor.close()
-   
-            
+        cursor.close()
+
+    return None if row is None or row[0] is None else str(row[0])
+
+
+def cache_ttl (dataset):
+    """Returns how many seconds a dataset's cached hits are used for: result_cache_ttl if it has
+       a 'freshness' query, otherwise the shorter result_cache_ttl_no_freshness. None or 0 never expires"""
+    if dataset.get('freshness') or not result_cache_ttl_no_freshness:
+        return result_cache_ttl
+
+    return min(result_cache_ttl or result_cache_ttl_no_freshness, result_cache_ttl_no_freshness)
+
+
+def result_cache_path (name, dataset, wkb, srid, token):
+    """Returns the cache folder of one AOI's hits in a dataset: result_cache_dir/<dataset name>/<key>,
+       where the key hashes the AOI geometry, the dataset's definition (table, where, mask ..) and the source token"""
+    definition = json.dumps({k: v for k, v in sorted(dataset.items()) if k != 'freshness'})
+    key = hashlib.sha1(b'|'.join([hashlib.sha1(wkb).digest(), str(srid).encode(), definition.encode(), str(token).encode()])).hexdigest()
+    folder = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+
+    return os.path.join(result_cache_dir, folder, key)
+
+
+def cache_frame (df):
+    """Returns a copy of a chunk Parquet can store: LOBs are read, and Oracle objects
+       (ex. SDO_GEOMETRY from t.*) become text, as they are in the report"""
+    df = df.copy()
+    geometry = df.geometry.name if isinstance(df, gpd.GeoDataFrame) else None
+    for col in df.columns:
+        if col != geometry and df[col].dtype == object:
+            df[col] = [v.read() if hasattr(v, 'read') else v if v is None or isinstance(v, (str, bytes, int, float, datetime.date)) else str(v)
+                       for v in df[col]]
+
+    return df
+
+
+def read_cached_hits (path, aoi_id):
+    """Yields the chunks of one AOI's cached hits, with its AOI_ID put back in the first column"""
+    for part in sorted(os.listdir(path)):
+        part_file = os.path.join(path, part)
+        if b'geo' in (pyarrow.parquet.read_schema(part_file).metadata or {}):
+            df = gpd.read_parquet(part_file)
+        else:
+            df = pd.read_parquet(part_file)
+        df.insert(0, 'AOI_ID', aoi_id)
+        yield df
+
+
+def iter_cached_dataset (connection, name, dataset, wkb_dict, srid, dialect='oracle', chunk_size=None, refresh=False, cached=None):
+    """Yields a dataset's hits like iter_dataset, reading each AOI's hits from the result cache
+       when they are there and younger than cache_ttl, and querying only the other AOIs.
+       Their hits are then cached (one GeoParquet file per chunk), including AOIs with no hits.
+       refresh=True queries every AOI again and replaces its cached hits.
+       The AOI ids read from the cache are appended to 'cached'"""
+    if result_cache_dir is None or pyarrow is None:
+        for chunk in iter_dataset(connection, dataset, wkb_dict, srid, dialect, chunk_size):
+            yield chunk
+        return
+
+    token, ttl = source_token(connection, dataset, dialect), cache_ttl(dataset)
+    paths, missing = {}, {}
+    for aoi_id, wkb in wkb_dict.items():
+        paths[aoi_id] = result_cache_path(name, dataset, wkb, srid, token)
+        fresh = os.path.isdir(paths[aoi_id]) and (not ttl or time.time() - os.path.getmtime(paths[aoi_id]) < ttl)
+        if refresh or not fresh:
+            missing[aoi_id] = wkb
+
+    if len(missing) < len(wkb_dict) and not dataset.get('freshness'):
+        print ("{}: {} AOI(s) read from the result cache. This dataset has no 'freshness' query, so edits made "
+               "since they were cached may be missed - run with --refresh to query again".format(name, len(wkb_dict) - len(missing)))
+
+    for aoi_id in wkb_dict:
+        if aoi_id not in missing:
+            if cached is not None:
+                cached.append(aoi_id)
+            for chunk in read_cached_hits(paths[aoi_id], aoi_id):
+                yield chunk
+    if not missing:
+        return
+
+    parts = {aoi_id: 0 for aoi_id in missing}
+    temp_dirs = {aoi_id: paths[aoi_id] + '.tmp{}-{}'.format(os.getpid(), threading.get_ident()) for aoi_id in missing}
+    try:
+        for aoi_id in missing:
+            shutil.rmtree(temp_dirs[aoi_id], ignore_errors=True)
+            os.makedirs(temp_dirs[aoi_id])
+
+        empty = None
+        for chunk in iter_dataset(connection, dataset, missing, srid, dialect, chunk_size):
+            if empty is None:
+                empty = chunk.iloc[:0].drop(columns=['AOI_ID'])
+            for aoi_id, hits in chunk.groupby('AOI_ID', sort=False):
+                cache_frame(hits.drop(columns=['AOI_ID'])).to_parquet(os.path.join(temp_dirs[aoi_id], 'part-{:05d}.parquet'.format(parts[aoi_id])), index=False)
+                parts[aoi_id] += 1
+            yield chunk
+
+        for aoi_id in missing:
+            if parts[aoi_id] == 0 and empty is not None: # no hits - cache the columns, so the AOI isn't queried again
+                cache_frame(empty).to_parquet(os.path.join(temp_dirs[aoi_id], 'part-00000.parquet'), index=False)
+            if parts[aoi_id] or empty is not None:
+                shutil.rmtree(paths[aoi_id], ignore_errors=True)
+                os.replace(temp_dirs[aoi_id], paths[aoi_id])
+
+    finally: # stopped early or failed - nothing half-written is kept
+        for aoi_id in missing:
+            shutil.rmtree(temp_dirs[aoi_id], ignore_errors=True)
+
+
+def clear_result_cache (name=None, expired_only=False):
+    """Deletes cached hits: a dataset's (by its name in 'datasets'), or every dataset's.
+       expired_only=True only deletes hits older than their dataset's cache_ttl.
+       Returns the number of AOI results deleted"""
+    if result_cache_dir is None or not os.path.isdir(result_cache_dir):
+        return 0
+    if name is None:
+        folders = [os.path.join(result_cache_dir, f) for f in os.listdir(result_cache_dir)]
+    else:
+        folders = [os.path.dirname(result_cache_path(name, {}, b'', None, None))]
+
+    folder_ttls = {os.path.dirname(result_cache_path(n, {}, b'', None, None)): cache_ttl(d) for n, d in datasets.items()}
+    deleted = 0
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        ttl = folder_ttls.get(folder, result_cache_ttl)
+        for key in os.listdir(folder):
+            path = os.path.join(folder, key)
+            if expired_only and ttl and time.time() - os.path.getmtime(path) < ttl:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            deleted += 1
+
+    return deleted
+
+
+def run_datasets (pool, selected, wkb_dict, srid, dialect='oracle', max_workers=None, timings=None, queue_chunks=2, refresh=False, summary=False):
+    """Runs each dataset's query on its own pooled connection, up to max_workers
+       (at most the pool size) at once. Returns one iterator of chunks per dataset,
+       in the order of 'selected'. Each worker holds at most queue_chunks chunks
+       until they're read, so memory stays bounded while the queries overlap.
+       Hits come from the result cache where they can (see iter_cached_dataset).
+       summary=True gives one df per dataset from summarize_dataset instead of the hits.
+       A dict per dataset (rows, AOIs read from the cache, seconds waiting for a
+       connection, seconds querying, seconds blocked until its chunks were read)
+       is appended to 'timings'. Once a reader stops early, the workers stop fetching"""
+    workers = min(max_workers or pool.size, pool.size) # more workers than connections could wait on each other
+    executor = ThreadPoolExecutor(max_workers=workers)
+    cancelled = threading.Event()
+    done = object()
+
+    def put (chunks, item):
+        """Puts an item in a dataset's queue, unless the run is cancelled.
+           Returns the seconds spent waiting for room"""
+        start = time.perf_counter()
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                break
+            except queue.Full:
+                pass
+
+        return time.perf_counter() - start
+
+    def worker (name, dataset, chunks):
+        start = time.perf_counter()
+        try:
+            with pool.connection() as connection:
+                waited, blocked, rows, cached = time.perf_counter() - start, 0.0, 0, []
+                if summary:
+                    source = iter([summarize_dataset(connection, dataset, wkb_dict, srid, dialect)])
+                else:
+                    source = iter_cached_dataset(connection, name, dataset, wkb_dict, srid, dialect, refresh=refresh, cached=cached)
+                for chunk in source:
+                    if cancelled.is_set(): # nobody will read the rest - give the connection back
+                        break
+                    rows += chunk.shape[0]
+                    blocked += put(chunks, chunk)
+                if hasattr(source, 'close'):
+                    source.close()
+            if timings is not None:
+                timings.append({'dataset': name, 'rows': rows, 'cached': len(cached), 'wait_seconds': waited,
+                                'query_seconds': time.perf_counter() - start - waited - blocked, 'blocked_seconds': blocked})
+            put(chunks, done)
+        except Exception as error:
+            put(chunks, error)
+
+    def read (chunks):
+        item = None
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=1)
+                except queue.Empty:
+                    if cancelled.is_set():
+                        return
+                    continue
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if item is not done:
+                cancelled.set() # stopped early - let the other workers finish
+
+    results = []
+    for name, dataset in selected.items():
+        chunks = queue.Queue(maxsize=queue_chunks)
+        executor.submit(worker, name, dataset, chunks)
+        results.append(read(chunks))
+    executor.shutdown(wait=False) # the submitted queries keep running
+
+    return results
+
+
+def print_timings (timings):
+    """Prints the rows and seconds of each dataset query. 'Blocked' is time the query
+       was paused because its earlier chunks hadn't been written to the report yet"""
+    print ('\n{:<32}{:>10}{:>14}{:>12}{:>12}{:>14}'.format('Dataset', 'Rows', 'Cached AOIs', 'Wait (s)', 'Query (s)', 'Blocked (s)'))
+    for t in timings:
+        print ('{:<32}{:>10}{:>14}{:>12.2f}{:>12.2f}{:>14.2f}'.format(t['dataset'][:31], t['rows'], t.get('cached', 0), t['wait_seconds'],
+                                                                    t['query_seconds'], t.get('blocked_seconds', 0)))
+
+
+def query_dataset (connection, dataset, wkb_dict, srid, dialect='oracle'):
+    """Returns a df of a dataset's features that relate to any AOI,
+       with the AOI_ID of each match in the first column"""
+    dfs = list(iter_dataset(connection, dataset, wkb_dict, srid, dialect))
+
+    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=['AOI_ID'])
+
+
+def excel_value (value):
+    """Returns a value xlsxwriter can write: blanks for nulls, text for geometries / objects
+       (WKT, or the geometry type and vertices if it's longer than an Excel cell holds)"""
+    if value is None or (isinstance(value, float) and value != value) or value is pd.NaT:
+        return None
+    if isinstance(value, (str, int, float, bool, datetime.date, datetime.datetime)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return '<{} bytes>'.format(len(value))
+    text = str(value)
+    if len(text) > 32767 and isinstance(value, shapely.Geometry):
+        return '<{} - {} vertices>'.format(value.geom_type, shapely.get_num_coordinates(value))
+    return text
+
+
+def column_widths (columns, sample):
+    """Returns column widths from the header and the first width_sample_rows rows, instead of every row"""
+    widths = []
+    for i, col_name in enumerate(columns):
+        lengths = [len(str(row[i])) for row in sample if row[i] is not None]
+        widths.append(min(max([len(str(col_name))] + lengths) + 2, max_column_width))
+
+    return widths
+
+
 def generate_report (workspace, df_list, sheet_list, filename):
-    """ Exports dataframes to multi-tab excel spreasheet"""
+    """ Exports dataframes to multi-tab excel spreasheet.
+        Each item of df_list is a dataframe, or an iterable of dataframe chunks
+        (ex. from iter_dataset). Rows are streamed to disk as each chunk arrives
+        (xlsxwriter's constant_memory mode), so memory doesn't grow with the report.
+        Sheets with no rows are left out. Returns the rows written to each sheet"""
     out_file = os.path.join(workspace, str(filename) + '.xlsx')
 
-    writer = pd.ExcelWriter(out_file,engine='xlsxwriter')
+    workbook = xlsxwriter.Workbook(out_file, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss', 'remove_timezone': True})
+    header_format = workbook.add_format({'bold': True, 'bottom': 1})
+    counts = {}
 
-    for dataframe, sheet in zip(df_list, sheet_list):
-        dataframe = dataframe.reset_index(drop=True)
-        dataframe.index = dataframe.index + 1
+    for chunks, sheet in zip(df_list, sheet_list):
+        if isinstance(chunks, pd.DataFrame):
+            chunks = [chunks]
 
-        dataframe.to_excel(writer, sheet_name=sheet, index=False, startrow=0 , startcol=0)
+        worksheet, part, nrows, total = None, 1, 0, 0
+        for dataframe in chunks:
+            for pos, row in enumerate(dataframe.itertuples(index=False, name=None)):
+                if worksheet is None or nrows == max_sheet_rows:
+                    if worksheet is not None:
+                        finish_sheet(worksheet, nrows, columns)
+                        part += 1
+                    name = sheet if part == 1 else '{} ({})'.format(sheet[:26], part)
+                    columns = list(dataframe.columns)
+                    sample = [[excel_value(v) for v in r] for r in dataframe.iloc[pos:pos + width_sample_rows].itertuples(index=False, name=None)]
+                    worksheet = workbook.add_worksheet(name)
+                    for i, width in enumerate(column_widths(columns, sample)):
+                        worksheet.set_column(i, i, width)
+                    worksheet.write_row(0, 0, columns, header_format)
+                    worksheet.freeze_panes(1, 0)
+                    nrows = 0
 
-        worksheet = writer.sheets[sheet]
+                nrows += 1
+                total += 1
+                worksheet.write_row(nrows, 0, [excel_value(v) for v in row])
 
-        worksheet.set_column(0, dataframe.shape[1], 20)
-        
-        col_names = [{'header': col_name} for col_name in dataframe.columns[1:-1]]
-        col_names.insert(0,{'header' : dataframe.columns[0], 'total_string': 'Total'})
-        col_names.append ({'header' : dataframe.columns[-1], 'total_function': 'count'})
+        counts[sheet] = total
+        if worksheet is None:
+            print ('{} table is empty - No results exported'.format(sheet))
+        else:
+            finish_sheet(worksheet, nrows, columns)
+
+    workbook.close()
+
+    return counts
 
-        worksheet.add_table(0, 0, dataframe.shape[0]+1, dataframe.shape[1]-1, {
-            'total_row': True,
-            'columns': col_names})
 
-    writer.save()
+def finish_sheet (worksheet, nrows, columns):
+    """Adds the filter buttons and a Total row (count of the last column) under a sheet's rows"""
+    last_col = len(columns) - 1
+    worksheet.autofilter(0, 0, nrows, last_col)
+    worksheet.write(nrows + 1, 0, 'Total')
+    col = xl_col_to_name(last_col)
+    worksheet.write_formula(nrows + 1, last_col, '=SUBTOTAL(103,{0}2:{0}{1})'.format(col, nrows + 1), None, nrows)
 
 
 def main ():
+    parser = argparse.ArgumentParser(description='Screens an AOI against the BCGW datasets in the "datasets" dictionary')
+    parser.add_argument('--summary', action='store_true', help='report the number and area of the features in each AOI (by group_by) instead of every feature')
+    parser.add_argument('--refresh', action='store_true', help='query every AOI again, replacing its cached hits')
+    parser.add_argument('--clear-cache', nargs='?', const='all', metavar='DATASET', help="delete the cached hits (of one dataset, or 'all') and exit")
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        deleted = clear_result_cache(None if args.clear_cache == 'all' else args.clear_cache)
+        print ('{} cached AOI results deleted from {}'.format(deleted, result_cache_dir))
+        return
+    clear_result_cache(expired_only=True)
+
     aoi = input("Enter the location of your AOI file (shp or featureclass):")
     
     hostname = 'bcgw.bcgov/idwprod1.bcgov'
@@ -125,40 +825,28 @@ def main ():
     bcgw_pwd = os.getenv('bcgw_pwd')
     
     print ('Connecting to BCGW...')
-    connection = connect_to_DB (bcgw_user,bcgw_pwd,hostname)
+    pool = oracle_pool (bcgw_user,bcgw_pwd,hostname)
     
     print ('\nReading the input file...')
     gdf = esri_to_gdf (aoi)
     
-    print ('\nGetting WKT and SRID...')
-    wkt_dict, srid = get_wkt_srid (gdf)
-    
-    sql =  """
-            SELECT*
-            FROM WHSE_TANTALIS.TA_CROWN_TENURES_SVW t
-            WHERE t.TENURE_PURPOSE = 'AQUACULTURE'
-            AND t.TENURE_STAGE = 'TENURE'
-            AND SDO_RELATE (t.SHAPE, SDO_GEOMETRY('{w}', {s}),
-                            'mask=ANYINTERACT') = 'TRUE'
-            """
-    
-    print ('\nRunning SQL...')
-    dfs = []
-    keys = []
-    for k, v in wkt_dict.items():
-        query = sql.format(w= v,  s= srid)
-        df = read_query(connection,query)
-        
-        if df.shape [0] < 1:
-            print ('Feature {} table is empy - No results exported')
-        else:
-            dfs.append(df)
-            keys.append(k)  
+    tolerance = input("Enter a tolerance (m) to generalize the AOI, or leave blank to use it at full resolution:").strip()
+
+    print ('\nGetting WKB and SRID...')
+    wkb_dict, srid = get_wkb_srid (gdf, float(tolerance) if tolerance else None)
     
-    print ('\nExporting Query Results...')
     out_loc = input("Enter an output location (folder):")
-    sheets = ['Intersect ' + k for k in keys]
-    generate_report (out_loc, dfs, sheets, 'Query_Results')
+
+    print ('\nRunning SQL and Exporting Query Results...')
+    # Up to pool_size datasets are queried at once; each one's rows are written to its sheet chunk by chunk
+    timings = []
+    results = run_datasets(pool, datasets, wkb_dict, srid, timings=timings, refresh=args.refresh, summary=args.summary)
+    sheets = [k[:31] for k in datasets] # Excel sheet names are limited to 31 characters
+    generate_report (out_loc, results, sheets, 'Query_Summary' if args.summary else 'Query_Results')
+    pool.close()
+
+    print_timings (timings)
 
 
-main ()
+if __name__ == '__main__':
+    main ()
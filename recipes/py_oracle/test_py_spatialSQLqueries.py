@@ -0,0 +1,263 @@
+'''
+test_py_spatialSQLqueries.py
+description: runs the batched AOI queries against a SpatiaLite stand-in (connect_to_spatialite) and checks them
+             against one relate per AOI / feature - no BCGW needed.
+
+run with:  python -m pytest test_py_spatialSQLqueries.py
+'''
+
+import zipfile
+
+import pytest
+import shapely
+
+import py_spatialSQLqueries as q
+
+
+def square(x, y, size):
+    return shapely.box(x, y, x + size, y + size).wkt
+
+
+def square_wkb(x, y, size):
+    return shapely.to_wkb(shapely.box(x, y, x + size, y + size))
+
+
+@pytest.fixture(autouse=True)
+def result_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(q, 'result_cache_dir', str(tmp_path / 'result_cache'))
+    return tmp_path / 'result_cache'
+
+
+@pytest.fixture
+def tenures():
+    conn = q.connect_to_spatialite()
+    conn.execute('CREATE TABLE TENURES (TENURE_ID INTEGER, TENURE_PURPOSE TEXT, TENURE_STAGE TEXT, SHAPE BLOB)')
+    features = [(i, 'AQUACULTURE' if i % 3 else 'COMMERCIAL', 'TENURE', square(i * 100, 0, 150)) for i in range(30)]
+    conn.executemany('INSERT INTO TENURES VALUES (?, ?, ?, GeomFromText(?, 3005))', features)
+    dataset = {'table': 'TENURES', 'where': "t.TENURE_PURPOSE = 'AQUACULTURE' AND t.TENURE_STAGE = 'TENURE'",
+               'geom_column': 'SHAPE', 'mask': 'ANYINTERACT'}
+    return conn, dataset, features
+
+
+def expected_hits(features, wkb_dict):
+    return sorted((aoi_id, f[0]) for aoi_id, wkb in wkb_dict.items() for f in features
+                  if f[1] == 'AQUACULTURE' and shapely.intersects(shapely.from_wkb(wkb), shapely.from_wkt(f[3])))
+
+
+def test_one_query_returns_every_aoi_hit(tenures):
+    ''' One statement for all AOIs gives the same (AOI, feature) pairs as relating each AOI on its own '''
+    conn, dataset, features = tenures
+    wkb_dict = {'feature 0': square_wkb(0, 0, 250), 'feature 1': square_wkb(1000, 50, 400), 'feature 2': square_wkb(9000, 9000, 10)}
+    df = q.query_dataset(conn, dataset, wkb_dict, 3005, dialect='spatialite')
+    assert list(df.columns[:2]) == ['AOI_ID', 'TENURE_ID']
+    assert sorted(zip(df['AOI_ID'], df['TENURE_ID'])) == expected_hits(features, wkb_dict)
+    assert df.geometry.name == 'SHAPE' and df.crs.to_epsg() == 3005 # WKB decoded into a GeoDataFrame
+    assert all(g.equals(shapely.from_wkt(features[i][3])) for g, i in zip(df.geometry, df['TENURE_ID']))
+
+
+def test_aois_are_sent_in_batches(tenures, monkeypatch):
+    ''' More AOIs than aoi_batch_size are split over several statements, with the same result '''
+    conn, dataset, features = tenures
+    wkb_dict = {'feature {}'.format(i): square_wkb(i * 250, 0, 120) for i in range(7)}
+    statements = []
+    iter_query = q.iter_query
+    monkeypatch.setattr(q, 'aoi_batch_size', 3)
+    monkeypatch.setattr(q, 'iter_query', lambda c, sql, *args, **kwargs: statements.append(sql) or iter_query(c, sql, *args, **kwargs))
+    df = q.query_dataset(conn, dataset, wkb_dict, 3005, dialect='spatialite')
+    assert len(statements) == 3
+    assert sorted(zip(df['AOI_ID'], df['TENURE_ID'])) == expected_hits(features, wkb_dict)
+
+
+def test_oracle_query_binds_the_aois():
+    ''' The Oracle statement has no AOI geometry in its text, only binds '''
+    sql = q.build_aoi_query(q.datasets['Aquaculture Tenures'], 2, columns='t.TENURE_ID, ' + q.wkb_column('SHAPE'))
+    assert 'SELECT /*+ ORDERED */ aoi.AOI_ID, t.TENURE_ID, SDO_UTIL.TO_WKBGEOMETRY(t.SHAPE) AS SHAPE' in sql
+    assert ':aoi_wkb_1' in sql and 'SDO_GEOMETRY(:aoi_wkb_0, :srid)' in sql
+    assert "SDO_RELATE (t.SHAPE, aoi.SHAPE, 'mask=ANYINTERACT') = 'TRUE'" in sql
+    assert set(q.aoi_binds([('a', b'1'), ('b', b'2')], 3005)) == {'srid', 'aoi_id_0', 'aoi_wkb_0', 'aoi_id_1', 'aoi_wkb_1'}
+
+
+def test_full_resolution_aoi_and_cached_generalization(tmp_path, monkeypatch):
+    ''' AOIs are sent at full resolution unless a tolerance is given; a generalized AOI is simplified once, then read from the cache '''
+    circle = shapely.Point(0, 0).buffer(5000, quad_segs=4000) # 16 000 vertices, far past the old 4000 character WKT limit
+    gdf = q.gpd.GeoDataFrame(geometry=[circle], crs=3005)
+    wkb_dict, srid = q.get_wkb_srid(gdf)
+    assert srid == 3005 and shapely.get_num_coordinates(shapely.from_wkb(wkb_dict['feature 0'])) == shapely.get_num_coordinates(circle)
+
+    monkeypatch.setattr(q, 'aoi_cache_dir', str(tmp_path))
+    generalized = q.get_wkb_srid(gdf, tolerance=5)[0]['feature 0']
+    assert shapely.get_num_coordinates(shapely.from_wkb(generalized)) < shapely.get_num_coordinates(circle)
+    monkeypatch.setattr(q.shapely, 'simplify', None) # a second call must not simplify again
+    assert q.get_wkb_srid(gdf, tolerance=5)[0]['feature 0'] == generalized
+
+
+def test_streaming_chunks_and_report(tenures, tmp_path):
+    ''' Results come back in chunks of chunk_size rows with the geometry decoded per chunk, and the report is written from the chunks '''
+    conn, dataset, features = tenures
+    chunks = list(q.iter_query(conn, 'SELECT TENURE_ID, AsBinary(SHAPE) AS SHAPE FROM TENURES', chunk_size=8, geometry_column='SHAPE', srid=3005))
+    assert [len(c) for c in chunks] == [8, 8, 8, 6]
+    assert chunks[0].crs.to_epsg() == 3005 and chunks[-1].geometry.iloc[-1].equals(shapely.from_wkt(features[-1][3]))
+    assert len(list(q.iter_query(conn, 'SELECT TENURE_ID FROM TENURES WHERE 0 = 1'))[0].columns) == 1
+
+    wkb_dict = {'feature {}'.format(i): square_wkb(i * 250, 0, 120) for i in range(7)}
+    results = [q.iter_dataset(conn, dataset, wkb_dict, 3005, 'spatialite', chunk_size=4), iter([])]
+    counts = q.generate_report(str(tmp_path), results, ['Tenures', 'Nothing'], 'Query_Results')
+    hits = len(expected_hits(features, wkb_dict))
+    assert counts == {'Tenures': hits, 'Nothing': 0}
+    with zipfile.ZipFile(str(tmp_path / 'Query_Results.xlsx')) as xlsx:
+        assert [n for n in xlsx.namelist() if n.startswith('xl/worksheets/sheet')] == ['xl/worksheets/sheet1.xml']
+        sheet = xlsx.read('xl/worksheets/sheet1.xml').decode()
+    assert sheet.count('<row ') == hits + 2 and 'SUBTOTAL(103' in sheet # header, rows, Total
+
+
+def test_report_rolls_over_to_a_new_sheet(tmp_path, monkeypatch):
+    ''' Rows past max_sheet_rows carry on in a new sheet; nulls, bytes and geometries are written as blanks / text '''
+    monkeypatch.setattr(q, 'max_sheet_rows', 4)
+    chunks = [q.pd.DataFrame({'ID': [1, 2, 3], 'NOTE': [None, float('nan'), b'abc'], 'SHAPE': [shapely.Point(i, 0) for i in range(3)]})] * 3
+    counts = q.generate_report(str(tmp_path), [iter(chunks)], ['Tenures'], 'Query_Results')
+    assert counts == {'Tenures': 9}
+    with zipfile.ZipFile(str(tmp_path / 'Query_Results.xlsx')) as xlsx:
+        assert [n in xlsx.read('xl/workbook.xml').decode() for n in ('"Tenures"', '"Tenures (2)"', '"Tenures (3)"')] == [True] * 3
+        sheet = xlsx.read('xl/worksheets/sheet1.xml').decode() # strings are written inline in constant_memory mode
+    assert sheet.count('<row ') == 6 and '&lt;3 bytes&gt;' in sheet and 'POINT (2 0)' in sheet
+
+
+def test_pooled_datasets_run_concurrently(tmp_path):
+    ''' Datasets run on pooled connections (never more than the pool size at once) and give the same rows as one at a time '''
+    db_path = str(tmp_path / 'tenures.sqlite')
+    conn = q.connect_to_spatialite(db_path)
+    conn.execute('CREATE TABLE TENURES (TENURE_ID INTEGER, TENURE_PURPOSE TEXT, SHAPE BLOB)')
+    conn.executemany('INSERT INTO TENURES VALUES (?, ?, GeomFromText(?, 3005))',
+                     [(i, ['AQUACULTURE', 'COMMERCIAL', 'UTILITY'][i % 3], square(i * 10, 0, 15)) for i in range(3000)])
+    conn.commit()
+    selected = {purpose: {'table': 'TENURES', 'where': "t.TENURE_PURPOSE = '{}'".format(purpose), 'geom_column': 'SHAPE'}
+                for purpose in ['AQUACULTURE', 'COMMERCIAL', 'UTILITY', 'NONE']}
+    wkb_dict = {'feature 0': square_wkb(0, 0, 20000), 'feature 1': square_wkb(5000, 0, 100)}
+
+    pool = q.spatialite_pool(db_path, size=2)
+    in_use, peak, lock = [0], [0], q.threading.Lock()
+    acquire, release = pool.acquire, pool.release
+    def counting_acquire():
+        connection = acquire()
+        with lock:
+            in_use[0] += 1
+            peak[0] = max(peak[0], in_use[0])
+        return connection
+    def counting_release(connection):
+        with lock:
+            in_use[0] -= 1
+        release(connection)
+    pool.acquire, pool.release = counting_acquire, counting_release
+
+    timings = []
+    results = q.run_datasets(pool, selected, wkb_dict, 3005, 'spatialite', max_workers=8, timings=timings)
+    for (name, dataset), chunks in zip(selected.items(), results):
+        expected = q.query_dataset(conn, dataset, wkb_dict, 3005, 'spatialite')
+        got = q.pd.concat(list(chunks), ignore_index=True)
+        assert sorted(zip(got['AOI_ID'], got['TENURE_ID'])) == sorted(zip(expected['AOI_ID'], expected['TENURE_ID']))
+    pool.close()
+    assert peak[0] <= 2 and sorted(t['dataset'] for t in timings) == sorted(selected)
+
+
+def test_slow_reader_is_not_query_time(tmp_path, monkeypatch):
+    ''' Time a worker spends waiting for the report to read its chunks is 'blocked', not query time;
+        once the reader stops early the workers stop fetching and give their connections back '''
+    db_path = str(tmp_path / 'tenures.sqlite')
+    conn = q.connect_to_spatialite(db_path)
+    conn.execute('CREATE TABLE TENURES (TENURE_ID INTEGER, TENURE_PURPOSE TEXT, SHAPE BLOB)')
+    conn.executemany('INSERT INTO TENURES VALUES (?, ?, GeomFromText(?, 3005))',
+                     [(i, ['AQUACULTURE', 'COMMERCIAL'][i % 2], square(i, 0, 1)) for i in range(2000)])
+    conn.commit()
+    selected = {purpose: {'table': 'TENURES', 'where': "t.TENURE_PURPOSE = '{}'".format(purpose), 'geom_column': 'SHAPE'}
+                for purpose in ['AQUACULTURE', 'COMMERCIAL']}
+    wkb_dict = {'feature 0': square_wkb(0, 0, 5000)}
+    monkeypatch.setattr(q, 'chunk_rows', 100)
+    monkeypatch.setattr(q, 'result_cache_dir', None)
+
+    pool, timings = q.spatialite_pool(db_path, size=2), []
+    for chunks in q.run_datasets(pool, selected, wkb_dict, 3005, 'spatialite', timings=timings):
+        for chunk in chunks:
+            q.time.sleep(0.05) # writing the sheet
+    assert len(timings) == 2
+    for t in timings:
+        assert t['rows'] == 1000 and t['blocked_seconds'] > 0.2 and t['query_seconds'] < t['blocked_seconds']
+
+    fetched, iter_cached_dataset = [], q.iter_cached_dataset
+    def counting_iter(*args, **kwargs):
+        for chunk in iter_cached_dataset(*args, **kwargs):
+            fetched.append(chunk.shape[0])
+            yield chunk
+    monkeypatch.setattr(q, 'iter_cached_dataset', counting_iter)
+    results = q.run_datasets(pool, selected, wkb_dict, 3005, 'spatialite')
+    next(results[0])
+    results[0].close() # the report stopped after one chunk
+    deadline = q.time.time() + 10
+    while pool._idle.qsize() < 2: # both workers have given their connection back
+        assert q.time.time() < deadline
+        q.time.sleep(0.05)
+    assert sum(fetched) < 2000 / 2
+    pool.close()
+
+
+def test_result_cache(tenures, monkeypatch):
+    ''' Hits are cached per AOI geometry / dataset / source token: re-runs read them from disk, and new data, refresh, the TTL or clearing the cache query again '''
+    conn, dataset, features = tenures
+    dataset = dict(dataset, freshness='SELECT COUNT(*) FROM TENURES')
+    wkb_dict = {'feature 0': square_wkb(0, 0, 250), 'feature 1': square_wkb(9000, 9000, 10)} # feature 1 has no hits
+    def run(wkb_dict, **kwargs):
+        cached = []
+        df = q.pd.concat(list(q.iter_cached_dataset(conn, 'Aquaculture Tenures', dataset, wkb_dict, 3005, 'spatialite', cached=cached, **kwargs)), ignore_index=True)
+        return sorted(zip(df['AOI_ID'], df['TENURE_ID'])), cached
+
+    assert run(wkb_dict) == (expected_hits(features, wkb_dict), [])
+    iter_dataset = q.iter_dataset
+    monkeypatch.setattr(q, 'iter_dataset', None) # everything must come from the cache now
+    assert run(wkb_dict) == (expected_hits(features, wkb_dict), ['feature 0', 'feature 1'])
+    renamed = {'another name': wkb_dict['feature 0']} # keyed on the geometry, not the AOI id
+    assert run(renamed) == (expected_hits(features, renamed), ['another name'])
+    monkeypatch.setattr(q, 'iter_dataset', iter_dataset)
+
+    assert run(wkb_dict, refresh=True)[1] == []
+    conn.execute("INSERT INTO TENURES VALUES (99, 'AQUACULTURE', 'TENURE', GeomFromText(?, 3005))", (square(9000, 9000, 5),))
+    new_features = features + [(99, 'AQUACULTURE', 'TENURE', square(9000, 9000, 5))]
+    assert run(wkb_dict) == (expected_hits(new_features, wkb_dict), []) # the source token changed
+    monkeypatch.setattr(q, 'result_cache_ttl', 1e-9)
+    assert run(wkb_dict)[1] == []
+    monkeypatch.setattr(q, 'result_cache_ttl', 3600)
+
+    assert q.clear_result_cache('Aquaculture Tenures') == 4 and run(wkb_dict)[1] == []
+
+
+def test_result_cache_without_freshness(tenures, monkeypatch, capsys):
+    ''' Datasets without a freshness query keep cached hits for the shorter TTL, and say so when they're used '''
+    conn, dataset, features = tenures
+    wkb_dict = {'feature 0': square_wkb(0, 0, 250)}
+    def run():
+        cached = []
+        list(q.iter_cached_dataset(conn, 'Aquaculture Tenures', dataset, wkb_dict, 3005, 'spatialite', cached=cached))
+        return cached
+
+    assert all(d.get('freshness') for d in q.datasets.values())
+    assert q.cache_ttl(dataset) == 24 * 3600 and q.cache_ttl(dict(dataset, freshness='SELECT 1')) == 7 * 24 * 3600
+    assert run() == [] and 'freshness' not in capsys.readouterr().out
+    assert run() == ['feature 0'] and "no 'freshness' query" in capsys.readouterr().out
+    monkeypatch.setattr(q, 'result_cache_ttl_no_freshness', 1e-9) # result_cache_ttl is still 7 days
+    assert run() == []
+
+
+def test_summary_pushdown_matches_client_side(tenures):
+    ''' The counts and areas added up in the database are the same as adding up the fetched hits, per AOI and group_by value '''
+    conn, dataset, features = tenures
+    dataset = dict(dataset, where=None, group_by=['TENURE_PURPOSE'])
+    wkb_dict = {'feature 0': square_wkb(0, 0, 250), 'feature 1': square_wkb(1000, 50, 400), 'feature 2': square_wkb(9000, 9000, 10)}
+    server = q.summarize_dataset(conn, dataset, wkb_dict, 3005, 'spatialite')
+    client = q.summarize_dataset(conn, dataset, wkb_dict, 3005, 'spatialite', pushdown=False)
+    assert list(server.columns) == ['AOI_ID', 'TENURE_PURPOSE', 'FEATURE_COUNT', 'AREA_SQ_M']
+    assert server[['AOI_ID', 'TENURE_PURPOSE', 'FEATURE_COUNT']].values.tolist() == client[['AOI_ID', 'TENURE_PURPOSE', 'FEATURE_COUNT']].values.tolist()
+    assert server['AREA_SQ_M'].tolist() == pytest.approx(client['AREA_SQ_M'].tolist(), rel=1e-9)
+
+    aoi = shapely.from_wkb(wkb_dict['feature 0'])
+    hits = [f for f in features if f[1] == 'COMMERCIAL' and aoi.intersects(shapely.from_wkt(f[3]))]
+    row = server[(server['AOI_ID'] == 'feature 0') & (server['TENURE_PURPOSE'] == 'COMMERCIAL')].iloc[0]
+    assert row['FEATURE_COUNT'] == len(hits) and row['AREA_SQ_M'] == pytest.approx(sum(aoi.intersection(shapely.from_wkt(f[3])).area for f in hits))
+    assert 'SDO_GEOM.SDO_AREA(SDO_GEOM.SDO_INTERSECTION(t.SHAPE, aoi.SHAPE, :tolerance)' in q.build_summary_query(dataset, 1)
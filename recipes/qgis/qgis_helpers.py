@@ -2,18 +2,33 @@
 # description: some helpers for qgis standalone python scripts
 import sys
 import os
+import json
+import tempfile
+import threading
+import time
 import qgis_set_environment
 from osgeo import ogr
 from qgis.PyQt.QtSql import QSqlDatabase, QSqlQuery 
 
+# table metadata (geometry column, geometry type, key column, srid) is cached here by OWNER.TABLE,
+# so loading a layer again doesn't query the catalog. Entries older than METADATA_TTL seconds are looked up again
+METADATA_CACHE = os.path.join(tempfile.gettempdir(), 'bcgw_metadata_cache.json')
+METADATA_TTL = 7 * 24 * 3600
+BCGW_HOST = 'bcgw.bcgov' + "/" + 'idwprod1.bcgov'
+
+_metadata_lock = threading.Lock()
+
 def create_oracle_layer(layer_name,user_name,user_pass,db_table,geom_column_name,sql=None,geom_type=None,key='OBJECTID'):
     # create an QgsVector from oracle table
     uri = QgsDataSourceUri()
     uri.setConnection('bcgw.bcgov', '1521','idwprod1.bcgov', user_name, user_pass)
     schema, table = db_table.split('.')
-    geom_c = get_bcgw_geomcolumn(db_table=db_table,user_name=user_name,user_pass=user_pass)
-    geom_type = get_bcgw_table_geomtype(db_table=db_table,geom_column_name=geom_c,user_name=user_name,user_pass=user_pass)
-    key = get_bcgw_column_key(db_table=db_table,user_name=user_name,user_pass=user_pass)
+    # geometry column, type, key and srid come from the metadata cache - the catalog is only queried the first time
+    metadata = get_bcgw_table_metadata(db_table=db_table,user_name=user_name,user_pass=user_pass)
+    geom_c = metadata['geom_column']
+    geom_type = metadata['geom_type']
+    key = metadata['key_column']
+    crs = get_bcgw_crs(metadata['srid'])
     if sql is not None:
         if len(sql)>0:
             if 'WHERE' in sql.upper():
@@ -25,7 +40,7 @@ def create_oracle_layer(layer_name,user_name,user_pass,db_table,geom_column_name
     else:
         uri.setDataSource(schema, table, geom_column_name,key)
     
-    uri.setSrid('EPSG:3005')
+    uri.setSrid(crs.authid())
     
     uri.setUseEstimatedMetadata(True)
     uri.setKeyColumn(key)
@@ -47,27 +62,53 @@ def create_oracle_layer(layer_name,user_name,user_pass,db_table,geom_column_name
 
     tlayer = QgsVectorLayer(uri.uri(), layer_name, 'oracle')
     assert tlayer.isValid()
-    tlayer.setCrs(QgsCoordinateReferenceSystem("EPSG:3005"))
+    tlayer.setCrs(crs)
     
     return tlayer
 
-def get_bcgw_table_geomtype(db_table,geom_column_name,user_name,user_pass):
-    # get geometry type from oracle table - oracle stores multiple types so
-    # this returns the maximum type ie multiline, multipolygon, multipoint if
-    # present in geometry
-    owner,table = db_table.split('.') 
+def get_bcgw_crs(srid):
+    # return the QgsCoordinateReferenceSystem for an srid - oracle srids aren't always epsg codes
+    # (ex. 8307, 90112), so anything qgis doesn't know as an epsg code falls back to EPSG:3005
+    crs = QgsCoordinateReferenceSystem(f"EPSG:{srid}") if srid else QgsCoordinateReferenceSystem()
+    if not crs.isValid():
+        print (f"SRID {srid} is not a known EPSG code, using EPSG:3005")
+        crs = QgsCoordinateReferenceSystem("EPSG:3005")
+    return crs
+
+def get_bcgw_connection(user_name,user_pass):
+    # return an open QOCISPATIAL connection to the bcgw - one per user and thread (QSqlDatabase
+    # connections can only be used from the thread that made them), opened the first time and
+    # then reused for the rest of the session. close with close_bcgw_connections()
     driver ="QOCISPATIAL"
-    conn_name = "bcgw_conn"
-    if not QSqlDatabase.contains(conn_name):
-        db = QSqlDatabase.addDatabase(driver,conn_name)
+    conn_name = f"bcgw_conn_{user_name}_{threading.get_ident()}"
+    if QSqlDatabase.contains(conn_name):
+        db = QSqlDatabase.database(conn_name, False)
+        if db.isOpen():
+            return db
     else:
-        db = QSqlDatabase.database(conn_name)
-    db.setDatabaseName('bcgw.bcgov' + "/" + 'idwprod1.bcgov') 
+        db = QSqlDatabase.addDatabase(driver,conn_name)
+    db.setDatabaseName(BCGW_HOST) 
     db.setUserName(user_name) 
     db.setPassword(user_pass) 
-    db.open()
     if not db.open(): 
-        print ("Failed Connection from find_bcgw_the_geom") 
+        print (f"Failed Connection from get_bcgw_connection: {db.lastError().text()}") 
+    return db
+
+def close_bcgw_connections():
+    # close and remove the pooled bcgw connections (ex. at the end of a script)
+    for conn_name in QSqlDatabase.connectionNames():
+        if conn_name.startswith('bcgw_conn_'):
+            db = QSqlDatabase.database(conn_name, False)
+            db.close()
+            del db
+            QSqlDatabase.removeDatabase(conn_name)
+
+def get_bcgw_table_geomtype(db_table,geom_column_name,user_name,user_pass):
+    # get geometry type from oracle table - oracle stores multiple types so
+    # this returns the maximum type ie multiline, multipolygon, multipoint if
+    # present in geometry
+    owner,table = db_table.split('.') 
+    db = get_bcgw_connection(user_name,user_pass)
     q = QSqlQuery(db) 
     query = f"SELECT MAX(t.{geom_column_name}.GET_GTYPE()) AS geometry_type from {owner}.{table} t"
     q.exec(query) 
@@ -86,49 +127,24 @@ def get_bcgw_table_geomtype(db_table,geom_column_name,user_name,user_pass):
     elif type_num ==6:
         geom_t = 'MultiLineString'
     else:
-        db.close()
         raise TypeError
-    db.close()
     return geom_t
 
 def get_bcgw_geomcolumn(db_table,user_name,user_pass):
     # get the name of the geometry column for oracle table
     owner,table = db_table.split('.') 
-    driver ="QOCISPATIAL" 
-    conn_name = "bcgw_conn"
-    if not QSqlDatabase.contains(conn_name):
-        db = QSqlDatabase.addDatabase(driver,conn_name)
-    else:
-        db = QSqlDatabase.database(conn_name)
-    db.setDatabaseName('bcgw.bcgov' + "/" + 'idwprod1.bcgov') 
-    db.setUserName(user_name) 
-    db.setPassword(user_pass) 
-    db.open()
-    if not db.open(): 
-        print ("Failed Connection from find_bcgw_the_geom") 
+    db = get_bcgw_connection(user_name,user_pass)
     q = QSqlQuery(db) 
     query ="SELECT COLUMN_NAME from all_tab_columns where OWNER = '{}' AND TABLE_NAME = '{}' AND DATA_TYPE = 'SDO_GEOMETRY'".format(owner,table)  
     q.exec(query) 
     q.first() 
     geom_c = q.value(0)
-    db.close()
     return geom_c
 
 def get_bcgw_column_key(db_table,user_name,user_pass):
     # estimate a unique id column for an oracle table if OBJECTID does not exist
     owner,table = db_table.split('.') 
-    driver ="QOCISPATIAL" 
-    conn_name = "bcgw_conn"
-    if not QSqlDatabase.contains(conn_name):
-        db = QSqlDatabase.addDatabase(driver,conn_name)
-    else:
-        db = QSqlDatabase.database(conn_name)
-    db.setDatabaseName('bcgw.bcgov' + "/" + 'idwprod1.bcgov') 
-    db.setUserName(user_name) 
-    db.setPassword(user_pass) 
-    db.open()
-    if not db.open(): 
-        print ("Failed Connection from find_bcgw_the_geom") 
+    db = get_bcgw_connection(user_name,user_pass)
     q = QSqlQuery(db)
     sql = f"SELECT cols.column_name \
     FROM all_tab_cols cols where cols.table_name = '{table}' and cols.COLUMN_NAME like \'OBJECTID\'"
@@ -141,9 +157,73 @@ def get_bcgw_column_key(db_table,user_name,user_pass):
         q.exec(sql)
         if q.first():
             key_c = q.value(0)
-    db.close()
     return key_c
 
+def get_bcgw_srid(db_table,geom_column_name,user_name,user_pass):
+    # get the srid of an oracle table's geometry column from the spatial metadata (None if it isn't registered).
+    # oracle's own srids (ex. 8307) are mapped to their epsg code where oracle knows one
+    owner,table = db_table.split('.') 
+    db = get_bcgw_connection(user_name,user_pass)
+    q = QSqlQuery(db)
+    query = f"SELECT m.SRID, MDSYS.SDO_CS.MAP_ORACLE_SRID_TO_EPSG(m.SRID) FROM all_sdo_geom_metadata m \
+    WHERE m.OWNER = '{owner}' AND m.TABLE_NAME = '{table}' AND m.COLUMN_NAME = '{geom_column_name}'"
+    q.exec(query)
+    if q.first() and q.value(0):
+        return int(q.value(1) or q.value(0))
+    return None
+
+def get_bcgw_table_metadata(db_table,user_name,user_pass,refresh=False):
+    # return the geometry column, geometry type, key column and srid of an oracle table, from
+    # METADATA_CACHE if it was looked up less than METADATA_TTL seconds ago; otherwise from the
+    # catalog (on the pooled connection), saved to the cache. refresh=True always looks it up again
+    table_key = db_table.upper()
+    with _metadata_lock:
+        cache = read_metadata_cache()
+    entry = cache.get(table_key)
+    if entry and not refresh and time.time() - entry['cached'] < METADATA_TTL:
+        return entry
+
+    geom_c = get_bcgw_geomcolumn(db_table=db_table,user_name=user_name,user_pass=user_pass)
+    entry = {'geom_column': geom_c,
+             'geom_type': get_bcgw_table_geomtype(db_table=db_table,geom_column_name=geom_c,user_name=user_name,user_pass=user_pass),
+             'key_column': get_bcgw_column_key(db_table=db_table,user_name=user_name,user_pass=user_pass),
+             'srid': get_bcgw_srid(db_table=db_table,geom_column_name=geom_c,user_name=user_name,user_pass=user_pass),
+             'cached': time.time()}
+    with _metadata_lock:
+        cache = read_metadata_cache() # another script may have added tables since
+        cache[table_key] = entry
+        write_metadata_cache(cache)
+    return entry
+
+def read_metadata_cache():
+    # read the metadata cache file (empty if it doesn't exist or can't be read)
+    if not os.path.exists(METADATA_CACHE):
+        return {}
+    try:
+        with open(METADATA_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError) as error:
+        print (f"Ignoring metadata cache {METADATA_CACHE}: {error}")
+        return {}
+
+def write_metadata_cache(cache):
+    # write the metadata cache to a temporary file first, so a reader never sees half a file
+    temp_file = f"{METADATA_CACHE}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(temp_file, METADATA_CACHE)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def clear_metadata_cache(db_table=None):
+    # forget the cached metadata of one table (OWNER.TABLE), or of every table
+    with _metadata_lock:
+        cache = read_metadata_cache() if db_table is not None else {}
+        cache.pop(str(db_table).upper(), None)
+        write_metadata_cache(cache)
+
 def create_gpkg(root,name,overwrite=False):
     # create an empty geopackage
     fullpath = os.path.join(root,name)
@@ -0,0 +1,119 @@
+'''
+test_qgis_helpers.py
+description: checks qgis_helpers' table metadata cache (TTL, refresh, clearing, atomic writes) and the EPSG:3005
+             fallback for oracle srids - with stand-ins for the catalog queries, no QGIS session or BCGW needed.
+
+run with:  python -m pytest test_qgis_helpers.py
+'''
+
+import importlib.util
+import json
+import os
+import sys
+import types
+
+import pytest
+
+if importlib.util.find_spec('qgis') is None:
+    # qgis_helpers needs QGIS_PATH and qgis only for its imports here - stand in for them
+    qtsql = types.ModuleType('qgis.PyQt.QtSql')
+    qtsql.QSqlDatabase, qtsql.QSqlQuery = object, object
+    osgeo = types.ModuleType('osgeo')
+    osgeo.ogr = None
+    for name, module in [('qgis_set_environment', types.ModuleType('qgis_set_environment')), ('osgeo', osgeo),
+                         ('qgis', types.ModuleType('qgis')), ('qgis.PyQt', types.ModuleType('qgis.PyQt')), ('qgis.PyQt.QtSql', qtsql)]:
+        sys.modules.setdefault(name, module)
+
+import qgis_helpers as h
+
+
+class StandInCrs:
+    # knows the EPSG codes in 'known', like QgsCoordinateReferenceSystem does with the proj database
+    known = ['EPSG:3005', 'EPSG:4326']
+
+    def __init__(self, definition=''):
+        self.definition = definition
+
+    def isValid(self):
+        return self.definition in self.known
+
+    def authid(self):
+        return self.definition if self.isValid() else ''
+
+
+@pytest.fixture(autouse=True)
+def metadata_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(h, 'METADATA_CACHE', str(tmp_path / 'bcgw_metadata_cache.json'))
+    return tmp_path / 'bcgw_metadata_cache.json'
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    # stand-ins for the catalog queries; counts how often each table is looked up
+    counts = {}
+
+    def geomcolumn(db_table, user_name, user_pass):
+        counts[db_table] = counts.get(db_table, 0) + 1
+        return 'SHAPE'
+
+    monkeypatch.setattr(h, 'get_bcgw_geomcolumn', geomcolumn)
+    monkeypatch.setattr(h, 'get_bcgw_table_geomtype', lambda db_table, geom_column_name, user_name, user_pass: 'MultiPolygon')
+    monkeypatch.setattr(h, 'get_bcgw_column_key', lambda db_table, user_name, user_pass: 'OBJECTID')
+    monkeypatch.setattr(h, 'get_bcgw_srid', lambda db_table, geom_column_name, user_name, user_pass: 3005)
+    return counts
+
+
+def test_metadata_is_cached_for_its_ttl(lookups, monkeypatch):
+    ''' A table is looked up once, then read from the cache until METADATA_TTL has passed or refresh=True '''
+    now = [1000000.0]
+    monkeypatch.setattr(h.time, 'time', lambda: now[0])
+    table = 'WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW'
+    entry = h.get_bcgw_table_metadata(table, 'user', 'pass')
+    assert {k: entry[k] for k in ('geom_column', 'geom_type', 'key_column', 'srid')} == {
+        'geom_column': 'SHAPE', 'geom_type': 'MultiPolygon', 'key_column': 'OBJECTID', 'srid': 3005}
+
+    now[0] += h.METADATA_TTL - 1
+    assert h.get_bcgw_table_metadata(table.lower(), 'user', 'pass') == entry
+    assert lookups == {table: 1}
+
+    h.get_bcgw_table_metadata(table, 'user', 'pass', refresh=True)
+    assert lookups == {table: 2}
+    now[0] += h.METADATA_TTL
+    assert h.get_bcgw_table_metadata(table, 'user', 'pass')['cached'] == now[0]
+    assert lookups == {table: 3}
+
+
+def test_clear_metadata_cache(lookups):
+    ''' clear_metadata_cache(OWNER.TABLE) forgets one table (any case); with no table it forgets them all '''
+    tables = ['WHSE_FOREST_TENURE.FTEN_CUT_BLOCK_POLY_SVW', 'WHSE_TANTALIS.TA_CROWN_TENURES_SVW', 'WHSE_BASEMAPPING.FWA_LAKES_POLY']
+    for table in tables:
+        h.get_bcgw_table_metadata(table, 'user', 'pass')
+
+    h.clear_metadata_cache('whse_tantalis.ta_crown_tenures_svw')
+    assert sorted(h.read_metadata_cache()) == sorted([tables[0], tables[2]])
+    h.clear_metadata_cache()
+    assert h.read_metadata_cache() == {}
+    h.get_bcgw_table_metadata(tables[0], 'user', 'pass')
+    assert lookups[tables[0]] == 2
+
+
+def test_cache_file_is_replaced_in_one_step(metadata_cache):
+    ''' A write that fails leaves the old cache and no temporary file; a broken cache file reads as empty '''
+    h.write_metadata_cache({'A.B': {'srid': 3005}})
+    with pytest.raises(TypeError):
+        h.write_metadata_cache({'A.B': {'srid': object()}})
+    assert h.read_metadata_cache() == {'A.B': {'srid': 3005}}
+    assert os.listdir(metadata_cache.parent) == [metadata_cache.name]
+
+    metadata_cache.write_text('{"A.B": {"srid": ')
+    assert h.read_metadata_cache() == {}
+    h.write_metadata_cache({'C.D': {'srid': 4326}})
+    assert json.loads(metadata_cache.read_text()) == {'C.D': {'srid': 4326}}
+
+
+def test_srids_that_are_not_epsg_codes_fall_back_to_3005(monkeypatch):
+    ''' EPSG codes are used as they are; oracle-only srids (ex. 90112) and missing srids become EPSG:3005 '''
+    monkeypatch.setattr(h, 'QgsCoordinateReferenceSystem', StandInCrs, raising=False)
+    assert h.get_bcgw_crs(4326).authid() == 'EPSG:4326'
+    assert h.get_bcgw_crs(90112).authid() == 'EPSG:3005'
+    assert h.get_bcgw_crs(None).authid() == 'EPSG:3005'